@@ -1,17 +1,73 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 import requests
 import os
 from dotenv import load_dotenv
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend to avoid GUI errors
-import matplotlib.pyplot as plt
-import networkx as nx   
 import time
 import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
+from distance_providers import (
+    GraphHopperDistanceProvider, HaversineDistanceProvider, MatrixError,
+    PROVIDER_NAMES, matrix_to_list, parse_circuity, resolve_provider_name,
+)
+from geocoding import GeocodeCache, Geocoder, GraphHopperProvider
+from matrix_cache import MatrixCache
+from upstream import client_from_env
+from visualization import RenderQueue
+
+# Scenario wire format shared with the model service (pip install -e shared)
+from logistics_shared import wire_format
+
+load_dotenv()
 
 app = Flask(__name__)
-MODEL_URL = "http://127.0.0.1:6000/solve" 
+
+# --- Upstream clients (pooled sessions, per-upstream timeouts and retries) ---
+GRAPHHOPPER = client_from_env("graphhopper", "GRAPHHOPPER", "https://graphhopper.com/api/1",
+                              default_timeout=20, default_retries=2)
+# Matrix tiles are retried one by one in GraphHopperDistanceProvider; a
+# retrying session underneath would multiply the attempts per tile
+GRAPHHOPPER_MATRIX = GRAPHHOPPER.without_retries()
+MODEL = client_from_env("model", "MODEL", "http://127.0.0.1:6000/solve",
+                        default_timeout=30, default_retries=0)
+MODEL_URL = MODEL.url()
+
+# /optimize should answer within OPTIMIZE_BUDGET_SECONDS (default: the model
+# read timeout). Every model call gets whatever budget is left, minus a margin
+# for its own overhead and the response, as budget_ms: a hard cap after which
+# the model returns the plan it has. The model only runs an anytime search
+# when the request sends deadline_ms, or when MODEL_DEADLINE_MS opts every
+# request in; that deadline is cut to the same budget.
+OPTIMIZE_BUDGET = float(os.getenv("OPTIMIZE_BUDGET_SECONDS", str(MODEL.timeout[1])))
+MODEL_DEADLINE_MS = float(os.getenv("MODEL_DEADLINE_MS")) if os.getenv("MODEL_DEADLINE_MS") else None
+MODEL_DEADLINE_MARGIN = float(os.getenv("MODEL_DEADLINE_MARGIN", "1.0"))
+
+# Persistent per-pair cache in front of the GraphHopper matrix API
+MATRIX_CACHE = MatrixCache()
+
+# Matrix tiles beyond the upstream point limit are fetched on their own pool,
+# whose size caps concurrent matrix requests across all /optimize calls
+MATRIX_TILE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("GRAPHHOPPER_MATRIX_CONCURRENCY", "4")),
+                                      thread_name_prefix="matrix-tile")
+
+# Offline distance engine, used when there is no API key or on request
+HAVERSINE = HaversineDistanceProvider(circuity=parse_circuity(os.getenv("ROAD_CIRCUITY_FACTORS")))
+
+GEOCODE_CACHE = GeocodeCache()
+
+# Route images are rendered in the background and fetched from /render/<id>
+RENDERS = RenderQueue(max_workers=int(os.getenv("RENDER_WORKERS", "2")),
+                      max_pending=int(os.getenv("RENDER_MAX_PENDING", "16")))
+
+# "npz": compact binary scenario; "json": the original routes-list payload.
+# json stays the default so a backend deployed ahead of the model service
+# keeps working; switch to npz once both run the same version.
+MODEL_WIRE_FORMAT = os.getenv("MODEL_WIRE_FORMAT", "json").lower()
+
+# Matrix and VRP requests are independent, so each /optimize runs them side by side
+UPSTREAM_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_WORKERS", "8")),
+                                   thread_name_prefix="upstream")
 
 def prepare_and_send_to_model(backend_json, graphhopper_result, distance_matrix):
     """
@@ -64,78 +120,61 @@ def prepare_and_send_to_model(backend_json, graphhopper_result, distance_matrix)
 
     return payload
 
+def prepare_compact_scenario(backend_json, distance_matrix):
+    """
+    Same scenario as prepare_and_send_to_model in the compact index-based
+    format (see logistics_shared/wire_format.py): the matrix travels as one float32
+    array instead of N^2 route dicts. Both distance providers return road
+    or great-circle shortest distances, so the matrix is marked metric.
+    """
+    distance_matrix = np.asarray(distance_matrix, dtype=np.float32)
+    n = len(distance_matrix)
+
+    names = [backend_json.get("source", "")] + backend_json.get("destinations", [])
+    locations = [str(names[i]) if i < len(names) and names[i] else f"Location {i}" for i in range(n)]
+
+    loads = backend_json.get("loads", [])
+    packages = {
+        "id": list(range(len(loads))),
+        "pickup": [0] * len(loads),
+        "delivery": [min(i + 1, n - 1) for i in range(len(loads))],
+        "weight": loads,
+        "priority": [1] * len(loads),
+    }
+    vehicles = {
+        "id": [0],
+        "capacity": [backend_json.get("vehicle_capacity", 1000)],
+        "location": [0],
+        "speed": [1.0],
+        "cost_per_km": [1.0],
+    }
+    return {
+        "format": wire_format.COMPACT_FORMAT,
+        "locations": locations,
+        "distance_matrix": distance_matrix,
+        "metric": True,
+        "packages": packages,
+        "vehicles": vehicles,
+    }
+
 # Example usage after backend GraphHopper processing:
 # backend_json = {...}  # your JSON from frontend
 # graphhopper_result = {...}  # result from GraphHopper
 # model_output = prepare_and_send_to_model(backend_json, graphhopper_result)
 # print(model_output)
 
-# --- Visualization Helpers ---
-def visualize_distance_matrix_graph(locations, distance_matrix, filename="distance_matrix_graph.png"):
-    plt.figure(figsize=(12, 12))
-    G = nx.Graph()
-    edge_labels = {}
-    for i in range(len(locations)):
-        for j in range(i + 1, len(locations)):
-            if distance_matrix[i][j] is not None:
-                G.add_edge(i, j, weight=distance_matrix[i][j])
-                edge_labels[(i, j)] = f"{distance_matrix[i][j]} km"
-    pos = nx.spring_layout(G, seed=42)
-    nx.draw_networkx_nodes(G, pos, node_color='skyblue', node_size=700)
-    nx.draw_networkx_labels(G, pos)
-    nx.draw_networkx_edges(G, pos, alpha=0.5, edge_color='gray')
-    nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_color='red', font_size=8)
-    nx.draw_networkx_nodes(G, pos, nodelist=[0], node_color='green', node_size=800, label='Node 0 (Origin)')
-    plt.title("Direct Routes and Distances Between All Nodes")
-    plt.legend()
-    plt.savefig(filename)
-    plt.close()
-
-def visualize_complete_graph(locations, distance_matrix, optimized_path, filename="optimized_route_graph.png"):
-    plt.figure(figsize=(12, 12))
-    G = nx.Graph()
-    edge_labels = {}
-    for i in range(len(locations)):
-        for j in range(i + 1, len(locations)):
-            if distance_matrix[i][j] is not None:
-                G.add_edge(i, j, weight=distance_matrix[i][j])
-                edge_labels[(i, j)] = f"{distance_matrix[i][j]} km"
-    pos = nx.spring_layout(G, seed=42)
-    nx.draw_networkx_nodes(G, pos, node_color='skyblue', node_size=700)
-    nx.draw_networkx_labels(G, pos)
-    nx.draw_networkx_edges(G, pos, alpha=0.5, edge_color='gray')
-    nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_color='red', font_size=8)
-    nx.draw_networkx_nodes(G, pos, nodelist=[optimized_path[0]], node_color='green', node_size=800, label='Origin')
-    nx.draw_networkx_nodes(G, pos, nodelist=[optimized_path[-1]], node_color='red', node_size=800, label='Destination')
-    route_edges = list(zip(optimized_path, optimized_path[1:]))
-    nx.draw_networkx_edges(G, pos, edgelist=route_edges, edge_color='black', width=2.5, arrows=True, arrowstyle='->', arrowsize=20)
-    plt.title("Complete Network Graph with Optimized Route")
-    plt.legend()
-    plt.savefig(filename)
-    plt.close()
-
 # --- GraphHopper Helpers ---
-def get_distance_matrix_graphhopper(api_key, destinations):
-    endpoint = f"https://graphhopper.com/api/1/matrix?key={api_key}"
-
-    # Expect dicts {"lat": x, "lng": y}, GraphHopper wants [lng, lat]
-    points = [[loc["lng"], loc["lat"]] for loc in destinations]
-
-    payload = {"points": points, "out_arrays": ["distances"]}
-    response = requests.post(endpoint, json=payload)
-    response.raise_for_status()
-    data = response.json()
-
-    if "distances" in data:
-        return [[round(d / 1000, 2) if d is not None else None for d in row] for row in data['distances']]
-    return {"error": data.get('message', 'Failed to retrieve distance matrix.')}
+def get_distance_provider(name, api_key):
+    if name == "haversine":
+        return HAVERSINE
+    return GraphHopperDistanceProvider(api_key, GRAPHHOPPER_MATRIX, MATRIX_CACHE, pool=MATRIX_TILE_POOL,
+                                       tile_size=int(os.getenv("GRAPHHOPPER_MATRIX_TILE_SIZE", "80")),
+                                       tile_retries=int(os.getenv("GRAPHHOPPER_MATRIX_TILE_RETRIES", "2")))
 
 def get_optimized_route_graphhopper(api_key, destinations):
     if len(destinations) < 2:
         return {"error": "Please provide at least two destinations."}
 
-    endpoint = f"https://graphhopper.com/api/1/vrp?key={api_key}"
-
     vehicle = {
         "vehicle_id": "my_vehicle",
         "start_address": {
@@ -162,7 +201,7 @@ def get_optimized_route_graphhopper(api_key, destinations):
         })
 
     payload = {"vehicles": [vehicle], "services": services}
-    response = requests.post(endpoint, json=payload)
+    response = GRAPHHOPPER.post("vrp", params={"key": api_key}, json=payload)
     response.raise_for_status()
     data = response.json()
 
@@ -197,15 +236,32 @@ def get_optimized_route_graphhopper(api_key, destinations):
     return {"total_distance_km": total_distance_km, "optimized_path": optimized_path, "legs": leg_details}
 
 # --- Geocoding ---
+_GEOCODERS = {}
+
+def get_geocoder(api_key):
+    if api_key not in _GEOCODERS:
+        provider = GraphHopperProvider(api_key, GRAPHHOPPER)
+        _GEOCODERS[api_key] = Geocoder(provider, GEOCODE_CACHE, rate=float(os.getenv("GEOCODE_RATE", "5")))
+    return _GEOCODERS[api_key]
+
+def model_time_budget(start_ts, requested_ms=None):
+    """
+    (deadline_ms, budget_ms, read timeout in seconds) for the model call,
+    from what is left of OPTIMIZE_BUDGET. deadline_ms is None when neither
+    the request nor MODEL_DEADLINE_MS asks for one.
+    """
+    remaining = OPTIMIZE_BUDGET - (time.time() - start_ts) - MODEL_DEADLINE_MARGIN
+    budget_ms = round(max(0.0, remaining * 1000))
+    wanted = MODEL_DEADLINE_MS if requested_ms is None else float(requested_ms)
+    if wanted is None:
+        return None, budget_ms, remaining + MODEL_DEADLINE_MARGIN
+    return round(max(0.0, min(wanted, budget_ms))), budget_ms, remaining + MODEL_DEADLINE_MARGIN
+
 def geocode_location(place, api_key):
-    url = f"https://graphhopper.com/api/1/geocode?q={place}&key={api_key}"
-    resp = requests.get(url)
-    resp.raise_for_status()
-    results = resp.json().get("hits", [])
-    if not results:
+    coords = get_geocoder(api_key).geocode(place)
+    if coords is None:
         raise ValueError(f"No results found for {place}")
-    hit = results[0]
-    return (hit["point"]["lat"], hit["point"]["lng"])
+    return coords
 
 # --- Flask Route ---
 @app.route("/optimize", methods=["POST"])
@@ -214,9 +270,12 @@ def optimize_route():
     try:
         backend_json = request.get_json(force=True)
 
-        load_dotenv()
         API_KEY = os.getenv("GRAPHHOPPER_API_KEY")
-        if not API_KEY:
+        try:
+            provider_name = resolve_provider_name(backend_json.get("distance_provider"), API_KEY)
+        except ValueError as e:
+            return jsonify({"error": str(e), "valid_providers": list(PROVIDER_NAMES)}), 400
+        if provider_name == "graphhopper" and not API_KEY:
             return jsonify({"error": "GraphHopper API key not found"}), 500
 
         # --- Extract coordinates ---
@@ -236,31 +295,54 @@ def optimize_route():
         if not locations:
             return jsonify({"error": "No valid locations provided"}), 400
 
-        # --- Get GraphHopper results ---
-        distance_matrix = get_distance_matrix_graphhopper(API_KEY, locations)
-        graphhopper_result = get_optimized_route_graphhopper(API_KEY, locations)
-        
+        # --- Distance matrix and GraphHopper VRP (skipped without an API key) ---
+        provider = get_distance_provider(provider_name, API_KEY)
+        matrix_future = UPSTREAM_POOL.submit(provider.matrix, locations, backend_json.get("vehicle_type"))
+        vrp_future = UPSTREAM_POOL.submit(get_optimized_route_graphhopper, API_KEY, locations) if API_KEY else None
+        try:
+            matrix = matrix_future.result()
+            distance_matrix = matrix_to_list(matrix)
+        except MatrixError as e:
+            return jsonify({"error": "Distance matrix error", "detail": str(e)}), 500
+        if vrp_future is not None:
+            graphhopper_result = vrp_future.result()
+        else:
+            graphhopper_result = {"skipped": "GraphHopper API key not found"}
+
         if isinstance(graphhopper_result, dict) and graphhopper_result.get("error"):
             return jsonify({"error": "GraphHopper VRP error", "detail": graphhopper_result}), 500
 
         # --- Prepare model payload in correct format ---
-        model_payload = prepare_and_send_to_model(backend_json, graphhopper_result, distance_matrix)
+        if MODEL_WIRE_FORMAT == "npz":
+            scenario = prepare_compact_scenario(backend_json, matrix)
+            request_kwargs = {"data": wire_format.encode_npz(scenario),
+                              "headers": {"Content-Type": wire_format.NPZ_MIMETYPE}}
+            model_payload = {k: v for k, v in scenario.items() if k != "distance_matrix"}
+        else:
+            model_payload = prepare_and_send_to_model(backend_json, graphhopper_result, distance_matrix)
+            request_kwargs = {"json": model_payload}
         print("Prepared model payload:", model_payload)
         
-        # --- Send to model ---
+        # --- Send to model, within what is left of the time budget ---
+        deadline_ms, budget_ms, model_timeout = model_time_budget(start_ts, backend_json.get("deadline_ms"))
+        if model_timeout <= 0:
+            return jsonify({"error": "Time budget exhausted before optimization",
+                            "budget_seconds": OPTIMIZE_BUDGET}), 504
         try:
-            model_response = requests.post(MODEL_URL, json=model_payload, timeout=30)
+            params = {k: backend_json[k] for k in ("engine", "beam_width", "beam_depth")
+                      if backend_json.get(k) is not None}
+            params["budget_ms"] = budget_ms
+            if deadline_ms is not None:
+                params["deadline_ms"] = deadline_ms
+            request_kwargs["params"] = params
+            model_response = MODEL.post(timeout=(MODEL.timeout[0], model_timeout), **request_kwargs)
             model_response.raise_for_status()
             model_result = model_response.json()
         except requests.exceptions.RequestException as e:
             model_result = {"error": f"Model request failed: {str(e)}"}
         
-        # --- Generate visualizations ---
-        try:
-            visualize_distance_matrix_graph(locations, distance_matrix)
-            visualize_complete_graph(locations, distance_matrix, graphhopper_result.get("optimized_path", []))
-        except Exception as viz_error:
-            print(f"Visualization error: {viz_error}")
+        # --- Queue visualizations (served later from /render/<id>) ---
+        render_ids = RENDERS.submit(locations, distance_matrix, graphhopper_result.get("optimized_path", []))
 
         # --- Return comprehensive response ---
         elapsed = time.time() - start_ts
@@ -268,10 +350,16 @@ def optimize_route():
             "status": "success",
             "processing_time_seconds": round(elapsed, 2),
             "locations": locations,
+            "distance_provider": provider.name,
+            "matrix_tiles": getattr(provider, "tile_timings", []),
             "distance_matrix": distance_matrix,
             "graphhopper_result": graphhopper_result,
             "model_payload": model_payload,
-            "model_result": model_result
+            "model_result": model_result,
+            "model_deadline_ms": deadline_ms,
+            "model_budget_ms": budget_ms,
+            "render_ids": render_ids,
+            "render_urls": {name: f"/render/{artifact_id}" for name, artifact_id in render_ids.items()}
         })
 
     except Exception as e:
@@ -281,7 +369,22 @@ def optimize_route():
             "detail": str(e), 
             "traceback": tb
         }), 500
-    
+
+
+@app.route("/render/<artifact_id>", methods=["GET"])
+def render(artifact_id):
+    status = RENDERS.status(artifact_id)
+    if status is None:
+        return jsonify({"error": "Unknown render id"}), 404
+    if status == "ready":
+        return send_file(os.path.abspath(RENDERS.path(artifact_id)), mimetype="image/png")
+    if status == "pending":
+        return jsonify({"status": "pending"}), 202
+    return jsonify({"status": status}), 500 if status == "failed" else 503
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({"matrix_cache": MATRIX_CACHE.summary()})
 
 
 if __name__ == "__main__":
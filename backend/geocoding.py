@@ -0,0 +1,194 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def normalize_query(query):
+    """Cache key for a place name: Unicode-normalized, case-folded, single-spaced"""
+    text = unicodedata.normalize("NFKC", str(query)).casefold()
+    text = re.sub(r"\s*,\s*", ", ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" ,.;")
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class GeocodeCache:
+    """
+    Two-tier geocoding cache: an in-process LRU in front of a SQLite file.
+
+    Misses (queries the provider had no result for) are cached as well,
+    with their own shorter TTL, so a misspelled stop is not looked up
+    again on every rerun.
+    """
+
+    def __init__(self, path=None, max_entries=4096, ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        self.path = path or os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes ("
+                " key TEXT PRIMARY KEY, lat REAL, lng REAL, created_at REAL NOT NULL)"
+            )
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _fresh(self, entry):
+        coords, created_at = entry
+        ttl = self.ttl if coords is not None else self.negative_ttl
+        return time.time() - created_at < ttl
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return (found, coords); coords is None for a cached miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry):
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return True, entry[0]
+
+            row = self._conn.execute("SELECT lat, lng, created_at FROM geocodes WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                lat, lng, created_at = row
+                entry = ((lat, lng) if lat is not None else None, created_at)
+                if self._fresh(entry):
+                    self._remember(key, entry)
+                    self.stats["disk_hits"] += 1
+                    return True, entry[0]
+
+            self.stats["misses"] += 1
+            return False, None
+
+    def put(self, key, coords):
+        entry = (tuple(coords) if coords is not None else None, time.time())
+        lat, lng = entry[0] if entry[0] is not None else (None, None)
+        with self._lock, self._conn:
+            self._remember(key, entry)
+            self._conn.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)", (key, lat, lng, entry[1]))
+
+
+# --- Providers: callables query -> (lat, lng) or None; transport errors raise ---
+
+class NominatimProvider:
+    name = "nominatim"
+
+    def __init__(self, session=None, url="https://nominatim.openstreetmap.org/search", user_agent="genai-routing-app"):
+        self.session = session or requests.Session()
+        self.url = url
+        self.headers = {"User-Agent": user_agent}
+
+    def __call__(self, query):
+        resp = self.session.get(self.url, params={"q": query, "format": "json", "limit": 1},
+                                headers=self.headers, timeout=10)
+        resp.raise_for_status()
+        results = resp.json()
+        if not results:
+            return None
+        return (float(results[0]["lat"]), float(results[0]["lon"]))
+
+
+class GraphHopperProvider:
+    name = "graphhopper"
+
+    def __init__(self, api_key, client):
+        self.api_key = api_key
+        self.client = client
+
+    def __call__(self, query):
+        resp = self.client.get("geocode", params={"q": query, "key": self.api_key})
+        resp.raise_for_status()
+        hits = resp.json().get("hits", [])
+        if not hits:
+            return None
+        return (hits[0]["point"]["lat"], hits[0]["point"]["lng"])
+
+
+class Geocoder:
+    """
+    Cached, rate-limited geocoding in front of one provider.
+
+    geocode_many resolves a whole destination list at once: duplicates
+    and cached names cost nothing, and the remaining lookups run
+    concurrently on up to max_workers threads while the rate limiter
+    keeps the provider's request rate within its usage policy.
+    """
+
+    def __init__(self, provider, cache=None, rate=1.0, max_workers=4):
+        self.provider = provider
+        self.cache = cache or GeocodeCache()
+        self.rate_limiter = RateLimiter(rate)
+        self.max_workers = max_workers
+
+    def _key(self, query):
+        return f"{self.provider.name}:{normalize_query(query)}"
+
+    def _lookup(self, query, key):
+        self.rate_limiter.wait()
+        coords = self.provider(query)
+        self.cache.put(key, coords)
+        return coords
+
+    def geocode(self, query):
+        key = self._key(query)
+        found, coords = self.cache.get(key)
+        if found:
+            return coords
+        return self._lookup(query, key)
+
+    def geocode_many(self, queries):
+        """Coordinates (or None) for each query, in order"""
+        results = {}
+        pending = {}
+        for query in queries:
+            key = self._key(query)
+            if key in results or key in pending:
+                continue
+            found, coords = self.cache.get(key)
+            if found:
+                results[key] = coords
+            else:
+                pending[key] = query
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+                futures = {key: pool.submit(self._lookup, query, key) for key, query in pending.items()}
+                for key, future in futures.items():
+                    try:
+                        results[key] = future.result()
+                    except Exception as e:  # transport errors are not cached
+                        print(f"Geocoding failed for {pending[key]!r}: {e}")
+                        results[key] = None
+
+        return [results[self._key(query)] for query in queries]
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class MatrixCache:
+    """
+    Persistent per-pair distance cache for upstream matrix calls.
+
+    Points are keyed on their coordinates rounded to `precision` decimal
+    places (5 ~ 1 m), and every (source, target) distance is stored as its
+    own SQLite row with the time it was fetched; rows older than `ttl`
+    seconds are ignored. A request is answered entirely from the cache
+    when every pair is known. Otherwise only the points that have unknown
+    pairs are sent upstream, as their rows plus their columns, and the
+    result is stitched into the cached matrix.
+
+    Distances are kept in the upstream unit (meters). Unreachable pairs
+    (NaN from fetch) are cached too and come back as NaN.
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    _IN_CHUNK = 400
+
+    def __init__(self, path=None, precision=None, ttl=None):
+        self.path = path or os.getenv("MATRIX_CACHE_PATH", "matrix_cache.sqlite3")
+        self.precision = int(precision if precision is not None else os.getenv("MATRIX_CACHE_PRECISION", "5"))
+        self.ttl = float(ttl if ttl is not None else os.getenv("MATRIX_CACHE_TTL", str(7 * 24 * 3600)))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pairs ("
+                " src TEXT NOT NULL, dst TEXT NOT NULL, distance REAL, fetched_at REAL NOT NULL,"
+                " PRIMARY KEY (src, dst)) WITHOUT ROWID"
+            )
+        self.stats = {
+            "requests": 0,
+            "full_hits": 0,
+            "pair_hits": 0,
+            "pair_misses": 0,
+            "upstream_calls": 0,
+            "upstream_bytes": 0,
+        }
+
+    def point_key(self, lat, lng):
+        return f"{round(float(lat), self.precision):.{self.precision}f},{round(float(lng), self.precision):.{self.precision}f}"
+
+    # --- Stats ---
+    def hit_ratio(self):
+        total = self.stats["pair_hits"] + self.stats["pair_misses"]
+        return self.stats["pair_hits"] / total if total else 0.0
+
+    def bytes_saved(self):
+        """Upstream response bytes avoided, estimated from the average bytes per fetched pair"""
+        if not self.stats["pair_misses"]:
+            return 0
+        return int(self.stats["pair_hits"] * self.stats["upstream_bytes"] / self.stats["pair_misses"])
+
+    def summary(self):
+        return dict(self.stats, hit_ratio=round(self.hit_ratio(), 4), bytes_saved=self.bytes_saved())
+
+    # --- Storage ---
+    def _load(self, keys):
+        """Return (distances, known) for all pairs of keys; unreachable pairs are inf"""
+        n = len(keys)
+        index = {}
+        for i, key in enumerate(keys):
+            index.setdefault(key, []).append(i)
+        unique = list(index)
+        distances = np.full((n, n), np.nan)
+        known = np.zeros((n, n), dtype=bool)
+        cutoff = time.time() - self.ttl
+
+        with self._lock:
+            for start in range(0, len(unique), self._IN_CHUNK):
+                src_chunk = unique[start:start + self._IN_CHUNK]
+                for dst_start in range(0, len(unique), self._IN_CHUNK):
+                    dst_chunk = unique[dst_start:dst_start + self._IN_CHUNK]
+                    rows = self._conn.execute(
+                        f"SELECT src, dst, distance FROM pairs"
+                        f" WHERE src IN ({','.join('?' * len(src_chunk))})"
+                        f" AND dst IN ({','.join('?' * len(dst_chunk))}) AND fetched_at >= ?",
+                        (*src_chunk, *dst_chunk, cutoff),
+                    )
+                    for src, dst, distance in rows:
+                        value = np.inf if distance is None else distance
+                        for i in index[src]:
+                            for j in index[dst]:
+                                distances[i, j] = value
+                                known[i, j] = True
+        return distances, known
+
+    def _store(self, keys, sources, targets, block):
+        now = time.time()
+        rows = []
+        for a, i in enumerate(sources):
+            for b, j in enumerate(targets):
+                value = block[a, b]
+                rows.append((keys[i], keys[j], None if np.isnan(value) else float(value), now))
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?)", rows)
+
+    @staticmethod
+    def _cover(known):
+        """Greedy set of points whose rows and columns cover every unknown pair"""
+        unknown = ~known
+        cover = []
+        while unknown.any():
+            degree = unknown.sum(axis=0) + unknown.sum(axis=1)
+            i = int(np.argmax(degree))
+            cover.append(i)
+            unknown[i, :] = False
+            unknown[:, i] = False
+        return sorted(cover)
+
+    # --- Lookup ---
+    def get_or_fetch(self, points, fetch):
+        """
+        Distance matrix (meters, NaN for unreachable) for points, a list of
+        {"lat", "lng"} dicts. fetch(sources, targets) is called with index
+        lists into points for the blocks that are not cached, and must
+        return a len(sources) x len(targets) array in meters with NaN for
+        unreachable pairs.
+        """
+        n = len(points)
+        keys = [self.point_key(p["lat"], p["lng"]) for p in points]
+        distances, known = self._load(keys)
+        self.stats["requests"] += 1
+
+        missing = self._cover(known)
+        hits = int(known.sum())
+        if not missing:
+            self.stats["full_hits"] += 1
+        else:
+            everything = list(range(n))
+            missing_set = set(missing)
+            rest = [i for i in everything if i not in missing_set]
+            blocks = [(missing, everything)]
+            if rest:
+                blocks.append((rest, missing))
+            for sources, targets in blocks:
+                block = np.asarray(fetch(sources, targets), dtype=np.float64)
+                self._store(keys, sources, targets, block)
+                distances[np.ix_(sources, targets)] = np.where(np.isnan(block), np.inf, block)
+                self.stats["upstream_calls"] += 1
+            # Pairs covered by the fetched rows/columns that were already cached
+            # count as misses too: they cost upstream bytes all the same
+            hits = int(known[np.ix_(rest, rest)].sum()) if rest else 0
+
+        self.stats["pair_hits"] += hits
+        self.stats["pair_misses"] += n * n - hits
+        distances[np.isinf(distances)] = np.nan
+        return distances
+
+    def record_upstream_bytes(self, nbytes):
+        self.stats["upstream_bytes"] += nbytes
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,148 @@
+import importlib.util
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from upstream import UpstreamClient
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class StubServer:
+    """Local HTTP upstream: answers POSTs with respond(path, body) after `delay` seconds, failing the first `fail` with 503"""
+
+    def __init__(self, respond=None, delay=0.0, fail=0):
+        self.respond = respond or (lambda path, body: {})
+        self.delay = delay
+        self.fail = fail
+        self.calls = []  # (path, start, end) in time.perf_counter() seconds
+        self.queries = []  # query parameters of each call
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                start = time.perf_counter()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?")[0].strip("/")
+                with stub._lock:
+                    failing = stub.fail > 0
+                    stub.fail -= failing
+                time.sleep(stub.delay)
+                if failing:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                else:
+                    payload = json.dumps(stub.respond(path, body)).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                with stub._lock:
+                    stub.calls.append((path, start, time.perf_counter()))
+                    stub.queries.append(parse_qs(urlsplit(self.path).query))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def graphhopper_response(path, body):
+    request = json.loads(body)
+    if path == "matrix":
+        n = len(request["points"])
+        return {"distances": [[1000.0 * abs(i - j) for j in range(n)] for i in range(n)]}
+    n = len(request["services"]) + 2
+    activities = ([{"type": "start", "distance": 0}]
+                  + [{"type": "service", "id": str(i), "distance": 1000 * i} for i in range(1, n - 1)]
+                  + [{"type": "end", "distance": 1000 * (n - 1)}])
+    return {"solution": {"distance": 1000 * (n - 1), "routes": [{"activities": activities}]}}
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    graphhopper = StubServer(graphhopper_response, delay=0.3)
+    model = StubServer(lambda path, body: {"result": {}})
+    monkeypatch.setenv("GRAPHHOPPER_URL", graphhopper.url)
+    monkeypatch.setenv("GRAPHHOPPER_API_KEY", "test-key")
+    monkeypatch.setenv("MODEL_URL", f"{model.url}/solve")
+    monkeypatch.setenv("MODEL_WIRE_FORMAT", "json")
+    monkeypatch.setenv("MATRIX_CACHE_PATH", str(tmp_path / "matrix.sqlite3"))
+    monkeypatch.setenv("GEOCODE_CACHE_PATH", str(tmp_path / "geocode.sqlite3"))
+    monkeypatch.setenv("RENDER_DIR", str(tmp_path / "renders"))
+    spec = importlib.util.spec_from_file_location("backend_app", os.path.join(BACKEND_DIR, "app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    yield app, graphhopper, model
+    graphhopper.close()
+    model.close()
+
+
+def test_matrix_and_vrp_calls_overlap(backend):
+    app, graphhopper, model = backend
+    response = app.app.test_client().post("/optimize", json={
+        "source": "depot", "destinations": ["a", "b", "c"], "loads": [1, 2, 3], "vehicle_capacity": 10,
+        "source_coords": [9.93, 76.26], "destination_coords": [[9.95, 76.28], [9.97, 76.30], [9.99, 76.32]],
+    })
+
+    assert response.status_code == 200
+    calls = {path: (start, end) for path, start, end in graphhopper.calls}
+    assert set(calls) == {"matrix", "vrp"}
+    assert max(calls["matrix"][0], calls["vrp"][0]) < min(calls["matrix"][1], calls["vrp"][1])
+    assert [path for path, _, _ in model.calls] == ["solve"]
+
+
+def test_model_always_gets_the_remaining_budget(backend):
+    app, graphhopper, model = backend
+    response = app.app.test_client().post("/optimize", json={
+        "source": "depot", "destinations": ["a"], "loads": [1], "vehicle_capacity": 10,
+        "source_coords": [9.93, 76.26], "destination_coords": [[9.95, 76.28]],
+    })
+
+    assert response.status_code == 200
+    query = model.queries[0]
+    assert "deadline_ms" not in query
+    assert 0 < float(query["budget_ms"][0]) <= (app.OPTIMIZE_BUDGET - app.MODEL_DEADLINE_MARGIN) * 1000
+    assert response.get_json()["model_budget_ms"] == int(query["budget_ms"][0])
+
+
+def test_retries_with_backoff_on_5xx():
+    stub = StubServer(lambda path, body: {"ok": True}, fail=2)
+    try:
+        client = UpstreamClient("stub", stub.url, retries=2, backoff=0.2)
+        response = client.post("lookup", json={})
+
+        assert response.status_code == 200
+        starts = [start for _, start, _ in stub.calls]
+        assert len(starts) == 3
+        # urllib3 sleeps backoff * 2 ** (n - 1) before the n-th consecutive retry, skipping the first
+        assert starts[2] - starts[1] >= 0.2 * 2 * 0.9
+    finally:
+        stub.close()
+
+
+def test_without_retries_makes_one_attempt():
+    stub = StubServer(fail=5)
+    try:
+        client = UpstreamClient("stub", stub.url, retries=2, backoff=0.2).without_retries()
+        response = client.post("lookup", json={})
+
+        assert response.status_code == 503
+        assert len(stub.calls) == 1
+    finally:
+        stub.close()
@@ -0,0 +1,82 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class UpstreamClient:
+    """
+    Keep-alive HTTP client for one upstream service.
+
+    Every client owns a pooled requests.Session, so repeated calls reuse
+    TCP/TLS connections instead of opening a new one per request. Failed
+    connections and retryable status codes (429, 5xx) are retried up to
+    `retries` times with exponential backoff; `timeout` is (connect, read)
+    seconds and applies to every call unless overridden.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, name, base_url, timeout=(3.05, 30), retries=2, backoff=0.3, pool_size=10):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=None,  # our upstream POSTs are idempotent lookups
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def without_retries(self):
+        """Client for the same upstream that makes every call exactly once, for callers that retry themselves"""
+        return UpstreamClient(self.name, self.base_url, timeout=self.timeout, retries=0, pool_size=self.pool_size)
+
+    def url(self, path=""):
+        return f"{self.base_url}/{path.lstrip('/')}" if path else self.base_url
+
+    def get(self, path="", timeout=None, **kwargs):
+        return self.session.get(self.url(path), timeout=timeout or self.timeout, **kwargs)
+
+    def post(self, path="", timeout=None, **kwargs):
+        return self.session.post(self.url(path), timeout=timeout or self.timeout, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def client_from_env(name, prefix, default_url, default_timeout, default_retries):
+    """
+    Build an UpstreamClient configured by <PREFIX>_URL, <PREFIX>_TIMEOUT
+    (read timeout, seconds), <PREFIX>_CONNECT_TIMEOUT, <PREFIX>_RETRIES
+    and <PREFIX>_BACKOFF. Pointing <PREFIX>_URL at a local stub server is
+    enough to run the backend without the real upstream.
+    """
+    return UpstreamClient(
+        name,
+        os.getenv(f"{prefix}_URL", default_url),
+        timeout=(_env_float(f"{prefix}_CONNECT_TIMEOUT", 3.05), _env_float(f"{prefix}_TIMEOUT", default_timeout)),
+        retries=_env_int(f"{prefix}_RETRIES", default_retries),
+        backoff=_env_float(f"{prefix}_BACKOFF", 0.3),
+    )
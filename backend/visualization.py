@@ -0,0 +1,140 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import networkx as nx
+
+
+# --- Visualization Helpers ---
+# Figures are built with the object-oriented API instead of pyplot so that
+# several renders can run on worker threads at the same time.
+
+def compute_layout(locations, distance_matrix):
+    """Graph, node positions and edge labels shared by both route images"""
+    G = nx.Graph()
+    edge_labels = {}
+    for i in range(len(locations)):
+        for j in range(i + 1, len(locations)):
+            if distance_matrix[i][j] is not None:
+                G.add_edge(i, j, weight=distance_matrix[i][j])
+                edge_labels[(i, j)] = f"{distance_matrix[i][j]} km"
+    pos = nx.spring_layout(G, seed=42)
+    return G, pos, edge_labels
+
+def _draw_network(G, pos, edge_labels):
+    fig = Figure(figsize=(12, 12))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    nx.draw_networkx_nodes(G, pos, ax=ax, node_color='skyblue', node_size=700)
+    nx.draw_networkx_labels(G, pos, ax=ax)
+    nx.draw_networkx_edges(G, pos, ax=ax, alpha=0.5, edge_color='gray')
+    nx.draw_networkx_edge_labels(G, pos, ax=ax, edge_labels=edge_labels, font_color='red', font_size=8)
+    return fig, ax
+
+def visualize_distance_matrix_graph(locations, distance_matrix, filename="distance_matrix_graph.png", layout=None):
+    G, pos, edge_labels = layout or compute_layout(locations, distance_matrix)
+    fig, ax = _draw_network(G, pos, edge_labels)
+    nx.draw_networkx_nodes(G, pos, ax=ax, nodelist=[0], node_color='green', node_size=800, label='Node 0 (Origin)')
+    ax.set_title("Direct Routes and Distances Between All Nodes")
+    ax.legend()
+    fig.savefig(filename)
+
+def visualize_complete_graph(locations, distance_matrix, optimized_path, filename="optimized_route_graph.png", layout=None):
+    G, pos, edge_labels = layout or compute_layout(locations, distance_matrix)
+    fig, ax = _draw_network(G, pos, edge_labels)
+    nx.draw_networkx_nodes(G, pos, ax=ax, nodelist=[optimized_path[0]], node_color='green', node_size=800, label='Origin')
+    nx.draw_networkx_nodes(G, pos, ax=ax, nodelist=[optimized_path[-1]], node_color='red', node_size=800, label='Destination')
+    route_edges = list(zip(optimized_path, optimized_path[1:]))
+    nx.draw_networkx_edges(G, pos, ax=ax, edgelist=route_edges, edge_color='black', width=2.5, arrows=True, arrowstyle='->', arrowsize=20)
+    ax.set_title("Complete Network Graph with Optimized Route")
+    ax.legend()
+    fig.savefig(filename)
+
+
+# --- Background rendering ---
+
+class RenderQueue:
+    """
+    Renders route images on a bounded worker pool, off the request path.
+
+    submit() returns one artifact ID per image right away; the images are
+    written to output_dir under those IDs. At most max_pending jobs are
+    queued or running; beyond that new jobs are skipped rather than
+    letting renders pile up, and so are networks with more than max_nodes
+    locations (a labelled complete graph is unreadable and slow to lay
+    out). Only the newest max_artifacts artifacts are kept on disk.
+    """
+
+    IMAGES = ("distance_matrix_graph", "optimized_route_graph")
+
+    def __init__(self, output_dir=None, max_workers=2, max_pending=16, max_artifacts=256, max_nodes=60):
+        self.output_dir = output_dir or os.getenv("RENDER_DIR", "renders")
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.max_artifacts = max_artifacts
+        self.max_nodes = max_nodes
+        self._lock = threading.Lock()
+        self._status = OrderedDict()  # artifact id -> "pending" | "ready" | "failed" | "skipped"
+
+    def path(self, artifact_id):
+        return os.path.join(self.output_dir, f"{artifact_id}.png")
+
+    def status(self, artifact_id):
+        with self._lock:
+            return self._status.get(artifact_id)
+
+    def _set(self, artifact_ids, status):
+        with self._lock:
+            for artifact_id in artifact_ids:
+                self._status[artifact_id] = status
+                self._status.move_to_end(artifact_id)
+            while len(self._status) > self.max_artifacts:
+                old_id, _ = self._status.popitem(last=False)
+                try:
+                    os.remove(self.path(old_id))
+                except FileNotFoundError:
+                    pass
+
+    def submit(self, locations, distance_matrix, optimized_path):
+        """Queue both route images; returns {image name: artifact id}"""
+        job = uuid.uuid4().hex
+        artifacts = {name: f"{job}-{name}" for name in self.IMAGES}
+        ids = list(artifacts.values())
+
+        if len(locations) > self.max_nodes or not self.slots.acquire(blocking=False):
+            self._set(ids, "skipped")
+            return artifacts
+        self._set(ids, "pending")
+        self.pool.submit(self._render, artifacts, locations, distance_matrix, optimized_path)
+        return artifacts
+
+    def _render(self, artifacts, locations, distance_matrix, optimized_path):
+        try:
+            layout = compute_layout(locations, distance_matrix)
+            matrix_id = artifacts["distance_matrix_graph"]
+            route_id = artifacts["optimized_route_graph"]
+            try:
+                visualize_distance_matrix_graph(locations, distance_matrix, self.path(matrix_id), layout=layout)
+                self._set([matrix_id], "ready")
+            except Exception as e:
+                print(f"Visualization error ({matrix_id}): {e}")
+                self._set([matrix_id], "failed")
+            if not optimized_path:
+                self._set([route_id], "skipped")
+                return
+            try:
+                visualize_complete_graph(locations, distance_matrix, optimized_path, self.path(route_id), layout=layout)
+                self._set([route_id], "ready")
+            except Exception as e:
+                print(f"Visualization error ({route_id}): {e}")
+                self._set([route_id], "failed")
+        except Exception as e:
+            print(f"Visualization error: {e}")
+            self._set(list(artifacts.values()), "failed")
+        finally:
+            self.slots.release()
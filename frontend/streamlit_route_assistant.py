@@ -3,8 +3,12 @@ from streamlit_folium import st_folium
 import folium
 import requests
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from geocoding import GeocodeCache, Geocoder, NominatimProvider
+
 st.set_page_config(layout="wide")
 
 # --- Sidebar/Left Panel ---
@@ -15,17 +19,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Helper: Geocode ---
+@st.cache_resource
+def get_geocoder():
+    # Nominatim's usage policy allows at most one request per second
+    return Geocoder(NominatimProvider(), GeocodeCache(), rate=1.0)
+
 def geocode_location(location_name):
-    url = f"https://nominatim.openstreetmap.org/search"
-    params = {"q": location_name, "format": "json", "limit": 1}
-    try:
-        resp = requests.get(url, params=params, headers={"User-Agent": "genai-routing-app"})
-        if resp.status_code == 200 and resp.json():
-            data = resp.json()[0]
-            return [float(data['lat']), float(data['lon'])]
-    except Exception:
-        pass
-    return None
+    return geocode_locations([location_name])[0]
+
+def geocode_locations(location_names):
+    return [list(coords) if coords else None for coords in get_geocoder().geocode_many(location_names)]
 
 load_dotenv()
 ORS_API_KEY = os.getenv("ORS_API_KEY")
@@ -91,8 +94,7 @@ with col1:
             st.session_state['vehicle_capacity'] = vehicle_capacity
             st.session_state['transport'] = transport
             # Geocode
-            src_coords = geocode_location(source)
-            dest_coords_list = [geocode_location(dest) for dest in destinations if dest]
+            src_coords, *dest_coords_list = geocode_locations([source] + [dest for dest in destinations if dest])
             st.session_state['src_coords'] = src_coords
             st.session_state['dest_coords_list'] = dest_coords_list
             # Get route for each leg
@@ -154,8 +156,8 @@ with col1:
                     st.markdown(f"**Parsed vehicle_type:** {vehicle_type}")
                     st.markdown(f"**Parsed vehicle_capacity:** {vehicle_capacity}")
                     # Geocode
-                    src_coords = geocode_location(source) if source else None
-                    dest_coords_list = [geocode_location(dest) for dest in destinations if dest]
+                    dest_coords_list = geocode_locations(([source] if source else []) + [dest for dest in destinations if dest])
+                    src_coords = dest_coords_list.pop(0) if source else None
                     if not source or not destinations:
                         st.warning("Gemini did not parse source or destinations. Please rephrase your prompt.")
                     elif not src_coords or not dest_coords_list:
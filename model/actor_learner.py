@@ -0,0 +1,301 @@
+import multiprocessing as mp
+import pickle
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import ImprovedLogisticsEnvironment, ImprovedDQNAgent
+
+# Fields of one transition as stored in the shared-memory chunks
+def _transition_layout(state_size, action_size, chunk_size):
+    return [
+        ("state", np.float32, (chunk_size, state_size)),
+        ("action", np.int32, (chunk_size,)),
+        ("reward", np.float64, (chunk_size,)),
+        ("next_state", np.float32, (chunk_size, state_size)),
+        ("done", np.bool_, (chunk_size,)),
+        ("mask", np.float32, (chunk_size, action_size)),
+        ("next_mask", np.float32, (chunk_size, action_size)),
+    ]
+
+
+class TransitionChunks:
+    """
+    Views over a SharedMemory block holding queue_depth chunks of
+    chunk_size transitions for one actor. Chunk ownership moves between
+    actor and learner through a free queue and a filled queue of indices.
+    """
+
+    def __init__(self, shm, state_size, action_size, chunk_size, queue_depth):
+        self.shm = shm
+        self.fields = {}
+        offset = 0
+        for name, dtype, shape in _transition_layout(state_size, action_size, chunk_size):
+            full_shape = (queue_depth,) + shape
+            self.fields[name] = np.ndarray(full_shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            offset += int(np.prod(full_shape)) * np.dtype(dtype).itemsize
+
+    @staticmethod
+    def nbytes(state_size, action_size, chunk_size, queue_depth):
+        return sum(int(np.prod((queue_depth,) + shape)) * np.dtype(dtype).itemsize
+                   for _, dtype, shape in _transition_layout(state_size, action_size, chunk_size))
+
+
+class WeightBroadcast:
+    """Flat float32 copy of the Q-network weights in shared memory plus a version counter"""
+
+    def __init__(self, shm, shapes, version, lock):
+        self.shm = shm
+        self.shapes = shapes
+        self.sizes = [int(np.prod(shape)) for shape in shapes]
+        self.flat = np.ndarray((sum(self.sizes),), dtype=np.float32, buffer=shm.buf)
+        self.version = version
+        self.lock = lock
+
+    def publish(self, weights):
+        with self.lock:
+            self.flat[:] = np.concatenate([w.ravel() for w in weights])
+            self.version.value += 1
+
+    def read(self):
+        with self.lock:
+            flat = self.flat.copy()
+            version = self.version.value
+        weights, offset = [], 0
+        for shape, size in zip(self.shapes, self.sizes):
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return weights, version
+
+
+def _actor_main(actor_id, config, chunk_shm_name, weights_shm_name, shapes, weight_version, weight_lock,
+                epsilon, free_slots, filled_slots, episode_queue, transition_counts, stop_event):
+    """Run episodes with a local copy of the Q-network and stream transitions to the learner"""
+    import tensorflow as tf
+    from m import generate_random_scenario
+
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    env = ImprovedLogisticsEnvironment()
+    agent = ImprovedDQNAgent(env.state_size, env.action_space_size)
+
+    chunk_shm = shared_memory.SharedMemory(name=chunk_shm_name)
+    weights_shm = shared_memory.SharedMemory(name=weights_shm_name)
+    chunks = TransitionChunks(chunk_shm, env.state_size, env.action_space_size,
+                              config["chunk_size"], config["queue_depth"])
+    broadcast = WeightBroadcast(weights_shm, shapes, weight_version, weight_lock)
+    local_version = -1
+
+    def sync_weights():
+        nonlocal local_version
+        if weight_version.value != local_version:
+            weights, local_version = broadcast.read()
+            agent.q_network.set_weights(weights)
+        agent.epsilon = epsilon.value
+
+    def next_slot():
+        while not stop_event.is_set():
+            try:
+                return free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    slot, filled = next_slot(), 0
+    steps_since_sync = 0
+    try:
+        while slot is not None and not stop_event.is_set():
+            sync_weights()
+            locations, routes, packages, vehicles = generate_random_scenario()
+            state = env.load_scenario(locations, routes, packages, vehicles)
+            total_reward, done, steps = 0, False, 0
+
+            while not done and steps < 1000 and slot is not None:
+                mask = env.get_valid_actions_mask()
+                action = agent.act(state, mask)
+                next_state, reward, done, _ = env.step(action)
+                next_mask = env.get_valid_actions_mask()
+
+                fields = chunks.fields
+                fields["state"][slot, filled] = state
+                fields["action"][slot, filled] = action
+                fields["reward"][slot, filled] = reward
+                fields["next_state"][slot, filled] = next_state
+                fields["done"][slot, filled] = done
+                fields["mask"][slot, filled] = mask
+                fields["next_mask"][slot, filled] = next_mask
+                filled += 1
+
+                if filled == config["chunk_size"]:
+                    filled_slots.put((actor_id, slot, filled))
+                    transition_counts[actor_id] += filled
+                    slot, filled = next_slot(), 0
+
+                state = next_state
+                total_reward += reward
+                steps += 1
+                steps_since_sync += 1
+                if steps_since_sync >= config["weight_sync_steps"]:
+                    sync_weights()
+                    steps_since_sync = 0
+
+            if slot is not None:
+                episode_queue.put({
+                    "actor": actor_id,
+                    "total_reward": total_reward,
+                    "packages_delivered": env.packages_delivered,
+                    "total_packages": len(env.packages),
+                    "completion_time": env.current_time,
+                    "total_distance": env.total_distance,
+                })
+    finally:
+        del chunks, broadcast
+        chunk_shm.close()
+        weights_shm.close()
+
+
+def train_actor_learner(episodes=3000, save_path="improved_logistics_model", num_actors=4,
+                        queue_depth=16, chunk_size=64, weight_broadcast_interval=50,
+                        weight_sync_steps=100, report_interval=10.0):
+    """
+    Actor/learner training: num_actors processes run episodes and stream
+    transitions through shared memory; this process owns the replay
+    buffer and runs agent.replay().
+
+    queue_depth chunks of chunk_size transitions are allocated per actor.
+    The learner publishes weights every weight_broadcast_interval updates
+    and actors pick them up every weight_sync_steps environment steps
+    (and at episode start).
+    """
+    env = ImprovedLogisticsEnvironment()
+    agent = ImprovedDQNAgent(env.state_size, env.action_space_size)
+    state_size, action_size = env.state_size, env.action_space_size
+    config = {"chunk_size": chunk_size, "queue_depth": queue_depth, "weight_sync_steps": weight_sync_steps}
+
+    ctx = mp.get_context("spawn")  # TensorFlow does not survive fork
+    stop_event = ctx.Event()
+    episode_queue = ctx.Queue()
+    filled_slots = ctx.Queue()
+    free_slots = [ctx.Queue() for _ in range(num_actors)]
+    transition_counts = ctx.Array("q", num_actors)
+    weight_version = ctx.Value("q", 0)
+    weight_lock = ctx.Lock()
+    epsilon = ctx.Value("d", agent.epsilon)
+
+    shapes = [w.shape for w in agent.q_network.get_weights()]
+    weights_shm = shared_memory.SharedMemory(create=True, size=sum(int(np.prod(s)) for s in shapes) * 4)
+    broadcast = WeightBroadcast(weights_shm, shapes, weight_version, weight_lock)
+    broadcast.publish(agent.q_network.get_weights())
+
+    chunk_bytes = TransitionChunks.nbytes(state_size, action_size, chunk_size, queue_depth)
+    chunk_shms = [shared_memory.SharedMemory(create=True, size=chunk_bytes) for _ in range(num_actors)]
+    chunk_views = [TransitionChunks(shm, state_size, action_size, chunk_size, queue_depth) for shm in chunk_shms]
+    for q in free_slots:
+        for slot in range(queue_depth):
+            q.put(slot)
+
+    actors = [
+        ctx.Process(target=_actor_main, name=f"actor-{i}", daemon=True, args=(
+            i, config, chunk_shms[i].name, weights_shm.name, shapes, weight_version, weight_lock,
+            epsilon, free_slots[i], filled_slots, episode_queue, transition_counts, stop_event))
+        for i in range(num_actors)
+    ]
+    for actor in actors:
+        actor.start()
+
+    history = {
+        'episode': [],
+        'total_reward': [],
+        'packages_delivered': [],
+        'completion_time': [],
+        'total_distance': [],
+        'epsilon': []
+    }
+
+    print("Starting actor/learner training...")
+    print(f"State size: {state_size}, Action size: {action_size}, Actors: {num_actors}")
+
+    updates = 0
+    start = last_report = time.perf_counter()
+    last_counts = [0] * num_actors
+    last_updates = 0
+
+    try:
+        while len(history['episode']) < episodes:
+            # Ingest whatever the actors have produced
+            try:
+                item = filled_slots.get(timeout=0.05 if len(agent.memory) <= agent.batch_size else 0)
+                while True:
+                    actor_id, slot, count = item
+                    fields = chunk_views[actor_id].fields
+                    for k in range(count):
+                        agent.remember(fields["state"][slot, k].copy(), int(fields["action"][slot, k]),
+                                       float(fields["reward"][slot, k]), fields["next_state"][slot, k].copy(),
+                                       bool(fields["done"][slot, k]), fields["mask"][slot, k].copy(),
+                                       fields["next_mask"][slot, k].copy())
+                    free_slots[actor_id].put(slot)
+                    item = filled_slots.get_nowait()
+            except queue.Empty:
+                pass
+
+            # Learn
+            if len(agent.memory) > agent.batch_size:
+                agent.replay()
+                updates += 1
+                epsilon.value = agent.epsilon
+                if updates % weight_broadcast_interval == 0:
+                    broadcast.publish(agent.q_network.get_weights())
+
+            # Episode bookkeeping
+            try:
+                while len(history['episode']) < episodes:
+                    summary = episode_queue.get_nowait()
+                    history['episode'].append(len(history['episode']))
+                    history['total_reward'].append(summary["total_reward"])
+                    history['packages_delivered'].append(summary["packages_delivered"])
+                    history['completion_time'].append(summary["completion_time"])
+                    history['total_distance'].append(summary["total_distance"])
+                    history['epsilon'].append(agent.epsilon)
+            except queue.Empty:
+                pass
+
+            now = time.perf_counter()
+            if now - last_report >= report_interval:
+                # A dead actor stops producing episodes, so the loop would never finish
+                for i, actor in enumerate(actors):
+                    if not actor.is_alive():
+                        raise RuntimeError(f"Actor {i} exited with code {actor.exitcode} during training")
+                elapsed = now - last_report
+                counts = list(transition_counts)
+                per_actor = ", ".join(f"{(c - p) / elapsed:.1f}" for c, p in zip(counts, last_counts))
+                avg_reward = np.mean(history['total_reward'][-100:]) if history['total_reward'] else 0
+                print(f"Episodes {len(history['episode'])}/{episodes}  Avg Reward: {avg_reward:.2f}  "
+                      f"Epsilon: {agent.epsilon:.4f}")
+                print(f"  Transitions/s per actor: [{per_actor}]  "
+                      f"Learner updates/s: {(updates - last_updates) / elapsed:.1f}")
+                last_report, last_counts, last_updates = now, counts, updates
+    finally:
+        stop_event.set()
+        for actor in actors:
+            actor.join(timeout=10)
+            if actor.is_alive():
+                actor.terminate()
+        del chunk_views, broadcast
+        for shm in chunk_shms + [weights_shm]:
+            shm.close()
+            shm.unlink()
+
+    elapsed = time.perf_counter() - start
+    total = sum(transition_counts)
+    print(f"Collected {total} transitions in {elapsed:.1f}s "
+          f"({total / elapsed / num_actors:.1f}/s per actor), {updates / elapsed:.1f} updates/s")
+
+    agent.save(save_path)
+    with open(f"{save_path}_history.pkl", 'wb') as f:
+        pickle.dump(history, f)
+
+    print("Training completed!")
+    return agent, history
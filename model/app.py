@@ -1,10 +1,50 @@
 # model/app.py
-from flask import Flask, request, jsonify
-from test import run_with_json
+from flask import Flask, request, jsonify, Response, stream_with_context
+from test import run_with_json, stream_with_json
 from train import Package, Vehicle, Route  # use your classes
+from registry import ModelRegistry
+from batching import MicroBatcher
+from distance_cache import DistanceMatrixCache
+from decomposition import cluster_pool, default_workers
+from inference import LogisticsOptimizer
+from logistics_shared import wire_format
+import os
+import json
+import math
 
 app = Flask(__name__)
 
+# Weights are loaded once per process and hot-reloaded when the file changes;
+# concurrent requests share batched forward passes and cached distance matrices.
+MODEL_REGISTRY = ModelRegistry(
+    batcher=MicroBatcher(
+        max_batch_size=int(os.getenv("SOLVE_MAX_BATCH_SIZE", "32")),
+        max_wait_ms=float(os.getenv("SOLVE_MAX_BATCH_WAIT_MS", "2.0")),
+    ),
+    distance_cache=DistanceMatrixCache(),
+)
+# Scenarios with more than 20 locations are solved cluster by cluster in
+# DECOMPOSE_WORKERS processes (see decomposition.py), started here rather
+# than on the first such request. They are spawned processes that import
+# this module as __mp_main__ and load their own weights.
+if __name__ != "__mp_main__":
+    preload_errors = MODEL_REGISTRY.preload()
+    if default_workers() > 1:
+        for model_path in MODEL_REGISTRY.model_paths:
+            if model_path in preload_errors:
+                continue
+            try:
+                cluster_pool(model_path, default_workers())
+            except Exception as e:
+                print(f"Could not start decomposition workers for '{model_path}': {e}")
+
+# Planner used when a request does not pick one with ?engine=
+SOLVE_ENGINE = os.getenv("SOLVE_ENGINE", "dqn").lower()
+# Beam search limits for ?engine=beam&beam_width=&beam_depth=
+MAX_BEAM_WIDTH = int(os.getenv("SOLVE_MAX_BEAM_WIDTH", "16"))
+# Upper bound for ?deadline_ms= (anytime search) and ?budget_ms= (hard time cap)
+MAX_DEADLINE_MS = float(os.getenv("SOLVE_MAX_DEADLINE_MS", "30000"))
+
 # Global variables so test.py can import them if needed
 LOCATIONS = []
 ROUTES = []
@@ -16,7 +56,12 @@ CUSTOM_VEHICLES = []
 def solve():
     global LOCATIONS, ROUTES, CUSTOM_PACKAGES, CUSTOM_VEHICLES
     try:
+        # Compact index-based scenarios (npz body or JSON) go straight to the optimizer
+        if request.mimetype == wire_format.NPZ_MIMETYPE:
+            return _respond(wire_format.decode_npz(request.get_data()))
         data = request.get_json(force=True)
+        if wire_format.is_compact(data):
+            return _respond(data)
 
         # Extract arrays from POST payload (match your format)
         LOCATIONS = data.get("LOCATIONS", [])
@@ -90,9 +135,7 @@ def solve():
 
         # Run simulation with scenario JSON
         print("SCENARIO_JSON =", scenario_json)
-        result = run_with_json(scenario_json)
-        print("RESULT:", result)
-        return jsonify({"status": "ok", "result": result})
+        return _respond(scenario_json)
 
     except Exception as e:
         import traceback
@@ -102,5 +145,46 @@ def solve():
         return jsonify({"error": str(e)}), 500
 
 
+def _to_json(value):
+    # numpy scalars that end up in plans and metrics
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def _respond(scenario):
+    """Solve and answer with one JSON document, or NDJSON events with ?stream=1"""
+    engine = request.args.get("engine", SOLVE_ENGINE).lower()
+    if engine not in LogisticsOptimizer.ENGINES:
+        return jsonify({"error": f"Unknown engine '{engine}'", "engines": list(LogisticsOptimizer.ENGINES)}), 400
+    options = {}
+    for name in ("deadline_ms", "budget_ms"):
+        if request.args.get(name) in (None, ""):
+            continue
+        try:
+            value = float(request.args[name])
+        except ValueError:
+            value = math.nan
+        if not math.isfinite(value) or value < 0:
+            return jsonify({"error": f"{name} must be a finite number >= 0"}), 400
+        options[name] = min(value, MAX_DEADLINE_MS)
+    if engine == "beam":
+        try:
+            options["beam_width"] = int(request.args.get("beam_width", 4))
+            depth = request.args.get("beam_depth")
+            options["beam_depth"] = int(depth) if depth not in (None, "") else None
+        except ValueError:
+            return jsonify({"error": "beam_width and beam_depth must be integers"}), 400
+        if not 1 <= options["beam_width"] <= MAX_BEAM_WIDTH or (options["beam_depth"] or 0) < 0:
+            return jsonify({"error": f"beam_width must be in 1..{MAX_BEAM_WIDTH} and beam_depth >= 0"}), 400
+    if request.args.get("stream", "0").lower() in ("1", "true"):
+        def events():
+            for event in stream_with_json(scenario, registry=MODEL_REGISTRY, engine=engine, **options):
+                yield json.dumps(event, default=_to_json) + "\n"
+        return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
+    result = run_with_json(scenario, registry=MODEL_REGISTRY, engine=engine, **options)
+    print("RESULT:", result)
+    return jsonify({"status": "ok", "result": result})
+
+
 if __name__ == "__main__":
     app.run(port=6000, debug=True)
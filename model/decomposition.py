@@ -0,0 +1,500 @@
+"""
+Hierarchical decomposition for scenarios with more locations than the
+network can address (ImprovedLogisticsEnvironment.max_locations).
+LogisticsOptimizer uses it for the policy engines; the heuristic plans
+such scenarios whole unless they are too large for it (see
+LogisticsOptimizer._heuristic_fits), as splitting only makes its plans
+worse.
+
+1. Delivery locations are clustered on the distance matrix (k-medoids,
+   then bisection of any cluster that is still too large), so every
+   cluster plus its entry point and pickup locations fits in one
+   environment.
+2. The cluster medoids are ordered into one tour from the first vehicle's
+   start (nearest neighbour + 2-opt), and the tour is cut into one
+   contiguous stretch of clusters per vehicle.
+3. Every cluster becomes a small compact scenario for its vehicle, which
+   enters from the previous cluster's medoid. The scenarios are solved
+   by LogisticsOptimizer.optimize_routes, in worker processes when there
+   is more than one worker.
+4. The cluster plans are stitched per vehicle in tour order. Times,
+   distances and costs are recomputed on the full matrix, so the plan is
+   consistent end to end.
+
+When all of a vehicle's packages are picked up at its start and fit in it
+at once, they are loaded before it leaves, and the clusters only deliver.
+This is the backend's one-source, N-destination job. Otherwise each
+cluster picks up its own packages and the vehicle leaves the cluster
+empty. A package picked up but not delivered within its cluster is left
+at its pickup location and reported undelivered. Time windows are not
+carried over to the cluster scenarios.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logistics_shared import wire_format
+from shortest_path import direct_edge_matrix, shortest_path_matrix
+
+ENTRY = "__entry__"  # stand-in location for where a vehicle enters a cluster
+
+
+# --- Scenario conversion ---
+
+def to_compact(scenario_dict):
+    """
+    Compact scenario (see logistics_shared.wire_format) with a shortest-path matrix for
+    either input format. Location names are made unique the way
+    LogisticsOptimizer does it, and unknown location names in packages or
+    vehicles become index -1.
+    """
+    if wire_format.is_compact(scenario_dict):
+        scenario = wire_format.normalize(scenario_dict)
+        locations, seen = [], {}
+        for name in scenario["locations"]:
+            seen[name] = seen.get(name, 0) + 1
+            locations.append(name if seen[name] == 1 else f"{name} #{seen[name]}")
+        dist = scenario["distance_matrix"].astype(np.float64)
+        dist[~np.isfinite(dist)] = np.inf
+        np.fill_diagonal(dist, 0)
+        scenario["locations"] = locations
+        scenario["distance_matrix"] = dist if scenario["metric"] else shortest_path_matrix(dist)
+        scenario["metric"] = True
+        return scenario
+
+    locations = list(scenario_dict["locations"])
+    index = {name: i for i, name in enumerate(locations)}
+    routes = [r for r in scenario_dict["routes"] if r["start"] in index and r["end"] in index]
+    dist = direct_edge_matrix(len(locations), [index[r["start"]] for r in routes], [index[r["end"]] for r in routes],
+                              [r["distance"] * r.get("traffic_factor", 1.0) for r in routes])
+    packages = scenario_dict["packages"]
+    vehicles = scenario_dict["vehicles"]
+    return {
+        "format": wire_format.COMPACT_FORMAT,
+        "locations": locations,
+        "distance_matrix": shortest_path_matrix(dist),
+        "metric": True,
+        "packages": {
+            "id": np.array([p["id"] for p in packages], dtype=np.int64),
+            "pickup": np.array([index.get(p["pickup"], -1) for p in packages], dtype=np.int32),
+            "delivery": np.array([index.get(p["delivery"], -1) for p in packages], dtype=np.int32),
+            "weight": np.array([p["weight"] for p in packages], dtype=np.float64),
+            "priority": np.array([p.get("priority", 1) for p in packages], dtype=np.int32),
+        },
+        "vehicles": {
+            "id": np.array([v["id"] for v in vehicles], dtype=np.int64),
+            "capacity": np.array([v["capacity"] for v in vehicles], dtype=np.float64),
+            "location": np.array([index.get(v["location"], -1) for v in vehicles], dtype=np.int32),
+            "speed": np.array([v.get("speed", 1.0) for v in vehicles], dtype=np.float64),
+            "cost_per_km": np.array([v.get("cost_per_km", 1.0) for v in vehicles], dtype=np.float64),
+        },
+    }
+
+
+def location_count(scenario_dict):
+    return len(scenario_dict["locations"])
+
+
+# --- Clustering ---
+
+def _finite(dist):
+    """Symmetric copy of dist with unreachable pairs set far beyond every real distance"""
+    d = np.minimum(dist, dist.T)
+    finite = np.isfinite(d)
+    far = (d[finite].max() if finite.any() else 1.0) * 10 + 1
+    return np.where(finite, d, far)
+
+
+def medoid(dist, members):
+    """Member with the smallest total distance to the others"""
+    members = np.asarray(members, dtype=np.intp)
+    return int(members[np.argmin(dist[np.ix_(members, members)].sum(axis=1))])
+
+
+def _k_medoids(dist, points, k, iterations=10):
+    """Farthest-first seeds, then alternate nearest-medoid assignment and medoid updates"""
+    sub = dist[np.ix_(points, points)]
+    medoids = [int(np.argmin(sub.sum(axis=1)))]
+    nearest = sub[medoids[0]].copy()
+    for _ in range(1, k):
+        medoids.append(int(np.argmax(nearest)))
+        np.minimum(nearest, sub[medoids[-1]], out=nearest)
+    medoids = np.array(medoids)
+
+    for _ in range(iterations):
+        labels = np.argmin(sub[:, medoids], axis=1)
+        labels[medoids] = np.arange(k)
+        updated = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            updated[c] = members[np.argmin(sub[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    labels = np.argmin(sub[:, medoids], axis=1)
+    labels[medoids] = np.arange(k)
+    return [points[labels == c] for c in range(k) if np.any(labels == c)]
+
+
+def cluster_locations(dist, points, max_size):
+    """Split location indices `points` into clusters of at most max_size, close together on dist"""
+    points = np.asarray(points, dtype=np.intp)
+    if len(points) <= max_size:
+        return [points] if len(points) else []
+    d = _finite(dist)
+    clusters = []
+    pending = _k_medoids(d, points, int(np.ceil(len(points) / max_size)))
+    while pending:
+        cluster = pending.pop()
+        if len(cluster) <= max_size:
+            clusters.append(cluster)
+        else:
+            pending.extend(_k_medoids(d, cluster, 2))
+    return clusters
+
+
+def order_tour(dist, start, points):
+    """
+    Visiting order of `points` (location indices, repeats allowed) on a
+    short open path from `start`: nearest neighbour, then 2-opt. Returns
+    positions into points.
+    """
+    points = np.asarray(points, dtype=np.intp)
+    if len(points) < 2:
+        return list(range(len(points)))
+    d = _finite(dist)
+    remaining = np.ones(len(points), dtype=bool)
+    order = []
+    current = start
+    for _ in range(len(points)):
+        candidates = np.flatnonzero(remaining)
+        nxt = int(candidates[np.argmin(d[current, points[candidates]])])
+        order.append(nxt)
+        remaining[nxt] = False
+        current = points[nxt]
+
+    order = np.array(order)
+    n = len(order)
+    i, j = np.triu_indices(n, k=1)
+    while True:
+        # Reversing order[i..j] replaces edges (i-1, i) and (j, j+1) with (i-1, j) and (i, j+1)
+        path = np.concatenate([[start], points[order]])
+        has_after = j + 1 < n
+        after = path[np.minimum(j + 2, n)]
+        delta = (d[path[i], path[j + 1]] - d[path[i], path[i + 1]]
+                 + np.where(has_after, d[path[i + 1], after] - d[path[j + 1], after], 0.0))
+        best = int(np.argmin(delta))
+        if not delta[best] < -1e-9:
+            break
+        order[i[best]:j[best] + 1] = order[i[best]:j[best] + 1][::-1]
+    return order.tolist()
+
+
+# --- Worker processes ---
+
+_WORKER = None
+_POOLS = {}  # (weights path, workers) -> (pool, weights mtime)
+_POOLS_LOCK = threading.Lock()
+
+
+def default_workers():
+    """$DECOMPOSE_WORKERS, else at most two: every worker holds its own TensorFlow runtime and weights"""
+    return int(os.getenv("DECOMPOSE_WORKERS", "0")) or min(2, os.cpu_count() or 1)
+
+
+def _init_worker(model_path):
+    global _WORKER
+    from inference import LogisticsOptimizer
+    _WORKER = LogisticsOptimizer(model_path)
+
+
+def _solve_in_worker(job):
+    scenario, engine, options = job
+    return _WORKER.optimize_routes(scenario, engine=engine, **options)
+
+
+def _worker_ready(_):
+    # Long enough that each call lands on a different worker
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def cluster_pool(model_path, workers):
+    """
+    Process pool whose workers each hold a LogisticsOptimizer for
+    model_path, with all workers started and their weights loaded. It is
+    kept for reuse until the weights file changes; the pool for the old
+    weights is then shut down once its pending clusters are solved.
+    """
+    key = (os.path.abspath(model_path), workers)
+    try:
+        version = os.stat(key[0]).st_mtime_ns
+    except OSError:
+        version = None
+    with _POOLS_LOCK:
+        pool, pool_version = _POOLS.get(key, (None, None))
+        if pool is None or pool_version != version:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            # TensorFlow does not survive fork(), so workers start fresh
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=(model_path,))
+            try:
+                list(pool.map(_worker_ready, range(workers)))
+            except Exception:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            _POOLS[key] = (pool, version)
+        return pool
+
+
+# --- Decomposition ---
+
+class Decomposer:
+    """
+    Solve a scenario of any size as clusters of at most max_locations
+    locations. Clusters are solved in `workers` processes (default: see
+    default_workers); with one worker, or a single cluster, they are
+    solved in-process by `optimizer`. Starting the worker processes does
+    not count against deadline_ms or budget_ms.
+    """
+
+    def __init__(self, optimizer, max_locations, workers=None):
+        self.optimizer = optimizer
+        self.max_locations = max_locations
+        self.workers = default_workers() if workers is None else workers
+
+    def plan_clusters(self, scenario):
+        """
+        Returns (clusters, preloaded): clusters is a list of (vehicle,
+        entry, packages) in visiting order, where entry is the location the
+        vehicle comes from (its start for its first cluster, else the
+        previous cluster's medoid); preloaded holds the vehicles whose
+        packages are all loaded at their start.
+        """
+        dist = scenario["distance_matrix"]
+        p, v = scenario["packages"], scenario["vehicles"]
+        servable = (p["pickup"] >= 0) & (p["delivery"] >= 0) & (p["weight"] <= v["capacity"].max())
+        starts = np.where(v["location"] >= 0, v["location"], 0)
+
+        # Leave room for the entry point and, if packages come from elsewhere, some pickup sites
+        stops = np.unique(p["delivery"][servable])
+        outside = np.setdiff1d(np.unique(p["pickup"][servable]), stops)
+        reserved = 1 + min(len(outside), max(1, self.max_locations // 4))
+        clusters = cluster_locations(dist, stops, self.max_locations - reserved)
+
+        # Packages of each cluster, split further where their sites do not fit
+        by_stop = {}
+        for i in np.flatnonzero(servable):
+            by_stop.setdefault(int(p["delivery"][i]), []).append(int(i))
+        groups = []
+        for cluster in clusters:
+            group, sites = [], set()
+            for stop in cluster.tolist():
+                for i in by_stop[stop]:
+                    needed = {stop, int(p["pickup"][i])} - sites
+                    if group and len(sites) + len(needed) + 1 > self.max_locations:
+                        groups.append(group)
+                        group, sites = [], set()
+                        needed = {stop, int(p["pickup"][i])}
+                    group.append(i)
+                    sites |= needed
+            if group:
+                groups.append(group)
+        if not groups:
+            return [], set()
+
+        # One tour over the group medoids, cut into stretches of about equal package count
+        d = _finite(dist)
+        medoids = [medoid(d, np.unique(p["delivery"][g])) for g in groups]
+        tour = order_tour(dist, int(starts[0]), medoids)
+        n_vehicles = len(v["id"])
+        cumulative = np.cumsum([len(groups[g]) for g in tour])
+        cuts = np.searchsorted(cumulative, np.arange(1, n_vehicles) * cumulative[-1] / n_vehicles) + 1
+        stretches = [s for s in np.split(np.array(tour), np.minimum(cuts, len(tour))) if len(s)]
+
+        # Longest stretch first, each to the free vehicle starting nearest to it
+        free = list(range(n_vehicles))
+        plan, preloaded = [], set()
+        for stretch in sorted(stretches, key=len, reverse=True):
+            vehicle = min(free, key=lambda u: d[starts[u], medoids[stretch[0]]])
+            free.remove(vehicle)
+            packages = [i for g in stretch for i in groups[g]]
+            if (np.all(p["pickup"][packages] == starts[vehicle])
+                    and p["weight"][packages].sum() <= v["capacity"][vehicle]):
+                preloaded.add(vehicle)
+            entry = int(starts[vehicle])
+            for g in stretch:
+                plan.append((vehicle, entry, groups[g]))
+                entry = medoids[g]
+        return plan, preloaded
+
+    def cluster_scenario(self, scenario, vehicle, entry, packages, preload, first):
+        """
+        Compact scenario for one cluster. Location 0 is where the vehicle
+        enters: its real start for its first cluster, otherwise a stand-in
+        (ENTRY) with the previous medoid's distances, so nothing is picked
+        up there by accident. Preloaded packages are picked up at location 0.
+        """
+        p, v = scenario["packages"], scenario["vehicles"]
+        pickups = p["pickup"][packages]
+        deliveries = p["delivery"][packages]
+        sites = np.unique(deliveries if preload else np.concatenate([pickups, deliveries]))
+        sites = sites[sites != entry] if first else sites
+        index = np.concatenate([[entry], sites]).astype(np.intp)
+        position = {int(loc): k for k, loc in enumerate(index)} if first else \
+            {int(loc): k + 1 for k, loc in enumerate(sites)}
+
+        names = [scenario["locations"][i] for i in index]
+        if not first:
+            names[0] = ENTRY
+        return {
+            "format": wire_format.COMPACT_FORMAT,
+            "locations": names,
+            "distance_matrix": scenario["distance_matrix"][np.ix_(index, index)],
+            "metric": True,
+            "packages": {
+                "id": p["id"][packages],
+                "pickup": np.array([0 if preload else position[int(x)] for x in pickups], dtype=np.int32),
+                "delivery": np.array([position[int(x)] for x in deliveries], dtype=np.int32),
+                "weight": p["weight"][packages],
+                "priority": p["priority"][packages],
+            },
+            "vehicles": {key: column[[vehicle]] for key, column in v.items()} | {"location": np.zeros(1, np.int32)},
+        }
+
+    def solve(self, scenario_dict, engine="dqn", options=None):
+        started = time.perf_counter()
+        options = {k: val for k, val in (options or {}).items() if val is not None}
+        scenario = to_compact(scenario_dict)
+        plan, preloaded = self.plan_clusters(scenario)
+
+        seen = set()
+        jobs = []
+        for vehicle, entry, packages in plan:
+            jobs.append(self.cluster_scenario(scenario, vehicle, entry, packages, vehicle in preloaded,
+                                              first=vehicle not in seen))
+            seen.add(vehicle)
+
+        workers = max(1, min(self.workers, len(jobs)))
+        if workers > 1:
+            waited = time.perf_counter()
+            pool = cluster_pool(self.optimizer.model_path, self.workers)
+            started += time.perf_counter() - waited
+        for name in ("deadline_ms", "budget_ms"):
+            if name in options:
+                # Clusters run in rounds of `workers`; keep a tenth of the time for stitching
+                remaining = options[name] * 0.9 - (time.perf_counter() - started) * 1000
+                options[name] = max(0.0, remaining) * workers / max(len(jobs), 1)
+        if workers == 1:
+            results = [self.optimizer.optimize_routes(job, engine=engine, **options) for job in jobs]
+        else:
+            results = list(pool.map(_solve_in_worker, [(job, engine, options) for job in jobs]))
+        solve_seconds = time.perf_counter() - started  # without starting the workers
+
+        result = self.stitch(scenario, plan, preloaded, results)
+        engines = {}
+        for r in results:
+            engines[r.get("engine")] = engines.get(r.get("engine"), 0) + 1
+        result.update(engine="decomposed", optimal=False, decomposition={
+            "clusters": len(jobs),
+            "max_cluster_locations": max((len(job["locations"]) for job in jobs), default=0),
+            "workers": workers,
+            "cluster_engines": engines,
+            "solve_seconds": round(solve_seconds, 3),
+        })
+        return result
+
+    def stitch(self, scenario, plan, preloaded, results):
+        """
+        One execution plan from the cluster plans: per vehicle in visiting
+        order, with times, distances and costs recomputed on the full
+        matrix from the vehicle's start.
+        """
+        dist = scenario["distance_matrix"]
+        names = scenario["locations"]
+        index = {name: i for i, name in enumerate(names)}
+        p, v = scenario["packages"], scenario["vehicles"]
+        starts = np.where(v["location"] >= 0, v["location"], 0)
+
+        # Per vehicle: [(location or None for a wait, pickups, deliveries, wait duration)]
+        moves = {u: [] for u in range(len(v["id"]))}
+        loaded = {u: [] for u in preloaded}
+        for (vehicle, entry, packages), result in zip(plan, results):
+            steps = [s for s in result["execution_plan"]]
+            delivered = {d for s in steps if s["action"] == "move_to" for d in s["deliveries"]}
+            picked = {q for s in steps if s["action"] == "move_to" for q in s["pickups"]}
+            if vehicle in preloaded:
+                loaded[vehicle].extend(sorted(delivered, key=str))
+            elif delivered - picked:
+                # The policy's plan leaves out pickups at the location it starts from
+                moves[vehicle].append((int(starts[vehicle]), sorted(delivered - picked, key=str), [], 0))
+            for s in steps:
+                if s["action"] == "wait":
+                    moves[vehicle].append((None, [], [], s.get("duration", 10)))
+                    continue
+                pickups = [] if vehicle in preloaded else [q for q in s["pickups"] if q in delivered]
+                if s["destination"] == ENTRY:
+                    continue
+                moves[vehicle].append((index[s["destination"]], pickups, s["deliveries"], 0))
+
+        execution_plan = []
+        vehicle_routes = {}
+        total_distance = total_cost = total_time = 0.0
+        delivered_ids = set()
+        for u, vehicle_moves in moves.items():
+            vehicle_id = v["id"][u].item()
+            loc = int(starts[u])
+            vehicle_routes[vehicle_id] = [names[loc]]
+            if loaded.get(u):
+                vehicle_moves.insert(0, (loc, loaded[u], [], 0))
+            t = 0.0
+            for stop, pickups, deliveries, duration in vehicle_moves:
+                if stop is None:
+                    execution_plan.append({"time": t, "vehicle_id": vehicle_id, "action": "wait", "duration": duration})
+                    t += duration
+                    continue
+                if stop == loc and not pickups and not deliveries:
+                    continue
+                distance = float(dist[loc, stop])
+                cost = distance * v["cost_per_km"][u].item()
+                execution_plan.append({
+                    "time": t,
+                    "vehicle_id": vehicle_id,
+                    "action": "move_to",
+                    "destination": names[stop],
+                    "pickups": pickups,
+                    "deliveries": deliveries,
+                    "distance": distance,
+                    "cost": cost
+                })
+                if stop != loc:
+                    vehicle_routes[vehicle_id].append(names[stop])
+                t += distance / v["speed"][u].item()
+                total_distance += distance
+                total_cost += cost
+                delivered_ids.update(deliveries)
+                loc = stop
+            total_time = max(total_time, t)
+
+        execution_plan.sort(key=lambda step: step["time"])
+        ids = p["id"].tolist()
+        return {
+            "success": len(delivered_ids) == len(ids),
+            "execution_plan": execution_plan,
+            "metrics": {
+                "total_time": total_time,
+                "total_distance": total_distance,
+                "total_cost": total_cost,
+                "packages_delivered": len(delivered_ids),
+                "total_packages": len(ids),
+                "delivery_rate": len(delivered_ids) / len(ids) if ids else 0,
+                "vehicles_used": len(set(step["vehicle_id"] for step in execution_plan if step["action"] == "move_to"))
+            },
+            "vehicle_routes": vehicle_routes,
+            "undelivered_packages": [i for i in ids if i not in delivered_ids]
+        }
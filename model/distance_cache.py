@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.getenv("DISTANCE_CACHE_DIR", "distance_cache")
+
+
+def network_fingerprint(locations, routes):
+    """
+    Canonical hash of a route network: sorted location names plus every
+    route as (start, end, distance, traffic_factor), sorted. Route order
+    and list order of locations do not change the fingerprint.
+    """
+    canonical_routes = sorted(
+        (r.start_location, r.end_location, float(r.distance), float(getattr(r, "traffic_factor", 1.0)))
+        for r in routes
+    )
+    payload = json.dumps([sorted(locations), canonical_routes], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DistanceMatrixCache:
+    """
+    Two-tier cache of all-pairs distance matrices keyed by network_fingerprint().
+
+    Tier 1 is an in-process LRU bounded by total array bytes. Tier 2 is a
+    directory of .npy snapshots opened with mmap_mode='r', bounded by total
+    file bytes (oldest-accessed files are removed first), so a restarted
+    worker starts warm. Cached arrays are read-only; callers must not
+    modify them in place.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # fingerprint -> np.ndarray
+        self._memory_bytes = 0
+
+        self.stats = {
+            "memory_hits": 0, "memory_misses": 0, "memory_evictions": 0,
+            "disk_hits": 0, "disk_misses": 0, "disk_evictions": 0, "disk_errors": 0,
+        }
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    # --- Memory tier ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            matrix = self._memory.get(key)
+            if matrix is None:
+                self.stats["memory_misses"] += 1
+                return None
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return matrix
+
+    def _memory_put(self, key, matrix):
+        if matrix.nbytes > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = matrix
+            self._memory_bytes += matrix.nbytes
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+                self.stats["memory_evictions"] += 1
+
+    # --- Disk tier ---
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            matrix = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            self._count("disk_misses")
+            return None
+        try:
+            os.utime(path)  # access time drives disk eviction
+        except OSError:
+            self._count("disk_errors")
+        self._count("disk_hits")
+        return matrix
+
+    def _disk_put(self, key, matrix):
+        """Best effort: a disk that is full, read-only or not ours leaves the matrix in memory only"""
+        if not self.cache_dir:
+            return
+        # Write to a temp file and rename so readers never see a partial snapshot
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, matrix)
+            os.replace(tmp_path, self._path(key))
+            self._evict_disk()
+        except OSError as e:
+            print(f"Distance cache could not write '{self._path(key)}': {e}")
+            self._count("disk_errors")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+            self._count("disk_evictions")
+
+    # --- Public API ---
+
+    def get(self, key):
+        matrix = self._memory_get(key)
+        if matrix is not None:
+            return matrix
+        matrix = self._disk_get(key)
+        if matrix is not None:
+            self._memory_put(key, matrix)
+        return matrix
+
+    def put(self, key, matrix):
+        matrix = np.asarray(matrix)
+        self._disk_put(key, matrix)
+        matrix = matrix.view()
+        matrix.flags.writeable = False
+        self._memory_put(key, matrix)
+        return matrix
+
+    def get_or_compute(self, locations, routes, compute):
+        """Return the cached matrix for this network, calling compute() on a miss"""
+        key = network_fingerprint(locations, routes)
+        matrix = self.get(key)
+        if matrix is None:
+            matrix = self.put(key, compute())
+        return matrix
@@ -0,0 +1,197 @@
+"""
+Exact single-vehicle solver (Held-Karp dynamic programming over subsets).
+
+The DP runs over the pickup and delivery events of one vehicle. A state is
+the set of events already done plus the event done last. The load after a
+set of events does not depend on their order, so the capacity check and
+the pickup-before-delivery rule are both checked per subset and never per
+path. Subsets are processed one popcount layer at a time. Each layer is a
+handful of NumPy operations, one per possible last event.
+
+If all packages fit in the vehicle at once, capacity can never bind.
+Packages picked up at the start location are then loaded before the
+vehicle leaves, and packages with the same pickup and delivery are merged
+into one job. For the backend's one-source, N-destination jobs this
+leaves one event per destination, so the DP has 2^N subsets.
+
+Time windows follow the environment: a package cannot be picked up after
+the end of its time_window, and window starts are ignored (arriving
+early is allowed). The vehicle never waits, so for every state the
+cheapest path is also the earliest one, and dropping states whose last
+pickup is late keeps the DP exact. A preloaded job whose window has
+closed by the time the vehicle starts is not served.
+"""
+import time
+
+import numpy as np
+
+EPS = 1e-9
+
+
+class HeldKarpSolver:
+    """Provably optimal pickup-and-delivery route for a single vehicle"""
+
+    def __init__(self, distance_matrix, pickup, delivery, weight, start, capacity,
+                 servable=None, close=None, speed=1.0, ready=0.0,
+                 max_events=15, max_memory_mb=256, time_limit=1.0):
+        self.dist = np.asarray(distance_matrix, dtype=np.float64)
+        self.pickup = np.asarray(pickup, dtype=np.intp)
+        self.delivery = np.asarray(delivery, dtype=np.intp)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.start = int(start)
+        self.capacity = float(capacity)
+        servable = (np.ones(len(self.pickup), dtype=bool) if servable is None
+                    else np.asarray(servable, dtype=bool))
+        # Latest pickup time per package, checked against ready + distance / speed
+        self.close = np.full(len(self.pickup), np.inf) if close is None else np.asarray(close, dtype=np.float64)
+        self.speed = float(speed)
+        self.ready = float(ready)
+        # A package heavier than the vehicle, or closed before it leaves, can never be delivered
+        self.servable = servable & (self.weight <= self.capacity + EPS) & (self.close >= self.ready - EPS)
+        self.max_events = max_events
+        self.max_memory_mb = max_memory_mb
+        self.time_limit = time_limit
+        self.reason = None  # why the last solve() returned None
+        self._build_events()
+
+    @classmethod
+    def from_env(cls, env, **limits):
+        """Solver over a single-vehicle scenario loaded into an ImprovedLogisticsEnvironment"""
+        if len(env.veh_location) != 1:
+            raise ValueError("HeldKarpSolver handles exactly one vehicle")
+        return cls(env.distance_matrix, env.pkg_pickup, env.pkg_delivery, env.pkg_weight,
+                   env.veh_location[0], env.veh_capacity[0],
+                   servable=env.pkg_pickup_known & env.pkg_delivery_known & (env.pkg_status == 0),
+                   close=[p.time_window[1] for p in env.packages],
+                   speed=env.veh_speed[0], ready=env.veh_available[0], **limits)
+
+    def _build_events(self):
+        """Group packages into jobs and list the DP events (location, load change, package events)"""
+        packages = np.flatnonzero(self.servable)
+        loose = self.weight[packages].sum() <= self.capacity + EPS
+
+        jobs = {}
+        for p in packages:
+            key = (self.pickup[p], self.delivery[p]) if loose else p
+            jobs.setdefault(key, []).append(int(p))
+
+        self.preloaded = []        # package pickup events done at the start
+        self.event_loc = []
+        self.event_load = []
+        self.event_packages = []   # package events (2p / 2p+1) behind each DP event
+        self.event_after = []      # DP event that must precede this one, or -1
+        self.event_close = []      # latest arrival at this event
+        for members in jobs.values():
+            p = members[0]
+            w = float(self.weight[members].sum())
+            if loose and self.pickup[p] == self.start:
+                self.preloaded.extend(2 * m for m in members)
+                after = -1
+            else:
+                after = len(self.event_loc)
+                self.event_loc.append(self.pickup[p])
+                self.event_load.append(w)
+                self.event_packages.append([2 * m for m in members])
+                self.event_after.append(-1)
+                self.event_close.append(float(self.close[members].min()))
+            self.event_loc.append(self.delivery[p])
+            self.event_load.append(-w)
+            self.event_packages.append([2 * m + 1 for m in members])
+            self.event_after.append(after)
+            self.event_close.append(np.inf)
+
+        self.event_loc = np.asarray(self.event_loc, dtype=np.intp)
+        self.event_load = np.asarray(self.event_load, dtype=np.float64)
+        self.event_after = np.asarray(self.event_after, dtype=np.intp)
+        # Latest cumulative distance at which each event can still be reached
+        self.event_budget = (np.asarray(self.event_close, dtype=np.float64) - self.ready) * self.speed + EPS
+        self.initial_load = float(self.weight[[e >> 1 for e in self.preloaded]].sum())
+
+    @property
+    def num_events(self):
+        return len(self.event_loc)
+
+    def memory_mb(self):
+        """Estimated peak memory of the DP tables"""
+        m = self.num_events
+        # cost (float64) + parent (int8) per state, plus per-subset bits, load and flags
+        return (2 ** m) * (m * 9 + m + 16) / 2 ** 20
+
+    def applicable(self):
+        if self.num_events > self.max_events:
+            self.reason = f"{self.num_events} events exceed the limit of {self.max_events}"
+        elif self.memory_mb() > self.max_memory_mb:
+            self.reason = f"needs ~{self.memory_mb():.0f} MB, limit is {self.max_memory_mb} MB"
+        else:
+            self.reason = None
+        return self.reason is None
+
+    # --- DP ---
+    def _subset_feasibility(self, masks):
+        """Which subsets respect capacity and pickup-before-delivery"""
+        m = self.num_events
+        bits = ((masks[:, None] >> np.arange(m)) & 1).astype(np.uint8)
+        load = self.initial_load + bits @ self.event_load
+        ok = load <= self.capacity + EPS
+        for e in np.flatnonzero(self.event_after >= 0):
+            ok &= bits[:, e] <= bits[:, self.event_after[e]]
+        return ok, bits.sum(axis=1)
+
+    def solve(self):
+        """
+        Optimal route as a list of package events, or None when the
+        instance is over the size/memory guards, runs past time_limit or
+        has no feasible route (the reason is left in self.reason).
+        """
+        if not self.applicable():
+            return None
+        m = self.num_events
+        if m == 0:
+            return list(self.preloaded)
+        deadline = time.perf_counter() + self.time_limit
+
+        masks = np.arange(2 ** m, dtype=np.int64)
+        ok, popcount = self._subset_feasibility(masks)
+        step = self.dist[np.ix_(self.event_loc, self.event_loc)]
+        cost = np.full((2 ** m, m), np.inf)
+        parent = np.full((2 ** m, m), -1, dtype=np.int8)
+
+        first = 1 << np.arange(m)
+        reach = self.dist[self.start, self.event_loc]
+        cost[first, np.arange(m)] = np.where(ok[first] & (reach <= self.event_budget), reach, np.inf)
+
+        for size in range(2, m + 1):
+            layer = masks[(popcount == size) & ok]
+            for j in range(m):
+                sel = layer[(layer >> j) & 1 == 1]
+                if not sel.size:
+                    continue
+                candidates = cost[sel ^ (1 << j)] + step[:, j]
+                best = np.argmin(candidates, axis=1)
+                value = candidates[np.arange(len(sel)), best]
+                cost[sel, j] = np.where(value <= self.event_budget[j], value, np.inf)
+                parent[sel, j] = best
+            if time.perf_counter() > deadline:
+                self.reason = f"time limit of {self.time_limit}s reached at layer {size}/{m}"
+                return None
+
+        full = 2 ** m - 1
+        last = int(np.argmin(cost[full]))
+        if not np.isfinite(cost[full, last]):
+            self.reason = "no feasible route"
+            return None
+        self.cost = float(cost[full, last])
+
+        order = []
+        mask = full
+        while last >= 0:
+            order.append(last)
+            previous = int(parent[mask, last])
+            mask ^= 1 << last
+            last = previous if mask else -1
+        order.reverse()
+
+        route = list(self.preloaded)
+        for e in order:
+            route.extend(self.event_packages[e])
+        return route
@@ -0,0 +1,435 @@
+"""
+Classical pickup-and-delivery solver used as an alternative to the DQN rollout.
+
+A route is a list of events, 2 * package for its pickup and
+2 * package + 1 for its delivery, visited in order from the vehicle's
+start location (vehicles do not return). Routes are built by cheapest
+feasible insertion and then improved with 2-opt, or-opt and relocate
+moves; every move keeps each pickup before its delivery and the load
+within the vehicle capacity. Move deltas for all positions of a route
+are evaluated as NumPy arrays and only the most promising candidates are
+checked for feasibility.
+
+Time windows follow the environment: a package cannot be picked up after
+the end of its time_window, while arriving before the start is allowed
+(the environment only withholds a bonus). Vehicles leave at their clock
+in the environment and never wait, so each pickup's arrival time is the
+vehicle clock plus the distance so far over its speed; routes where a
+pickup arrives after its window closes are rejected by every move.
+Window starts are ignored.
+"""
+import time
+
+import numpy as np
+
+EPS = 1e-9
+
+
+class PDPSolver:
+    """Construction + local search over the environment's distance matrix"""
+
+    def __init__(self, distance_matrix, pickup, delivery, weight, priority,
+                 veh_start, veh_capacity, veh_cost, servable=None, close=None, veh_speed=None, veh_ready=None):
+        self.dist = np.asarray(distance_matrix, dtype=np.float64)
+        self.pickup = np.asarray(pickup, dtype=np.intp)
+        self.delivery = np.asarray(delivery, dtype=np.intp)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.priority = np.asarray(priority, dtype=np.float64)
+        self.veh_start = np.asarray(veh_start, dtype=np.intp)
+        self.veh_capacity = np.asarray(veh_capacity, dtype=np.float64)
+        self.veh_cost = np.asarray(veh_cost, dtype=np.float64)
+        self.servable = (np.ones(len(self.pickup), dtype=bool) if servable is None
+                         else np.asarray(servable, dtype=bool))
+        # Latest pickup time per package, and the vehicle clocks it is checked against
+        self.close = np.full(len(self.pickup), np.inf) if close is None else np.asarray(close, dtype=np.float64)
+        self.veh_speed = (np.ones(len(self.veh_start)) if veh_speed is None
+                          else np.asarray(veh_speed, dtype=np.float64))
+        self.veh_ready = (np.zeros(len(self.veh_start)) if veh_ready is None
+                          else np.asarray(veh_ready, dtype=np.float64))
+        self.timed = bool(np.isfinite(self.close[self.servable]).any())
+
+        self.routes = [[] for _ in range(len(self.veh_start))]
+        self.unassigned = []
+
+    @classmethod
+    def from_env(cls, env):
+        """Solver over a scenario already loaded into an ImprovedLogisticsEnvironment"""
+        return cls(env.distance_matrix, env.pkg_pickup, env.pkg_delivery, env.pkg_weight, env.pkg_priority,
+                   env.veh_location, env.veh_capacity, env.veh_cost,
+                   servable=env.pkg_pickup_known & env.pkg_delivery_known & (env.pkg_status == 0),
+                   close=[p.time_window[1] for p in env.packages],
+                   veh_speed=env.veh_speed, veh_ready=env.veh_available)
+
+    # --- Route evaluation ---
+    def event_locations(self, route):
+        ev = np.asarray(route, dtype=np.intp)
+        return np.where(ev & 1, self.delivery[ev >> 1], self.pickup[ev >> 1])
+
+    def path(self, v, route):
+        """Location sequence of a route including the start location"""
+        return np.concatenate([[self.veh_start[v]], self.event_locations(route)]).astype(np.intp)
+
+    def route_distance(self, v, route):
+        p = self.path(v, route)
+        return float(self.dist[p[:-1], p[1:]].sum())
+
+    def route_cost(self, v, route):
+        return self.veh_cost[v] * self.route_distance(v, route)
+
+    def total_cost(self, routes=None):
+        routes = self.routes if routes is None else routes
+        return sum(self.route_cost(v, r) for v, r in enumerate(routes))
+
+    def loads(self, route):
+        """Load carried after each event"""
+        ev = np.asarray(route, dtype=np.intp)
+        return np.cumsum(np.where(ev & 1, -self.weight[ev >> 1], self.weight[ev >> 1]))
+
+    def arrivals(self, v, route):
+        """Arrival time at each event"""
+        p = self.path(v, route)
+        return self.veh_ready[v] + np.cumsum(self.dist[p[:-1], p[1:]]) / self.veh_speed[v]
+
+    def on_time(self, v, route):
+        if not self.timed or not route:
+            return True
+        ev = np.asarray(route, dtype=np.intp)
+        pickups = (ev & 1) == 0
+        return bool(np.all(self.arrivals(v, route)[pickups] <= self.close[ev[pickups] >> 1] + EPS))
+
+    def feasible(self, v, route):
+        if route and self.loads(route).max() > self.veh_capacity[v] + EPS:
+            return False
+        if not self.on_time(v, route):
+            return False
+        picked = set()
+        for e in route:
+            if e & 1:
+                if (e >> 1) not in picked:
+                    return False
+            else:
+                picked.add(e >> 1)
+        return True
+
+    # --- Insertion ---
+    def best_insertion(self, v, pkg, route=None):
+        """
+        Cheapest feasible way to insert pkg into route v as (delta_cost,
+        i, j): pickup into gap i, delivery into gap j >= i, where gap g is
+        right after path position g. Returns (inf, -1, -1) if none fits.
+        """
+        route = self.routes[v] if route is None else route
+        if self.weight[pkg] > self.veh_capacity[v] + EPS:
+            return np.inf, -1, -1
+        D = self.dist
+        p = self.path(v, route)
+        n_gaps = len(p)
+        x, y = self.pickup[pkg], self.delivery[pkg]
+
+        # Edge each gap would break, and the edge back into the route (none after the last stop)
+        broken = np.append(D[p[:-1], p[1:]], 0.0)
+        following = np.append(p[1:], p[-1])
+        has_next = np.arange(n_gaps) < n_gaps - 1
+
+        into_x = D[p, x] + np.where(has_next, D[x, following], 0.0) - broken
+        into_y = D[p, y] + np.where(has_next, D[y, following], 0.0) - broken
+        both = D[p, x] + D[x, y] + np.where(has_next, D[y, following], 0.0) - broken
+
+        delta = into_x[:, None] + into_y[None, :]
+        np.fill_diagonal(delta, both)
+        upper = np.triu(np.ones((n_gaps, n_gaps), dtype=bool))
+
+        # Load at path positions (0 at the start); the package rides from gap i to gap j
+        load_at = np.concatenate([[0.0], self.loads(route)]) if route else np.zeros(1)
+        window = np.where(upper, load_at[None, :], -np.inf)
+        peak = np.maximum.accumulate(window, axis=1)
+        fits = upper & (peak + self.weight[pkg] <= self.veh_capacity[v] + EPS)
+
+        delta = np.where(fits, delta, np.inf)
+        delta[np.isnan(delta)] = np.inf
+        if self.timed:
+            # Cheapest insertion that keeps every pickup on the route on time
+            for flat in np.argsort(delta, axis=None):
+                i, j = divmod(int(flat), n_gaps)
+                if not np.isfinite(delta[i, j]):
+                    break
+                candidate = list(route)
+                self.insert(candidate, pkg, i, j)
+                if self.on_time(v, candidate):
+                    return self.veh_cost[v] * float(delta[i, j]), i, j
+            return np.inf, -1, -1
+        flat = int(np.argmin(delta))
+        i, j = divmod(flat, n_gaps)
+        if not np.isfinite(delta[i, j]):
+            return np.inf, -1, -1
+        return self.veh_cost[v] * float(delta[i, j]), i, j
+
+    @staticmethod
+    def insert(route, pkg, i, j):
+        route.insert(j, 2 * pkg + 1)
+        route.insert(i, 2 * pkg)
+
+    def _insert_best(self, pkg):
+        best = (np.inf, -1, -1, -1)
+        for v in range(len(self.routes)):
+            delta, i, j = self.best_insertion(v, pkg)
+            if delta < best[0]:
+                best = (delta, v, i, j)
+        if not np.isfinite(best[0]):
+            return False
+        _, v, i, j = best
+        self.insert(self.routes[v], pkg, i, j)
+        return True
+
+    def construct(self):
+        """Cheapest insertion, urgent and long-haul packages first"""
+        candidates = np.flatnonzero(self.servable)
+        haul = self.dist[self.pickup[candidates], self.delivery[candidates]]
+        haul = np.where(np.isfinite(haul), haul, 0.0)
+        order = candidates[np.lexsort((-haul, -self.priority[candidates]))]
+        self.unassigned = [int(pkg) for pkg in order if not self._insert_best(int(pkg))]
+        return self.routes
+
+    # --- Local search ---
+    def _two_opt(self, v):
+        """Best improving feasible segment reversal in route v"""
+        route = self.routes[v]
+        if len(route) < 2:
+            return False
+        D = self.dist
+        p = self.path(v, route)
+        L = len(route)
+        pos = np.arange(1, L + 1)
+        i, j = np.meshgrid(pos, pos, indexing="ij")
+        valid = j > i
+
+        # Reversing path positions i..j: the two boundary edges change and every
+        # edge inside the segment is traversed the other way
+        back = np.concatenate([[0.0], np.cumsum(D[p[1:], p[:-1]] - D[p[:-1], p[1:]])])
+        after = np.minimum(j + 1, L)
+        has_after = j < L
+        delta = (D[p[i - 1], p[j]] - D[p[i - 1], p[i]]
+                 + np.where(has_after, D[p[i], p[after]] - D[p[j], p[after]], 0.0)
+                 + back[j] - back[i])
+        return self._apply_first(v, np.where(valid, delta, np.inf),
+                                 lambda a, b: route[:a - 1] + route[a - 1:b][::-1] + route[b:])
+
+    def _or_opt(self, v, max_segment=3):
+        """Best improving feasible move of 1..max_segment consecutive events within route v"""
+        route = self.routes[v]
+        L = len(route)
+        if L < 2:
+            return False
+        D = self.dist
+        p = self.path(v, route)
+        best_moves = []
+        for size in range(1, min(max_segment, L - 1) + 1):
+            for start in range(L - size + 1):
+                segment = route[start:start + size]
+                rest = route[:start] + route[start + size:]
+                a, b = p[start + 1], p[start + size]
+                before = p[start]
+                removed = -D[before, a]
+                if start + size < L:
+                    nxt = p[start + size + 1]
+                    removed += D[before, nxt] - D[b, nxt]
+
+                q = self.path(v, rest)
+                following = np.append(q[1:], q[-1])
+                broken = np.append(D[q[:-1], q[1:]], 0.0)
+                has_next = np.arange(len(q)) < len(q) - 1
+                added = D[q, a] + np.where(has_next, D[b, following], 0.0) - broken
+                added[start] = np.inf  # putting it back where it was
+                g = int(np.argmin(added))
+                delta = removed + added[g]
+                if delta < -EPS:
+                    best_moves.append((delta, rest[:g] + segment + rest[g:]))
+        for delta, candidate in sorted(best_moves, key=lambda m: m[0]):
+            if self.feasible(v, candidate):
+                self.routes[v] = candidate
+                return True
+        return False
+
+    def _relocate(self):
+        """Move one package (both events) to its cheapest position in any route"""
+        improved = False
+        for v in range(len(self.routes)):
+            for pkg in sorted({e >> 1 for e in self.routes[v]}):
+                if pkg not in {e >> 1 for e in self.routes[v]}:
+                    continue
+                reduced = [e for e in self.routes[v] if e >> 1 != pkg]
+                saving = self.route_cost(v, self.routes[v]) - self.route_cost(v, reduced)
+                best = (np.inf, -1, -1, -1)
+                for w in range(len(self.routes)):
+                    delta, i, j = self.best_insertion(w, pkg, reduced if w == v else None)
+                    if delta < best[0]:
+                        best = (delta, w, i, j)
+                if best[0] < saving - EPS:
+                    _, w, i, j = best
+                    self.routes[v] = reduced
+                    self.insert(self.routes[w], pkg, i, j)
+                    improved = True
+        return improved
+
+    def _apply_first(self, v, delta, build):
+        order = np.argsort(delta, axis=None)
+        n = delta.shape[1]
+        for flat in order[:64]:
+            if not delta.flat[flat] < -EPS:
+                break
+            i, j = divmod(int(flat), n)
+            candidate = build(i + 1, j + 1)
+            if self.feasible(v, candidate):
+                self.routes[v] = candidate
+                return True
+        return False
+
+    def improve(self, deadline=None, max_rounds=100):
+        """Run the neighbourhoods until none improves (or the deadline passes)"""
+        for _ in range(max_rounds):
+            improved = False
+            for v in range(len(self.routes)):
+                while self._two_opt(v) or self._or_opt(v):
+                    improved = True
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return self.routes
+            improved = self._relocate() or improved
+            if self.unassigned:
+                self.unassigned = [pkg for pkg in self.unassigned if not self._insert_best(pkg)]
+            if not improved or (deadline is not None and time.perf_counter() > deadline):
+                break
+        return self.routes
+
+    def solve(self, deadline=None):
+        self.construct()
+        return self.improve(deadline=deadline)
+
+    # --- Anytime search ---
+    def objective(self):
+        """(undelivered servable packages, total cost); lower is better"""
+        return len(self.unassigned), self.total_cost()
+
+    def perturb(self, rng, strength=0.3):
+        """
+        Ruin and recreate: pull up to `strength` of the routed packages out
+        and reinsert them (and any unassigned ones) in random order.
+        Returns False if there is nothing to perturb.
+        """
+        assigned = sorted({e >> 1 for route in self.routes for e in route})
+        if not assigned:
+            return False
+        k = int(rng.integers(1, max(1, int(strength * len(assigned))) + 1))
+        removed = {int(pkg) for pkg in rng.choice(assigned, size=k, replace=False)}
+        self.routes = [[e for e in route if e >> 1 not in removed] for route in self.routes]
+        pending = [int(pkg) for pkg in rng.permutation(sorted(removed) + self.unassigned)]
+        self.unassigned = [pkg for pkg in pending if not self._insert_best(pkg)]
+        return True
+
+    def anytime(self, deadline, rng=None, on_improve=None):
+        """
+        Construct and improve a first plan, then repeat perturb + improve
+        from the best routes found until `deadline` (time.perf_counter()).
+        on_improve(source, routes, objective) is called for the first plan
+        and for every later improvement; the best routes are returned.
+        """
+        rng = np.random.default_rng(0) if rng is None else rng
+        best = None
+        best_routes = best_unassigned = None
+
+        def keep_if_better(source):
+            nonlocal best, best_routes, best_unassigned
+            current = self.objective()
+            if best is None or current[0] < best[0] or (current[0] == best[0] and current[1] < best[1] - EPS):
+                best, best_routes, best_unassigned = current, [list(r) for r in self.routes], list(self.unassigned)
+                if on_improve is not None:
+                    on_improve(source, best_routes, best)
+                return True
+            return False
+
+        self.construct()
+        keep_if_better("construct")
+        self.improve(deadline=deadline)
+        keep_if_better("local_search")
+
+        while time.perf_counter() < deadline:
+            if not self.perturb(rng):
+                break
+            self.improve(deadline=deadline)
+            if not keep_if_better("perturbation"):
+                self.routes, self.unassigned = [list(r) for r in best_routes], list(best_unassigned)
+        self.routes, self.unassigned = best_routes, best_unassigned
+        return self.routes
+
+
+def routes_to_result(env, packages, vehicles, routes, dist=None):
+    """
+    Turn event routes into the optimize_routes result dict: stops at the
+    same location are merged, travel times use each vehicle's speed from
+    its clock in the environment, and the execution plan is ordered by
+    departure time.
+    """
+    D = env.distance_matrix if dist is None else dist
+    execution_plan = []
+    vehicle_routes = {}
+    total_distance = total_cost = total_time = 0.0
+    delivered = set()
+
+    for v, route in enumerate(routes):
+        vehicle = vehicles[v]
+        loc = int(env.veh_location[v])
+        vehicle_routes[vehicle.id] = [vehicle.current_location]
+        t = float(env.veh_available[v])
+        k = 0
+        while k < len(route):
+            stop = int(env.pkg_delivery[route[k] >> 1] if route[k] & 1 else env.pkg_pickup[route[k] >> 1])
+            pickups, deliveries = [], []
+            while k < len(route):
+                e = route[k]
+                event_loc = int(env.pkg_delivery[e >> 1] if e & 1 else env.pkg_pickup[e >> 1])
+                if event_loc != stop:
+                    break
+                if e & 1:
+                    deliveries.append(packages[e >> 1].id)
+                    delivered.add(e >> 1)
+                else:
+                    pickups.append(packages[e >> 1].id)
+                k += 1
+            distance = float(D[loc, stop])
+            cost = distance * vehicle.cost_per_km
+            execution_plan.append({
+                "time": t,
+                "vehicle_id": vehicle.id,
+                "action": "move_to",
+                "destination": env.locations[stop],
+                "pickups": pickups,
+                "deliveries": deliveries,
+                "distance": distance,
+                "cost": cost
+            })
+            if stop != loc:
+                vehicle_routes[vehicle.id].append(env.locations[stop])
+            t += distance / vehicle.speed
+            total_distance += distance
+            total_cost += cost
+            loc = stop
+        total_time = max(total_time, t)
+
+    execution_plan.sort(key=lambda step: step["time"])
+    for i, p in enumerate(packages):
+        p.status = 2 if i in delivered else 0
+
+    return {
+        "success": len(delivered) == len(packages),
+        "execution_plan": execution_plan,
+        "metrics": {
+            "total_time": total_time,
+            "total_distance": total_distance,
+            "total_cost": total_cost,
+            "packages_delivered": len(delivered),
+            "total_packages": len(packages),
+            "delivery_rate": len(delivered) / len(packages) if packages else 0,
+            "vehicles_used": len(set(step["vehicle_id"] for step in execution_plan if step["action"] == "move_to"))
+        },
+        "vehicle_routes": vehicle_routes,
+        "undelivered_packages": [p.id for i, p in enumerate(packages) if i not in delivered]
+    }
@@ -8,6 +8,32 @@ import json
 from dataclasses import dataclass, field, asdict
 from typing import List, Tuple, Dict, Any
 import pickle
+import os
+import logging
+import time
+
+from shortest_path import direct_edge_matrix, shortest_path_matrix
+from replay_memory import ReplayMemory
+from logistics_shared import wire_format
+from heuristic import PDPSolver, routes_to_result
+from exact import HeldKarpSolver
+from decomposition import Decomposer, location_count
+
+# Single-vehicle scenarios within these limits are solved exactly (exact.py)
+# whatever engine was asked for; EXACT_MAX_EVENTS=0 turns that off.
+EXACT_LIMITS = {
+    "max_events": int(os.getenv("EXACT_MAX_EVENTS", "15")),
+    "max_memory_mb": float(os.getenv("EXACT_MAX_MEMORY_MB", "256")),
+    "time_limit": float(os.getenv("EXACT_TIME_LIMIT", "1.0")),
+}
+
+# The heuristic has no location limit, so scenarios beyond the policy's
+# locations are only decomposed for it above HEURISTIC_MAX_PACKAGES packages
+# (a full solve takes ~3 s at 200), or when its construction, which grows
+# with the cube of the package count (~0.25 s at 250 packages, ~2 s at 500),
+# is not expected to finish within half of the deadline.
+HEURISTIC_MAX_PACKAGES = int(os.getenv("HEURISTIC_MAX_PACKAGES", "200"))
+HEURISTIC_CONSTRUCT_SECONDS = 1.6e-8  # per package cubed
 
 @dataclass
 class Route:
@@ -44,16 +70,52 @@ class Vehicle:
 class LogisticsOptimizer:
     """Main class for using the trained model"""
     
-    def __init__(self, model_path="improved_logistics_model"):
-        self.env = ImprovedLogisticsEnvironment()
+    def __init__(self, model_path="improved_logistics_model", agent=None, distance_cache=None):
+        self.env = ImprovedLogisticsEnvironment(distance_cache=distance_cache)
+        self.model_path = model_path  # loaded again by decomposition worker processes
+        if agent is not None:
+            # Shared, already-loaded agent (see registry.ModelRegistry)
+            self.agent = agent
+            return
         self.agent = ImprovedDQNAgent(self.env.state_size, self.env.action_space_size)
         self.agent.load(model_path)
         self.agent.epsilon = 0  # No exploration during inference
     
-    def optimize_routes(self, scenario_dict):
+    ENGINES = ("dqn", "beam", "heuristic", "best")
+    exact_limits = EXACT_LIMITS
+    heuristic_max_packages = HEURISTIC_MAX_PACKAGES
+    
+    def optimize_routes(self, scenario_dict, engine="dqn", beam_width=4, beam_depth=None, deadline_ms=None,
+                        budget_ms=None):
         """
         Optimize routes for given scenario
         
+        engine picks the planner: "dqn" (greedy rollout of the trained
+        policy), "beam" (beam search over the policy's Q-values, see
+        _beam_rollout; beam_width and beam_depth trade latency for plan
+        quality), "heuristic" (insertion construction plus local search, see
+        heuristic.py) or "best" (greedy DQN and heuristic; the plan
+        delivering more packages, then the cheaper one, wins). The result
+        says which in "engine".
+        Single-vehicle scenarios small enough for exact.HeldKarpSolver (see
+        exact_limits) get the optimal plan instead, with engine "exact";
+        "optimal" in the result is True only for those.
+        Scenarios with more locations than the policy addresses are split
+        into clusters that are solved with the chosen engine and stitched
+        back together (see decomposition.py); their engine is "decomposed".
+        The heuristic and "best" engines only do so when the scenario is too
+        large for the heuristic as a whole (see _heuristic_fits); otherwise
+        the heuristic plans the whole scenario and "best" compares it with
+        the decomposed policy plan.
+        
+        With deadline_ms the call becomes an anytime search that returns
+        within that many milliseconds (see _anytime), and the result also
+        carries "deadline_ms" and an improvement "trace".
+        budget_ms is a hard cap on the plain (non-anytime) planners instead:
+        the exact solver, rollouts, local search and decomposition stop once
+        it is spent and return the plan they have, which may leave packages
+        undelivered. It also caps deadline_ms.
+        
         Input format:
         {
             "locations": ["Location_A", "Location_B", ...],
@@ -84,6 +146,11 @@ class LogisticsOptimizer:
             ]
         }
         
+        The compact index-based format from logistics_shared.wire_format (dense distance
+        matrix, location indices) is accepted as well; its matrix is used
+        directly, without rebuilding it from routes, and the shortest-path
+        pass is skipped when the scenario is marked "metric".
+        
         Output format:
         {
             "success": bool,
@@ -111,6 +178,145 @@ class LogisticsOptimizer:
         }
         """
         
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {self.ENGINES}")
+        if deadline_ms is not None and budget_ms is not None:
+            deadline_ms = min(deadline_ms, budget_ms)
+        started = time.perf_counter()
+        deadline = None if deadline_ms is None else started + deadline_ms / 1000
+        cap = None if budget_ms is None else started + budget_ms / 1000
+        policy = None
+        if location_count(scenario_dict) > self.env.max_locations:
+            if engine in ("dqn", "beam") or not self._heuristic_fits(
+                    scenario_dict, deadline_ms if deadline_ms is not None else budget_ms):
+                return self._decomposed(scenario_dict, engine, beam_width, beam_depth, deadline_ms, budget_ms)
+            if engine == "best":
+                # The policy only runs cluster by cluster; the heuristic plans the whole scenario
+                policy = self._decomposed(scenario_dict, "dqn", beam_width, beam_depth,
+                                          None if deadline_ms is None else deadline_ms / 2,
+                                          None if budget_ms is None else budget_ms / 2)
+            engine = "heuristic"
+        state, packages, vehicles = self._load(scenario_dict)
+        
+        exact = self._exact(packages, vehicles, deadline if deadline is not None else cap)
+        if exact is not None:
+            if deadline is not None:
+                exact.update(deadline_ms=deadline_ms, trace=[self._trace_entry(started, "exact", exact)])
+            return exact
+        
+        if deadline is not None:
+            return dict(self._anytime(state, packages, vehicles, engine, started, deadline, beam_width, beam_depth,
+                                      policy=policy),
+                        deadline_ms=deadline_ms)
+        
+        if engine == "dqn":
+            return dict(self._rollout(state, packages, vehicles, deadline=cap), engine="dqn", optimal=False)
+        if engine == "beam":
+            return dict(self._beam_rollout(state, packages, vehicles, beam_width, beam_depth, deadline=cap),
+                        engine="beam", optimal=False, beam={"width": beam_width, "depth": beam_depth})
+        
+        # The heuristic only reads the freshly loaded scenario, so it runs first
+        heuristic = dict(self._heuristic(packages, vehicles, deadline=cap), engine="heuristic", optimal=False)
+        if policy is not None:
+            return min((heuristic, policy), key=self._rank)
+        if engine == "heuristic":
+            return heuristic
+        
+        for p in packages:
+            p.status = 0  # routes_to_result marked the heuristic's deliveries
+        dqn = dict(self._rollout(state, packages, vehicles, deadline=cap), engine="dqn", optimal=False)
+        best = min((heuristic, dqn), key=self._rank)
+        for p in packages:
+            p.status = 2 if p.id not in best["undelivered_packages"] else 0
+        return best
+    
+    @staticmethod
+    def _rank(result):
+        """Sort key for plans: more deliveries first, then lower cost"""
+        return -result["metrics"]["packages_delivered"], result["metrics"]["total_cost"]
+    
+    @staticmethod
+    def _trace_entry(started, source, result):
+        return {
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "source": source,
+            "packages_delivered": result["metrics"]["packages_delivered"],
+            "total_cost": float(result["metrics"]["total_cost"]),
+        }
+    
+    def _anytime(self, state, packages, vehicles, engine, started, deadline, beam_width=4, beam_depth=None,
+                 policy=None):
+        """
+        Best plan found before `deadline` (time.perf_counter()).
+        
+        The "dqn", "beam" and "best" engines start from the policy's plan,
+        cut short halfway to the deadline so that a stuck rollout cannot use
+        up the budget. The rest goes to PDPSolver.anytime: an insertion
+        plan (built even if the deadline has already passed, as it takes
+        milliseconds and the policy's plan may be partial), local search,
+        then rounds of perturbation and local search on the best routes so
+        far. Every plan that beats the best so far is recorded in "trace"
+        with its source and elapsed time, and the last of them is returned.
+        A policy plan computed elsewhere (the decomposed one for scenarios
+        beyond the policy's locations) can be passed in as `policy`.
+        """
+        trace = []
+        best = None
+        
+        def record(source, result):
+            nonlocal best
+            if best is None or self._rank(result) < self._rank(best):
+                best = result
+                trace.append(self._trace_entry(started, source, result))
+        
+        if policy is not None:
+            record(policy["engine"], policy)
+        elif engine in ("dqn", "beam", "best"):
+            snapshot = self.env.snapshot()
+            policy_deadline = started + (deadline - started) / 2
+            if engine == "beam":
+                first = dict(self._beam_rollout(state, packages, vehicles, beam_width, beam_depth,
+                                                deadline=policy_deadline),
+                             engine="beam", optimal=False, beam={"width": beam_width, "depth": beam_depth})
+            else:
+                first = dict(self._rollout(state, packages, vehicles, deadline=policy_deadline),
+                             engine="dqn", optimal=False)
+            record(first["engine"], first)
+            self.env.restore(snapshot)
+        
+        solver = PDPSolver.from_env(self.env)
+        solver.anytime(deadline, on_improve=lambda source, routes, objective: record(
+            source, dict(routes_to_result(self.env, packages, vehicles, routes), engine="heuristic", optimal=False)))
+        
+        for p in packages:
+            p.status = 2 if p.id not in best["undelivered_packages"] else 0
+        return dict(best, trace=trace)
+    
+    def _heuristic(self, packages, vehicles, deadline=None):
+        """Construction + local search plan for the loaded scenario, local search stopping at `deadline`"""
+        solver = PDPSolver.from_env(self.env)
+        routes = solver.solve(deadline=deadline)
+        return routes_to_result(self.env, packages, vehicles, routes)
+    
+    def _exact(self, packages, vehicles, deadline=None):
+        """Optimal plan for a small single-vehicle scenario, or None if it is out of range"""
+        if len(vehicles) != 1 or not self.exact_limits["max_events"]:
+            return None
+        limits = dict(self.exact_limits)
+        if deadline is not None:
+            limits["time_limit"] = min(limits["time_limit"], deadline - time.perf_counter())
+        solver = HeldKarpSolver.from_env(self.env, **limits)
+        route = solver.solve()
+        if route is None:
+            logging.debug("Exact solver skipped: %s", solver.reason)
+            return None
+        return dict(routes_to_result(self.env, packages, vehicles, [route]), engine="exact", optimal=True)
+    
+    def _load(self, scenario_dict):
+        """Load either scenario format into the environment; returns (state, packages, vehicles)"""
+        if wire_format.is_compact(scenario_dict):
+            return self._load_compact(scenario_dict)
+        
         # Parse input
         locations = scenario_dict["locations"]
         
@@ -150,16 +356,221 @@ class LogisticsOptimizer:
         
         # Load scenario
         state = self.env.load_scenario(locations, routes, packages, vehicles)
+        return state, packages, vehicles
+    
+    def _load_compact(self, scenario_dict):
+        scenario = wire_format.normalize(scenario_dict)
+        
+        # The environment addresses locations by name, so repeated names get a suffix
+        locations, seen = [], {}
+        for name in scenario["locations"]:
+            seen[name] = seen.get(name, 0) + 1
+            locations.append(name if seen[name] == 1 else f"{name} #{seen[name]}")
+        
+        p, v = scenario["packages"], scenario["vehicles"]
+        packages = [
+            Package(
+                id=int(p["id"][i]),
+                pickup_location=locations[p["pickup"][i]],
+                delivery_location=locations[p["delivery"][i]],
+                weight=float(p["weight"][i]),
+                priority=int(p["priority"][i])
+            )
+            for i in range(len(p["id"]))
+        ]
+        vehicles = [
+            Vehicle(
+                id=int(v["id"][i]),
+                capacity=float(v["capacity"][i]),
+                current_location=locations[v["location"][i]],
+                speed=float(v["speed"][i]),
+                cost_per_km=float(v["cost_per_km"][i]),
+                current_capacity=float(v["capacity"][i])
+            )
+            for i in range(len(v["id"]))
+        ]
+        
+        state = self.env.load_scenario_matrix(locations, scenario["distance_matrix"], packages, vehicles,
+                                              metric=scenario["metric"])
+        return state, packages, vehicles
+    
+    def optimize_routes_stream(self, scenario_dict, engine="dqn", **options):
+        """
+        Generator variant of optimize_routes. Yields one event per plan
+        step as soon as it is decided:
+        
+            {"type": "step", "index": 0, "step": {...execution_plan entry...},
+             "metrics": {"time", "total_distance", "total_cost",
+                         "packages_delivered", "total_packages"}}
+        
+        followed by a final {"type": "result", "result": {...}} holding the
+        same dict optimize_routes returns (options such as beam_width or
+        deadline_ms are passed on to it). Only the greedy DQN plan without a
+        deadline is decided step by step (stopping at budget_ms, if given);
+        other plans' steps all arrive together once the plan is done. Errors
+        propagate to the consumer, possibly after some steps were yielded
+        (see test.stream_with_json).
+        """
+        if (engine != "dqn" or options.get("deadline_ms") is not None
+                or location_count(scenario_dict) > self.env.max_locations):
+            result = self.optimize_routes(scenario_dict, engine=engine, **options)
+        else:
+            budget_ms = options.get("budget_ms")
+            cap = None if budget_ms is None else time.perf_counter() + budget_ms / 1000
+            state, packages, vehicles = self._load(scenario_dict)
+            result = self._exact(packages, vehicles, cap)
+        if result is not None:
+            for index, step in enumerate(result["execution_plan"]):
+                yield {"type": "step", "index": index, "step": step, "metrics": None}
+            yield {"type": "result", "result": result}
+            return
         
-        # Execute optimization
         execution_plan = []
         vehicle_routes = {v.id: [v.current_location] for v in vehicles}
         
+        for index, step in enumerate(self._plan_steps(state, vehicle_routes, deadline=cap)):
+            execution_plan.append(step)
+            yield {"type": "step", "index": index, "step": step, "metrics": self._running_metrics(packages)}
+        
+        yield {"type": "result", "result": dict(self._compile_result(execution_plan, vehicle_routes, packages),
+                                                engine="dqn", optimal=False)}
+    
+    def _heuristic_fits(self, scenario_dict, deadline_ms=None):
+        """Whether the heuristic can plan the whole scenario, within deadline_ms if given"""
+        packages = scenario_dict["packages"]
+        n = len(packages["id"]) if wire_format.is_compact(scenario_dict) else len(packages)
+        if n > self.heuristic_max_packages:
+            return False
+        return deadline_ms is None or HEURISTIC_CONSTRUCT_SECONDS * n ** 3 * 1000 <= deadline_ms / 2
+    
+    def _decomposed(self, scenario_dict, engine, beam_width, beam_depth, deadline_ms, budget_ms=None):
+        """Solve a scenario too large for the environment cluster by cluster"""
+        started = time.perf_counter()
+        result = Decomposer(self, self.env.max_locations).solve(
+            scenario_dict, engine, dict(beam_width=beam_width, beam_depth=beam_depth, deadline_ms=deadline_ms,
+                                        budget_ms=budget_ms))
+        if deadline_ms is not None:
+            result.update(deadline_ms=deadline_ms, trace=[self._trace_entry(started, "decomposed", result)])
+        return result
+    
+    def _rollout(self, state, packages, vehicles, deadline=None):
+        """Greedy DQN rollout from a loaded scenario"""
+        vehicle_routes = {v.id: [v.current_location] for v in vehicles}
+        execution_plan = list(self._plan_steps(state, vehicle_routes, deadline=deadline))
+        return self._compile_result(execution_plan, vehicle_routes, packages)
+    
+    def _beam_rollout(self, state, packages, vehicles, beam_width=4, beam_depth=None, max_steps=1000, patience=50,
+                      deadline=None):
+        """
+        Beam search over the policy instead of one greedy action per step.
+        
+        The beam holds up to beam_width partial rollouts, each an
+        environment snapshot. At every depth each live member is expanded
+        with its beam_width best valid actions by Q-value, and the Q-values
+        of all children come from one batched network call. Children are
+        ranked by the reward collected so far (travel cost plus the
+        pickup/delivery rewards) plus their value estimate, the best valid
+        Q-value. After beam_depth expansions (None: no limit) every member
+        carries on greedily, still in lockstep. Children with identical
+        states are merged, and the search stops early once no member has
+        picked up or delivered anything for `patience` depths, or at the
+        deadline (time.perf_counter()). The finished
+        member with the most deliveries, then the lowest cost, becomes the
+        plan.
+        """
+        if beam_width < 1 or (beam_depth is not None and beam_depth < 0):
+            raise ValueError("beam_width must be >= 1 and beam_depth >= 0")
+        vehicle_routes = {v.id: [v.current_location] for v in vehicles}
+        root = {"snapshot": self.env.snapshot(), "state": state, "mask": self.env.get_valid_actions_mask(),
+                "reward": 0.0, "score": 0.0, "trail": None, "done": self.env._get_active_vehicle_idx() is None}
+        root["q"] = self.agent.q_values(state[None])[0]
+        beam = [root]
+        best_complete = None  # total cost of the cheapest member that delivered everything
+        best_progress, stalled = -1, 0
+        
+        for depth in range(max_steps):
+            live = [m for m in beam if not m["done"]]
+            if not live or (deadline is not None and time.perf_counter() > deadline):
+                break
+            top_k = beam_width if beam_depth is None or depth < beam_depth else 1
+            children = [m for m in beam if m["done"]]
+            
+            for m in live:
+                q = np.where(m["mask"] == 1, m["q"], -np.inf)
+                for action in np.argsort(-q, kind="stable")[:top_k]:
+                    if not np.isfinite(q[action]):
+                        break
+                    self.env.restore(m["snapshot"])
+                    next_state, reward, done, entry = self._decode_step(self.env._get_active_vehicle(), int(action))
+                    done = done or self.env._get_active_vehicle_idx() is None
+                    children.append({
+                        "snapshot": self.env.snapshot(),
+                        "state": next_state,
+                        "mask": self.env.get_valid_actions_mask(),
+                        "reward": m["reward"] + reward,
+                        "trail": m["trail"] if entry is None else (m["trail"], entry),
+                        "done": done,
+                    })
+            
+            new = [c for c in children if "q" not in c]
+            if new:
+                for c, q in zip(new, self.agent.q_values(np.stack([c["state"] for c in new]))):
+                    c["q"] = q
+                    c["score"] = c["reward"] + (0.0 if c["done"] else float(np.max(q[c["mask"] == 1])))
+            
+            # A member that delivered everything bounds the cost of any plan still worth finishing
+            for c in children:
+                scalars = c["snapshot"][1]
+                if scalars["packages_delivered"] == len(packages):
+                    cost = scalars["total_cost"]
+                    best_complete = cost if best_complete is None else min(best_complete, cost)
+            if best_complete is not None:
+                children = [c for c in children if c["snapshot"][1]["total_cost"] <= best_complete]
+            
+            children.sort(key=lambda c: c["score"], reverse=True)
+            seen = set()
+            beam = []
+            for c in children:
+                key = c["state"].tobytes()
+                if key not in seen:
+                    seen.add(key)
+                    beam.append(c)
+                    if len(beam) == beam_width:
+                        break
+            
+            # Progress: +1 per pickup and +1 per delivery
+            progress = max(2 * m["snapshot"][1]["packages_delivered"] + m["snapshot"][1]["num_in_transit"]
+                           for m in beam)
+            if progress > best_progress:
+                best_progress, stalled = progress, 0
+            else:
+                stalled += 1
+                if stalled >= patience:
+                    break
+        
+        final = min(beam, key=lambda m: (-m["snapshot"][1]["packages_delivered"], m["snapshot"][1]["total_cost"]))
+        self.env.restore(final["snapshot"])
+        
+        execution_plan = []
+        trail = final["trail"]
+        while trail is not None:
+            trail, entry = trail
+            execution_plan.append(entry)
+        execution_plan.reverse()
+        for entry in execution_plan:
+            if entry["action"] == "move_to":
+                vehicle_routes[entry["vehicle_id"]].append(entry["destination"])
+        return self._compile_result(execution_plan, vehicle_routes, packages)
+    
+    def _plan_steps(self, state, vehicle_routes, max_steps=1000, deadline=None):
+        """Run the greedy policy, yielding execution-plan entries as they are decided"""
         done = False
         steps = 0
-        max_steps = 1000
         
         while not done and steps < max_steps:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            
             # Get current vehicle
             active_vehicle = self.env._get_active_vehicle()
             if not active_vehicle:
@@ -171,59 +582,78 @@ class LogisticsOptimizer:
             # Choose best action
             action = self.agent.act(state, mask)
             
-            # Record state before action
-            prev_location = active_vehicle.current_location
-            prev_time = self.env.current_time
-            prev_inventory = list(active_vehicle.inventory)
+            state, reward, done, entry = self._decode_step(active_vehicle, action)
+            steps += 1
+            if entry is not None:
+                if entry["action"] == "move_to":
+                    vehicle_routes[active_vehicle.id].append(entry["destination"])
+                yield entry
+    
+    def _decode_step(self, active_vehicle, action):
+        """
+        Apply one action of the active vehicle; returns (next_state, reward,
+        done, entry) where entry is the execution-plan entry it produced
+        (None for a move that stays in place or an invalid action).
+        """
+        # Record state before action
+        prev_location = active_vehicle.current_location
+        prev_time = self.env.current_time
+        prev_inventory = list(active_vehicle.inventory)
+        
+        # Execute action
+        next_state, reward, done, info = self.env.step(action)
+        entry = None
+        
+        # Record action details
+        if action < len(self.env.locations):
+            destination = self.env.locations[action]
             
-            # Execute action
-            next_state, reward, done, info = self.env.step(action)
+            # Determine what was picked up and delivered
+            pickups = []
+            deliveries = []
             
-            # Record action details
-            if action < len(self.env.locations):
-                destination = self.env.locations[action]
+            if destination != prev_location:
+                # Check deliveries
+                for p in prev_inventory:
+                    if p not in active_vehicle.inventory and p.status == 2:
+                        deliveries.append(p.id)
                 
-                # Determine what was picked up and delivered
-                pickups = []
-                deliveries = []
+                # Check pickups
+                for p in active_vehicle.inventory:
+                    if p not in prev_inventory:
+                        pickups.append(p.id)
                 
-                if destination != prev_location:
-                    vehicle_routes[active_vehicle.id].append(destination)
-                    
-                    # Check deliveries
-                    for p in prev_inventory:
-                        if p not in active_vehicle.inventory and p.status == 2:
-                            deliveries.append(p.id)
-                    
-                    # Check pickups
-                    for p in active_vehicle.inventory:
-                        if p not in prev_inventory:
-                            pickups.append(p.id)
-                    
-                    execution_plan.append({
-                        "time": prev_time,
-                        "vehicle_id": active_vehicle.id,
-                        "action": "move_to",
-                        "destination": destination,
-                        "pickups": pickups,
-                        "deliveries": deliveries,
-                        "distance": info.get("distance", 0),
-                        "cost": info.get("cost", 0)
-                    })
-            elif action == self.env.action_space_size - 1:
-                # Wait action
-                execution_plan.append({
+                entry = {
                     "time": prev_time,
                     "vehicle_id": active_vehicle.id,
-                    "action": "wait",
-                    "duration": 10
-                })
-            
-            state = next_state
-            steps += 1
-        
-        # Compile results
-        result = {
+                    "action": "move_to",
+                    "destination": destination,
+                    "pickups": pickups,
+                    "deliveries": deliveries,
+                    "distance": info.get("distance", 0),
+                    "cost": info.get("cost", 0)
+                }
+        elif action == self.env.action_space_size - 1:
+            # Wait action
+            entry = {
+                "time": prev_time,
+                "vehicle_id": active_vehicle.id,
+                "action": "wait",
+                "duration": 10
+            }
+        return next_state, reward, done, entry
+    
+    def _running_metrics(self, packages):
+        return {
+            "time": self.env.current_time,
+            "total_distance": self.env.total_distance,
+            "total_cost": self.env.total_cost,
+            "packages_delivered": self.env.packages_delivered,
+            "total_packages": len(packages)
+        }
+    
+    def _compile_result(self, execution_plan, vehicle_routes, packages):
+        return {
             "success": self.env.packages_delivered == len(packages),
             "execution_plan": execution_plan,
             "metrics": {
@@ -238,8 +668,6 @@ class LogisticsOptimizer:
             "vehicle_routes": vehicle_routes,
             "undelivered_packages": [p.id for p in packages if p.status != 2]
         }
-        
-        return result
     
     def evaluate_scenario(self, scenario_dict, num_runs=5):
         """
@@ -268,7 +696,8 @@ class LogisticsOptimizer:
 class ImprovedLogisticsEnvironment:
     """Enhanced environment with better state representation and reward structure"""
     
-    def __init__(self, max_locations=20, max_packages=50, max_vehicles=10):
+    def __init__(self, max_locations=20, max_packages=50, max_vehicles=10, distance_cache=None,
+                 debug_checks=False):
         # Maximum sizes for normalization
         self.max_locations = max_locations
         self.max_packages = max_packages
@@ -282,6 +711,12 @@ class ImprovedLogisticsEnvironment:
         self.vehicles = []
         self.distance_matrix = None
         
+        # Optional distance_cache.DistanceMatrixCache shared across scenarios
+        self.distance_cache = distance_cache
+        
+        # Cross-check incrementally maintained statistics on every state
+        self.debug_checks = debug_checks
+        
         # State tracking
         self.current_time = 0
         self.packages_delivered = 0
@@ -320,34 +755,62 @@ class ImprovedLogisticsEnvironment:
         self.num_locations = len(self.locations)
         self.location_to_idx = {loc: i for i, loc in enumerate(self.locations)}
         
-        # Build distance matrix
-        self._create_distance_matrix()
+        # Build distance matrix, reusing a cached one for a known route network
+        if self.distance_cache is not None:
+            self.distance_matrix = self.distance_cache.get_or_compute(
+                self.locations, self.routes, self._compute_distance_matrix)
+        else:
+            self._create_distance_matrix()
         
         # Reset scenario
         self._reset_scenario()
         
         return self._get_state()
     
+    def load_scenario_matrix(self, locations: List[str], distance_matrix, packages: List[Package],
+                             vehicles: List[Vehicle], metric=False):
+        """
+        Load a scenario from a dense (n, n) matrix of direct distances
+        indexed like `locations` (NaN/inf: no direct route) instead of a
+        route list. With metric=True the matrix is taken to hold shortest
+        path distances already and is used as-is.
+        """
+        order = sorted(range(len(locations)), key=lambda i: locations[i])
+        self.locations = [locations[i] for i in order]
+        self.routes = []
+        self.packages = packages
+        self.vehicles = vehicles
+        
+        self.num_locations = len(self.locations)
+        self.location_to_idx = {loc: i for i, loc in enumerate(self.locations)}
+        
+        dist = np.asarray(distance_matrix, dtype=np.float64)[np.ix_(order, order)]
+        dist[~np.isfinite(dist)] = np.inf
+        np.fill_diagonal(dist, 0)
+        self.distance_matrix = dist if metric else shortest_path_matrix(dist)
+        
+        self._reset_scenario()
+        
+        return self._get_state()
+    
     def _create_distance_matrix(self):
-        """Create distance matrix using Floyd-Warshall algorithm"""
+        """Create all-pairs shortest path matrix (see shortest_path.py)"""
+        self.distance_matrix = self._compute_distance_matrix()
+    
+    def _compute_distance_matrix(self):
         n = len(self.locations)
-        dist = np.full((n, n), np.inf)
-        np.fill_diagonal(dist, 0)
+        starts, ends, lengths = [], [], []
         
         for route in self.routes:
             i = self.location_to_idx.get(route.start_location)
             j = self.location_to_idx.get(route.end_location)
             if i is not None and j is not None:
-                dist[i][j] = min(dist[i][j], route.distance * route.traffic_factor)
-                dist[j][i] = min(dist[j][i], route.distance * route.traffic_factor)
+                starts.append(i)
+                ends.append(j)
+                lengths.append(route.distance * route.traffic_factor)
         
-        # Floyd-Warshall
-        for k in range(n):
-            for i in range(n):
-                for j in range(n):
-                    dist[i][j] = min(dist[i][j], dist[i][k] + dist[k][j])
-        
-        self.distance_matrix = dist
+        dist = direct_edge_matrix(n, starts, ends, lengths)
+        return shortest_path_matrix(dist)
     
     def _reset_scenario(self):
         """Reset the scenario to initial state"""
@@ -364,218 +827,275 @@ class ImprovedLogisticsEnvironment:
         
         for p in self.packages:
             p.status = 0
+        
+        self._build_arrays()
+    
+    def _build_arrays(self):
+        """
+        Mirror packages and vehicles into flat arrays with location names
+        resolved to indices once. The Package/Vehicle objects stay in sync
+        for callers, but all featurization reads the arrays.
+        """
+        loc = self.location_to_idx
+        
+        # Unknown location names index as 0 (as before) but never count as a
+        # pickup/delivery site, hence the *_known masks.
+        self.pkg_pickup = np.array([loc.get(p.pickup_location, 0) for p in self.packages], dtype=np.intp)
+        self.pkg_delivery = np.array([loc.get(p.delivery_location, 0) for p in self.packages], dtype=np.intp)
+        self.pkg_pickup_known = np.array([p.pickup_location in loc for p in self.packages], dtype=bool)
+        self.pkg_delivery_known = np.array([p.delivery_location in loc for p in self.packages], dtype=bool)
+        self.pkg_weight = np.array([p.weight for p in self.packages], dtype=np.float64)
+        self.pkg_priority = np.array([p.priority for p in self.packages], dtype=np.float64)
+        self.pkg_status = np.array([p.status for p in self.packages], dtype=np.int8)
+        
+        self.veh_location = np.array([loc.get(v.current_location, 0) for v in self.vehicles], dtype=np.intp)
+        self.veh_location_known = np.array([v.current_location in loc for v in self.vehicles], dtype=bool)
+        self.veh_capacity = np.array([v.capacity for v in self.vehicles], dtype=np.float64)
+        self.veh_free = np.array([v.current_capacity for v in self.vehicles], dtype=np.float64)
+        self.veh_speed = np.array([v.speed for v in self.vehicles], dtype=np.float64)
+        self.veh_cost = np.array([v.cost_per_km for v in self.vehicles], dtype=np.float64)
+        self.veh_available = np.array([v.available_at_time for v in self.vehicles], dtype=np.float64)
+        self.veh_distance = np.array([v.total_distance_traveled for v in self.vehicles], dtype=np.float64)
+        self.veh_inventory = [[] for _ in self.vehicles]  # package indices in pickup order
+        
+        # Running statistics, updated as deltas in step()
+        for name, value in self._compute_stats().items():
+            setattr(self, name, value)
+    
+    # Everything step() changes; the scenario arrays (pickup, weight, ...) never change
+    _SNAPSHOT_ARRAYS = ("pkg_status", "veh_location", "veh_location_known", "veh_free", "veh_available",
+                        "veh_distance", "waiting_at", "pickup_density", "delivery_density", "veh_utilization")
+    _SNAPSHOT_SCALARS = ("current_time", "packages_delivered", "total_distance", "total_cost",
+                         "num_waiting", "num_in_transit")
+    
+    def snapshot(self):
+        """Copy of the mutable episode state, to return to later with restore()"""
+        return (
+            {name: getattr(self, name).copy() for name in self._SNAPSHOT_ARRAYS},
+            {name: getattr(self, name) for name in self._SNAPSHOT_SCALARS},
+            [list(inventory) for inventory in self.veh_inventory],
+            [(v.current_location, v.available_at_time, v.current_capacity, v.total_distance_traveled)
+             for v in self.vehicles],
+        )
+    
+    def restore(self, snapshot):
+        """Return to a snapshot(); the snapshot stays valid for further restores"""
+        arrays, scalars, inventories, vehicles = snapshot
+        for name, value in arrays.items():
+            setattr(self, name, value.copy())
+        for name, value in scalars.items():
+            setattr(self, name, value)
+        self.veh_inventory = [list(inventory) for inventory in inventories]
+        for p, status in zip(self.packages, self.pkg_status.tolist()):
+            p.status = status
+        for v, inventory, fields in zip(self.vehicles, self.veh_inventory, vehicles):
+            v.current_location, v.available_at_time, v.current_capacity, v.total_distance_traveled = fields
+            v.inventory = [self.packages[i] for i in inventory]
+    
+    def _compute_stats(self):
+        """Full recompute of the statistics that step() maintains incrementally"""
+        n = self.num_locations
+        waiting = self.pkg_status == 0
+        in_transit = self.pkg_status == 1
+        return {
+            "num_waiting": int(np.count_nonzero(waiting)),
+            "num_in_transit": int(np.count_nonzero(in_transit)),
+            # Waiting packages per pickup index (unknown names count at 0, like
+            # their features); used for the nearest-pickup distance
+            "waiting_at": np.bincount(self.pkg_pickup[waiting], minlength=n),
+            # Density counts only include known locations
+            "pickup_density": np.bincount(self.pkg_pickup[waiting & self.pkg_pickup_known], minlength=n),
+            "delivery_density": np.bincount(self.pkg_delivery[in_transit & self.pkg_delivery_known], minlength=n),
+            "veh_utilization": (self.veh_capacity - self.veh_free) / self.veh_capacity,
+        }
+    
+    def _check_stats(self):
+        """Compare the incremental statistics with a full recompute (debug_checks)"""
+        for name, expected in self._compute_stats().items():
+            actual = getattr(self, name)
+            if not np.array_equal(actual, expected):
+                raise RuntimeError(f"Incremental statistic '{name}' drifted: {actual} != {expected}")
+    
+    def _mark_picked_up(self, i):
+        """Move package i from waiting to in-transit and update the running statistics"""
+        self.pkg_status[i] = 1
+        self.num_waiting -= 1
+        self.num_in_transit += 1
+        self.waiting_at[self.pkg_pickup[i]] -= 1
+        if self.pkg_pickup_known[i]:
+            self.pickup_density[self.pkg_pickup[i]] -= 1
+        if self.pkg_delivery_known[i]:
+            self.delivery_density[self.pkg_delivery[i]] += 1
+    
+    def _mark_delivered(self, i):
+        """Move package i from in-transit to delivered and update the running statistics"""
+        self.pkg_status[i] = 2
+        self.num_in_transit -= 1
+        if self.pkg_delivery_known[i]:
+            self.delivery_density[self.pkg_delivery[i]] -= 1
     
     def _get_state(self):
         """Get enhanced state representation"""
-        state = []
+        if self.debug_checks:
+            self._check_stats()
+        
+        state = np.zeros(self.state_size, dtype=np.float64)
+        num_packages = max(len(self.packages), 1)
+        num_locations = max(self.num_locations, 1)
         
         # 1. Global features
-        delivery_progress = self.packages_delivered / max(len(self.packages), 1)
-        time_progress = min(self.current_time / self.max_time, 1.0)
-        
-        # Calculate efficiency metrics
-        avg_vehicle_utilization = np.mean([
-            (v.capacity - v.current_capacity) / v.capacity 
-            for v in self.vehicles
-        ]) if self.vehicles else 0
-        
-        waiting_packages = sum(1 for p in self.packages if p.status == 0)
-        in_transit_packages = sum(1 for p in self.packages if p.status == 1)
-        
-        state.extend([
-            delivery_progress,
-            time_progress,
-            avg_vehicle_utilization,
-            waiting_packages / max(len(self.packages), 1),
-            in_transit_packages / max(len(self.packages), 1)
-        ])
+        state[0] = self.packages_delivered / num_packages
+        state[1] = min(self.current_time / self.max_time, 1.0)
+        if self.vehicles:
+            state[2] = np.mean(self.veh_utilization)
+        state[3] = self.num_waiting / num_packages
+        state[4] = self.num_in_transit / num_packages
         
         # 2. Active vehicle features
-        vehicle = self._get_active_vehicle()
-        if vehicle:
-            loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
+        v = self._get_active_vehicle_idx()
+        if v is not None:
+            loc_idx = self.veh_location[v]
+            capacity = self.veh_capacity[v]
             
             # Calculate nearest package distances
-            nearest_pickup_dist = self._get_nearest_package_distance(vehicle, pickup=True)
-            nearest_delivery_dist = self._get_nearest_package_distance(vehicle, pickup=False)
+            nearest_pickup_dist = self._get_nearest_package_distance(v, pickup=True)
+            nearest_delivery_dist = self._get_nearest_package_distance(v, pickup=False)
             
-            state.extend([
-                loc_idx / max(self.num_locations, 1),
-                vehicle.capacity / 100.0,  # Normalized assuming max capacity of 100
-                (vehicle.capacity - vehicle.current_capacity) / vehicle.capacity,
-                vehicle.speed / 2.0,  # Normalized assuming max speed of 2
-                vehicle.cost_per_km / 5.0,  # Normalized
-                len(vehicle.inventory) / 10.0,  # Normalized
-                vehicle.available_at_time / self.max_time,
-                vehicle.total_distance_traveled / 1000.0,  # Normalized
+            state[5:15] = [
+                loc_idx / num_locations,
+                capacity / 100.0,  # Normalized assuming max capacity of 100
+                (capacity - self.veh_free[v]) / capacity,
+                self.veh_speed[v] / 2.0,  # Normalized assuming max speed of 2
+                self.veh_cost[v] / 5.0,  # Normalized
+                len(self.veh_inventory[v]) / 10.0,  # Normalized
+                self.veh_available[v] / self.max_time,
+                self.veh_distance[v] / 1000.0,  # Normalized
                 nearest_pickup_dist / 100.0,  # Normalized
                 nearest_delivery_dist / 100.0  # Normalized
-            ])
-        else:
-            state.extend([0] * 10)
-        
-        # 3. Package features (top 20 most relevant)
-        relevant_packages = self._get_relevant_packages(vehicle, max_count=20)
-        package_features = []
+            ]
         
-        for p in relevant_packages:
-            pickup_idx = self.location_to_idx.get(p.pickup_location, 0)
-            delivery_idx = self.location_to_idx.get(p.delivery_location, 0)
-            
+        # 3. Package features (top 20 most relevant), zero-padded
+        relevant = self._get_relevant_packages(v, max_count=20)
+        package_features = state[15:15 + 6 * len(relevant)].reshape(-1, 6)
+        package_features[:, 0] = self.pkg_status[relevant] / 2.0
+        package_features[:, 1] = self.pkg_pickup[relevant] / num_locations
+        package_features[:, 2] = self.pkg_delivery[relevant] / num_locations
+        package_features[:, 3] = self.pkg_weight[relevant] / 20.0  # Normalized
+        package_features[:, 4] = self.pkg_priority[relevant] / 3.0
+        if v is not None:
             # Distance from vehicle to package
-            if vehicle:
-                vehicle_loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
-                dist_to_pickup = self.distance_matrix[vehicle_loc_idx][pickup_idx]
-            else:
-                dist_to_pickup = 0
-            
-            package_features.extend([
-                p.status / 2.0,
-                pickup_idx / max(self.num_locations, 1),
-                delivery_idx / max(self.num_locations, 1),
-                p.weight / 20.0,  # Normalized
-                p.priority / 3.0,
-                dist_to_pickup / 100.0  # Normalized
-            ])
-        
-        # Pad if fewer packages
-        while len(package_features) < 20 * 6:
-            package_features.extend([0] * 6)
-        
-        state.extend(package_features[:20 * 6])
+            package_features[:, 5] = self.distance_matrix[self.veh_location[v], self.pkg_pickup[relevant]] / 100.0
         
         # 4. Location density features
-        location_features = self._get_location_density_features(vehicle)
-        state.extend(location_features)
+        state[135:145] = self._get_location_density_features(v)
         
-        return np.array(state[:self.state_size], dtype=np.float32)
+        return state.astype(np.float32)
     
-    def _get_active_vehicle(self):
-        """Get the vehicle that should act next"""
+    def _get_active_vehicle_idx(self):
+        """Index of the vehicle that should act next (earliest available)"""
         if not self.vehicles:
             return None
-        return min(self.vehicles, key=lambda v: v.available_at_time)
+        return int(np.argmin(self.veh_available))
+    
+    def _get_active_vehicle(self):
+        """Get the vehicle that should act next"""
+        v = self._get_active_vehicle_idx()
+        return None if v is None else self.vehicles[v]
     
-    def _get_nearest_package_distance(self, vehicle, pickup=True):
+    def _get_nearest_package_distance(self, v, pickup=True):
         """Get distance to nearest package pickup or delivery"""
-        if not vehicle:
+        if v is None:
             return 0
         
-        vehicle_loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
-        min_dist = float('inf')
-        
         if pickup:
-            for p in self.packages:
-                if p.status == 0:
-                    pkg_loc_idx = self.location_to_idx.get(p.pickup_location, 0)
-                    dist = self.distance_matrix[vehicle_loc_idx][pkg_loc_idx]
-                    min_dist = min(min_dist, dist)
+            targets = np.flatnonzero(self.waiting_at)
         else:
-            for p in vehicle.inventory:
-                pkg_loc_idx = self.location_to_idx.get(p.delivery_location, 0)
-                dist = self.distance_matrix[vehicle_loc_idx][pkg_loc_idx]
-                min_dist = min(min_dist, dist)
+            targets = self.pkg_delivery[self.veh_inventory[v]]
+        if len(targets) == 0:
+            return 0
         
+        min_dist = self.distance_matrix[self.veh_location[v], targets].min()
         return min_dist if min_dist != float('inf') else 0
     
-    def _get_relevant_packages(self, vehicle, max_count=20):
-        """Get most relevant packages for state representation"""
-        if not vehicle:
-            return self.packages[:max_count]
-        
-        # Combine packages in inventory and waiting packages
-        relevant = list(vehicle.inventory)
-        
-        # Add waiting packages sorted by distance and priority
-        vehicle_loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
-        waiting = [(p, self.distance_matrix[vehicle_loc_idx][self.location_to_idx.get(p.pickup_location, 0)])
-                   for p in self.packages if p.status == 0]
-        waiting.sort(key=lambda x: (x[1], -x[0].priority))
-        
-        for p, _ in waiting:
-            if len(relevant) >= max_count:
-                break
-            relevant.append(p)
-        
-        return relevant[:max_count]
+    def _get_relevant_packages(self, v, max_count=20):
+        """Indices of the most relevant packages: inventory first, then nearest waiting"""
+        if v is None:
+            return np.arange(min(len(self.packages), max_count))
+        
+        inventory = np.array(self.veh_inventory[v][:max_count], dtype=np.intp)
+        slots = max_count - len(inventory)
+        waiting = np.flatnonzero(self.pkg_status == 0)
+        if slots <= 0 or len(waiting) == 0:
+            return inventory
+        
+        dists = self.distance_matrix[self.veh_location[v], self.pkg_pickup[waiting]]
+        if len(waiting) > slots:
+            # Keep everything tied with the slots-th nearest so tie-breaking below is exact
+            kth = dists[np.argpartition(dists, slots - 1)[slots - 1]]
+            keep = dists <= kth
+            waiting, dists = waiting[keep], dists[keep]
+        
+        # Sorted by distance, then priority (descending), then package order
+        order = np.lexsort((-self.pkg_priority[waiting], dists))
+        return np.concatenate([inventory, waiting[order[:slots]]])
     
-    def _get_location_density_features(self, vehicle):
+    def _get_location_density_features(self, v):
         """Get features about package density at nearby locations"""
-        features = []
+        features = np.zeros(10)
         
-        if not vehicle:
-            return [0] * 10
+        if v is None:
+            return features
         
-        vehicle_loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
+        vehicle_loc_idx = self.veh_location[v]
         
-        # Count packages at each location
-        pickup_density = {}
-        delivery_density = {}
+        pickup_density = self.pickup_density
+        delivery_density = self.delivery_density
         
-        for p in self.packages:
-            if p.status == 0:
-                pickup_density[p.pickup_location] = pickup_density.get(p.pickup_location, 0) + 1
-            if p.status == 1:
-                delivery_density[p.delivery_location] = delivery_density.get(p.delivery_location, 0) + 1
-        
-        # Get top 5 nearest locations with packages
-        location_scores = []
-        for loc in self.locations:
-            if loc == vehicle.current_location:
-                continue
-            loc_idx = self.location_to_idx[loc]
-            dist = self.distance_matrix[vehicle_loc_idx][loc_idx]
-            pickups = pickup_density.get(loc, 0)
-            deliveries = delivery_density.get(loc, 0)
-            if pickups + deliveries > 0:
-                location_scores.append((dist, pickups + deliveries * 2))  # Prioritize deliveries
-        
-        location_scores.sort(key=lambda x: x[0])
-        
-        for i in range(5):
-            if i < len(location_scores):
-                features.extend([location_scores[i][0] / 100.0, location_scores[i][1] / 10.0])
-            else:
-                features.extend([0, 0])
+        # Top 5 nearest other locations with packages
+        has_packages = (pickup_density + delivery_density) > 0
+        if self.veh_location_known[v]:
+            has_packages[vehicle_loc_idx] = False
+        candidates = np.flatnonzero(has_packages)
+        dists = self.distance_matrix[vehicle_loc_idx, candidates]
+        nearest = candidates[np.argsort(dists, kind='stable')[:5]]
+        
+        scores = pickup_density[nearest] + delivery_density[nearest] * 2  # Prioritize deliveries
+        features[0:2 * len(nearest):2] = self.distance_matrix[vehicle_loc_idx, nearest] / 100.0
+        features[1:2 * len(nearest):2] = scores / 10.0
         
         return features
     
     def get_valid_actions_mask(self):
         """Returns a binary mask for valid destinations."""
-        vehicle = min(self.vehicles, key=lambda v: v.available_at_time)
-        valid_locs_names = set()
-
+        v = self._get_active_vehicle_idx()
+        mask = np.zeros(self.action_space_size)
+        
         # Valid destinations are where waiting packages can be picked up
-        for p in self.packages:
-            if p.status == 0 and p.weight <= vehicle.current_capacity:
-                valid_locs_names.add(p.pickup_location)
-
+        # (including the current location)
+        can_pickup = (self.pkg_status == 0) & (self.pkg_weight <= self.veh_free[v]) & self.pkg_pickup_known
+        mask[self.pkg_pickup[can_pickup]] = 1
+        
         # Or where packages in the current vehicle's inventory can be delivered
-        for p in vehicle.inventory:
-            valid_locs_names.add(p.delivery_location)
-
-        mask = np.zeros(self.action_space_size)
-        for loc_name in valid_locs_names:
-            # THE FIX IS HERE: We now allow the agent to choose its current location
-            # if there is a valid pickup or delivery to be made there.
-            # The line that checked if the location was different has been removed.
-            mask[self.location_to_idx[loc_name]] = 1
-
+        inventory = self.veh_inventory[v]
+        mask[self.pkg_delivery[inventory][self.pkg_delivery_known[inventory]]] = 1
+        
         # If no valid moves exist, allow all actions to avoid getting stuck
         return mask if np.any(mask) else np.ones(self.action_space_size)
     
     
     def step(self, action):
         """Execute action and return new state"""
-        vehicle = self._get_active_vehicle()
-        if not vehicle:
+        v = self._get_active_vehicle_idx()
+        if v is None:
             return self._get_state(), -100, True, {}
+        vehicle = self.vehicles[v]
         
         self.current_time = vehicle.available_at_time
         
         # Handle wait action
         if action == self.action_space_size - 1:
             vehicle.available_at_time += 10  # Wait for 10 time units
+            self.veh_available[v] = vehicle.available_at_time
             return self._get_state(), -5, False, {}  # Small penalty for waiting
         
         # Handle movement to location
@@ -583,7 +1103,7 @@ class ImprovedLogisticsEnvironment:
             return self._get_state(), -50, False, {}  # Invalid action
         
         destination = self.locations[action]
-        vehicle_loc_idx = self.location_to_idx.get(vehicle.current_location, 0)
+        vehicle_loc_idx = self.veh_location[v]
         dest_loc_idx = action
         
         distance = self.distance_matrix[vehicle_loc_idx][dest_loc_idx]
@@ -600,38 +1120,50 @@ class ImprovedLogisticsEnvironment:
         vehicle.total_distance_traveled += distance
         self.total_distance += distance
         self.total_cost += travel_cost
+        self.veh_location[v] = dest_loc_idx
+        self.veh_location_known[v] = True
+        self.veh_available[v] = vehicle.available_at_time
+        self.veh_distance[v] = vehicle.total_distance_traveled
         
         # Initialize reward
         reward = -travel_cost * 0.1  # Base travel cost
         
         # Process deliveries
         delivered = []
-        for p in list(vehicle.inventory):
-            if p.delivery_location == destination:
-                vehicle.inventory.remove(p)
-                vehicle.current_capacity += p.weight
-                p.status = 2
-                self.packages_delivered += 1
-                delivered.append(p)
-                
-                # Reward based on priority
-                reward += 50 * p.priority
+        inventory = self.veh_inventory[v]
+        kept = []
+        for i in inventory:
+            if not (self.pkg_delivery_known[i] and self.pkg_delivery[i] == dest_loc_idx):
+                kept.append(i)
+                continue
+            p = self.packages[i]
+            vehicle.current_capacity += p.weight
+            p.status = 2
+            self._mark_delivered(i)
+            self.packages_delivered += 1
+            delivered.append(p)
+            
+            # Reward based on priority
+            reward += 50 * p.priority
+        inventory[:] = kept
         
         # Process pickups
         picked_up = []
-        available_packages = [p for p in self.packages 
-                            if p.status == 0 and p.pickup_location == destination]
+        available = np.flatnonzero((self.pkg_status == 0) & self.pkg_pickup_known
+                                   & (self.pkg_pickup == dest_loc_idx))
         
         # Sort by priority and weight
-        available_packages.sort(key=lambda p: (-p.priority, p.weight))
+        available = available[np.lexsort((self.pkg_weight[available], -self.pkg_priority[available]))]
         
-        for p in available_packages:
+        for i in available:
+            p = self.packages[i]
             if p.weight <= vehicle.current_capacity:
                 # Check time window
                 if self.current_time <= p.time_window[1]:
-                    vehicle.inventory.append(p)
+                    inventory.append(int(i))
                     vehicle.current_capacity -= p.weight
                     p.status = 1
+                    self._mark_picked_up(i)
                     picked_up.append(p)
                     
                     # Reward for pickup
@@ -641,6 +1173,10 @@ class ImprovedLogisticsEnvironment:
                     if self.current_time >= p.time_window[0]:
                         reward += 5
         
+        vehicle.inventory[:] = [self.packages[i] for i in inventory]
+        self.veh_free[v] = vehicle.current_capacity
+        self.veh_utilization[v] = (vehicle.capacity - vehicle.current_capacity) / vehicle.capacity
+        
         # Penalties and bonuses
         if len(delivered) == 0 and len(picked_up) == 0:
             reward -= 30  # Penalty for useless trip
@@ -713,12 +1249,18 @@ class DuelingDQNNetwork(keras.Model):
 class ImprovedDQNAgent:
     """Enhanced DQN agent with Double DQN and Dueling architecture"""
     
-    def __init__(self, state_size, action_size):
+    def __init__(self, state_size, action_size, compile_mode="graph", memory_size=100000, memory_path=None):
+        """
+        compile_mode selects how the greedy action and the training step run:
+        "graph" (tf.function), "xla" (tf.function with jit_compile) or
+        "eager" (plain Python, for debugging).
+        memory_path puts the replay memory in np.memmap files in that directory.
+        """
         self.state_size = state_size
         self.action_size = action_size
         
         # Hyperparameters
-        self.memory = deque(maxlen=100000)
+        self.memory = ReplayMemory(memory_size, state_size, action_size, path=memory_path)
         self.gamma = 0.99
         self.epsilon = 1.0
         self.epsilon_min = 0.01
@@ -739,9 +1281,46 @@ class ImprovedDQNAgent:
         
         # Optimizer
         self.optimizer = keras.optimizers.Adam(learning_rate=self.learning_rate)
+        self.optimizer.build(self.q_network.trainable_variables)
         
         # Initialize target network
         self.update_target_network()
+        
+        self.set_compile_mode(compile_mode)
+    
+    def set_compile_mode(self, compile_mode):
+        """Switch between "graph", "xla" and "eager" execution of act/replay"""
+        if compile_mode not in ("graph", "xla", "eager"):
+            raise ValueError(f"Unknown compile mode: {compile_mode}")
+        self.compile_mode = compile_mode
+        
+        if compile_mode == "eager":
+            self._greedy_actions = self._greedy_actions_impl
+            self._q_values = self._q_values_impl
+            self._train_step = self._train_step_impl
+            return
+        
+        # Fixed signatures (batch dimension left open) so nothing retraces
+        jit_compile = compile_mode == "xla"
+        states_spec = tf.TensorSpec([None, self.state_size], tf.float32)
+        masks_spec = tf.TensorSpec([None, self.action_size], tf.float32)
+        self._greedy_actions = tf.function(
+            self._greedy_actions_impl,
+            input_signature=[states_spec, masks_spec],
+            jit_compile=jit_compile)
+        self._q_values = tf.function(
+            self._q_values_impl,
+            input_signature=[states_spec],
+            jit_compile=jit_compile)
+        self._train_step = tf.function(
+            self._train_step_impl,
+            input_signature=[states_spec,
+                             tf.TensorSpec([None], tf.int32),
+                             tf.TensorSpec([None], tf.float32),
+                             states_spec,
+                             tf.TensorSpec([None], tf.float32),
+                             masks_spec],
+            jit_compile=jit_compile)
     
     def update_target_network(self):
         """Copy weights from main network to target network"""
@@ -751,6 +1330,18 @@ class ImprovedDQNAgent:
         """Store experience in replay buffer"""
         self.memory.append((state, action, reward, next_state, done, mask, next_mask))
     
+    def _greedy_actions_impl(self, states, masks):
+        """Masked argmax over Q-values for a batch of states"""
+        q_values = self.q_network(states, training=False)
+        return tf.argmax(q_values + (1 - masks) * -1e9, axis=1, output_type=tf.int32)
+    
+    def _q_values_impl(self, states):
+        return self.q_network(states, training=False)
+    
+    def q_values(self, states):
+        """Q-values for a batch of states in one forward pass"""
+        return self._q_values(np.asarray(states, dtype=np.float32)).numpy()
+    
     def act(self, state, valid_actions_mask):
         """Choose action using epsilon-greedy policy"""
         if np.random.random() <= self.epsilon:
@@ -761,47 +1352,43 @@ class ImprovedDQNAgent:
             return np.random.randint(self.action_size)
         
         # Greedy action
-        state_tensor = tf.expand_dims(state, 0)
-        q_values = self.q_network(state_tensor, training=False).numpy()[0]
-        
-        # Apply mask
-        masked_q_values = q_values + (1 - valid_actions_mask) * -1e9
-        return np.argmax(masked_q_values)
+        states = np.asarray(state, dtype=np.float32)[None]
+        masks = np.asarray(valid_actions_mask, dtype=np.float32)[None]
+        return int(self._greedy_actions(states, masks).numpy()[0])
+
+    def act_batch(self, states, valid_actions_masks):
+        """Epsilon-greedy actions for a batch of states in one forward pass"""
+        states = np.asarray(states, dtype=np.float32)
+        valid_actions_masks = np.asarray(valid_actions_masks, dtype=np.float32)
+
+        actions = self._greedy_actions(states, valid_actions_masks).numpy()
+
+        # Random valid action for the exploring rows
+        explore = np.random.random(len(states)) <= self.epsilon
+        for i in np.flatnonzero(explore):
+            valid_indices = np.where(valid_actions_masks[i] == 1)[0]
+            if len(valid_indices) > 0:
+                actions[i] = np.random.choice(valid_indices)
+            else:
+                actions[i] = np.random.randint(self.action_size)
+        return actions
     
-    def replay(self):
-        """Train the network on a batch of experiences"""
-        if len(self.memory) < self.batch_size:
-            return
+    def _train_step_impl(self, states, actions, rewards, next_states, dones, next_masks):
+        """One Double-DQN gradient step; returns the loss"""
+        batch_indices = tf.range(tf.shape(actions)[0])
         
-        # Sample batch
-        batch = random.sample(self.memory, self.batch_size)
-        states = np.array([e[0] for e in batch])
-        actions = np.array([e[1] for e in batch])
-        rewards = np.array([e[2] for e in batch])
-        next_states = np.array([e[3] for e in batch])
-        dones = np.array([e[4] for e in batch])
-        next_masks = np.array([e[6] for e in batch])
-        
-        # Convert to tensors
-        states_tensor = tf.convert_to_tensor(states, dtype=tf.float32)
-        next_states_tensor = tf.convert_to_tensor(next_states, dtype=tf.float32)
-        
-        # Train step
         with tf.GradientTape() as tape:
             # Current Q values
-            current_q_values = self.q_network(states_tensor, training=True)
-            current_q = tf.gather_nd(current_q_values, 
-                                    tf.stack([tf.range(self.batch_size), actions], axis=1))
+            current_q_values = self.q_network(states, training=True)
+            current_q = tf.gather_nd(current_q_values, tf.stack([batch_indices, actions], axis=1))
             
             # Double DQN: use main network to select action, target network to evaluate
-            next_q_values = self.q_network(next_states_tensor, training=False)
+            next_q_values = self.q_network(next_states, training=False)
             masked_next_q = next_q_values + (1 - next_masks) * -1e9
-            next_actions = tf.argmax(masked_next_q, axis=1)
+            next_actions = tf.argmax(masked_next_q, axis=1, output_type=tf.int32)
             
-            target_next_q_values = self.target_network(next_states_tensor, training=False)
-            next_actions = tf.cast(next_actions, dtype=tf.int32)
-            next_q = tf.gather_nd(target_next_q_values,
-                                 tf.stack([tf.range(self.batch_size), next_actions], axis=1))
+            target_next_q_values = self.target_network(next_states, training=False)
+            next_q = tf.gather_nd(target_next_q_values, tf.stack([batch_indices, next_actions], axis=1))
             
             # Calculate targets
             targets = rewards + self.gamma * next_q * (1 - dones)
@@ -812,6 +1399,17 @@ class ImprovedDQNAgent:
         # Backpropagation
         gradients = tape.gradient(loss, self.q_network.trainable_variables)
         self.optimizer.apply_gradients(zip(gradients, self.q_network.trainable_variables))
+        return loss
+    
+    def replay(self):
+        """Train the network on a batch of experiences"""
+        if len(self.memory) < self.batch_size:
+            return
+        
+        # Sample batch
+        states, actions, rewards, next_states, dones, _, next_masks = self.memory.sample(self.batch_size)
+        
+        self._train_step(states, actions, rewards, next_states, dones, next_masks)
         
         # Update target network
         self.training_step += 1
@@ -9,6 +9,10 @@ from dataclasses import dataclass, field, asdict
 from typing import List, Tuple, Dict, Any
 import pickle
 
+from inference import (Route, Package, Vehicle, ImprovedLogisticsEnvironment,
+                       ImprovedDQNAgent, LogisticsOptimizer)
+from vec_env import VecLogisticsEnvironment
+
 # ========================= DATA CLASSES =========================
 
 
@@ -21,8 +25,21 @@ import pickle
 
 # ========================= TRAINING FUNCTION =========================
 
-def train_model(episodes=3000, save_path="improved_logistics_model"):
-    """Train the improved logistics model"""
+def train_model(episodes=3000, save_path="improved_logistics_model", num_envs=1, num_actors=0,
+                **actor_learner_kwargs):
+    """
+    Train the improved logistics model.
+    
+    With num_envs > 1, episodes run in a VecLogisticsEnvironment and the
+    agent picks actions for all environments in one forward pass.
+    With num_actors > 0, episodes run in separate actor processes and this
+    process only learns (see actor_learner.train_actor_learner).
+    """
+    if num_actors > 0:
+        from actor_learner import train_actor_learner
+        return train_actor_learner(episodes, save_path, num_actors, **actor_learner_kwargs)
+    if num_envs > 1:
+        return train_model_vectorized(episodes, save_path, num_envs)
     
     # Create environment
     env = ImprovedLogisticsEnvironment()
@@ -104,6 +121,87 @@ def train_model(episodes=3000, save_path="improved_logistics_model"):
     print("Training completed!")
     return agent, history
 
+def train_model_vectorized(episodes=3000, save_path="improved_logistics_model", num_envs=8, replays_per_step=None):
+    """
+    Train with num_envs scenarios stepped in lock-step (see train_model).
+    
+    Every vector step stores num_envs transitions, so it runs
+    replays_per_step replays (default num_envs) to keep one replay per
+    transition as in train_model. Each replay also decays epsilon and
+    counts towards the target network update, so fewer replays per step
+    slow both down by the same factor.
+    """
+    
+    vec_env = VecLogisticsEnvironment(num_envs, generate_random_scenario)
+    agent = ImprovedDQNAgent(vec_env.state_size, vec_env.action_space_size)
+    if replays_per_step is None:
+        replays_per_step = num_envs
+    
+    history = {
+        'episode': [],
+        'total_reward': [],
+        'packages_delivered': [],
+        'completion_time': [],
+        'total_distance': [],
+        'epsilon': []
+    }
+    
+    print("Starting vectorized training...")
+    print(f"State size: {vec_env.state_size}, Action size: {vec_env.action_space_size}, Envs: {num_envs}")
+    
+    states = vec_env.reset()
+    masks = vec_env.get_valid_actions_mask()
+    episode = 0
+    
+    while episode < episodes:
+        # One forward pass picks actions for every environment
+        actions = agent.act_batch(states, masks)
+        next_states, rewards, dones, infos = vec_env.step(actions)
+        next_masks = vec_env.get_valid_actions_mask()
+        
+        for i in range(num_envs):
+            if dones[i]:
+                # Finished envs were auto-reset; store the real terminal transition
+                agent.remember(states[i], actions[i], rewards[i], infos[i]["terminal_state"],
+                               not infos[i]["truncated"], masks[i], infos[i]["terminal_mask"])
+            else:
+                agent.remember(states[i], actions[i], rewards[i], next_states[i],
+                               False, masks[i], next_masks[i])
+        
+        # Train, one replay per stored transition by default
+        if len(agent.memory) > agent.batch_size:
+            for _ in range(replays_per_step):
+                agent.replay()
+        
+        for info in (info for info in infos if info):
+            if episode >= episodes:
+                break
+            history['episode'].append(episode)
+            history['total_reward'].append(info["episode_reward"])
+            history['packages_delivered'].append(info["packages_delivered"])
+            history['completion_time'].append(info["completion_time"])
+            history['total_distance'].append(info["total_distance"])
+            history['epsilon'].append(agent.epsilon)
+            
+            avg_reward = np.mean(history['total_reward'][-100:])
+            avg_delivered = np.mean(history['packages_delivered'][-100:])
+            print(f"Episode {episode}/{episodes}")
+            print(f"  Avg Reward: {avg_reward:.2f}")
+            print(f"  Avg Packages Delivered: {avg_delivered:.2f}/{info['total_packages']}")
+            print(f"  Epsilon: {agent.epsilon:.4f}")
+            print()
+            episode += 1
+        
+        states, masks = next_states, next_masks
+    
+    agent.save(save_path)
+    
+    with open(f"{save_path}_history.pkl", 'wb') as f:
+        pickle.dump(history, f)
+    
+    print("Training completed!")
+    return agent, history
+
 def generate_random_scenario():
     """Generate a random scenario for training"""
     
@@ -229,7 +327,8 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "train":
         # Train the model
         print("Training new model...")
-        agent, history = train_model(episodes=2000)
+        num_envs = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        agent, history = train_model(episodes=2000, num_envs=num_envs)
         print("Model saved to 'improved_logistics_model'")
         
     elif len(sys.argv) > 1 and sys.argv[1] == "test":
@@ -240,5 +339,6 @@ if __name__ == "__main__":
     else:
         print("Usage:")
         print("  python script.py train    # Train new model")
+        print("  python script.py train 8  # Train with 8 vectorized environments")
         print("  python script.py test     # Test with example scenario")
         print("\nFor custom usage, import LogisticsOptimizer class")
\ No newline at end of file
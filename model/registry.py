@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+from inference import LogisticsOptimizer, ImprovedLogisticsEnvironment, ImprovedDQNAgent
+from batching import BatchedAgent
+
+DEFAULT_MODEL_PATHS = ["logistics_model_v3.weights.h5", "logistics_model.weights.h5"]
+
+
+class ModelRegistry:
+    """
+    Process-level cache of loaded DQN agents, one per weights file.
+
+    Weights are loaded once and shared by every request. Each call to
+    get_optimizer() returns a LogisticsOptimizer with its own environment
+    wrapped around the shared agent. When a weights file changes on disk
+    a new agent is loaded off to the side and swapped in under the lock,
+    so requests that already hold the old agent finish with it unchanged.
+
+    With a batching.MicroBatcher, greedy actions of concurrent requests
+    are answered from shared batched forward passes. A shared
+    distance_cache.DistanceMatrixCache is handed to every optimizer.
+    """
+
+    def __init__(self, model_paths=None, check_interval=2.0, batcher=None, distance_cache=None):
+        self.model_paths = list(model_paths or DEFAULT_MODEL_PATHS)
+        self.check_interval = check_interval  # seconds between mtime checks per file
+        self.batcher = batcher
+        self.distance_cache = distance_cache
+
+        self._lock = threading.Lock()
+        self._reload_locks = {}
+        self._agents = {}       # abs path -> ImprovedDQNAgent
+        self._mtimes = {}       # abs path -> mtime of the loaded weights
+        self._last_check = {}   # abs path -> time of the last mtime check
+
+    @staticmethod
+    def _key(model_path):
+        return os.path.abspath(model_path)
+
+    def _load_agent(self, model_path):
+        """Build and load a fresh agent; never touches the shared state"""
+        env = ImprovedLogisticsEnvironment()
+        agent = ImprovedDQNAgent(env.state_size, env.action_space_size)
+        agent.load(model_path)
+        agent.epsilon = 0  # No exploration during inference
+        return agent
+
+    def _reload(self, key, mtime):
+        with self._lock:
+            reload_lock = self._reload_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given file; others keep using the current agent
+        with reload_lock:
+            with self._lock:
+                if key in self._agents and self._mtimes.get(key) == mtime:
+                    return self._agents[key]
+
+            print(f"Loading model from '{key}'...")
+            start = time.perf_counter()
+            agent = self._load_agent(key)
+            print(f"Loaded '{key}' in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            with self._lock:
+                self._agents[key] = agent
+                self._mtimes[key] = mtime
+                self._last_check[key] = time.monotonic()
+            return agent
+
+    def preload(self):
+        """Load every configured weights file; returns {path: error} for failures"""
+        errors = {}
+        for model_path in self.model_paths:
+            try:
+                self.get_agent(model_path)
+            except Exception as e:
+                print(f"Could not preload model '{model_path}': {e}")
+                errors[model_path] = str(e)
+        return errors
+
+    def get_agent(self, model_path):
+        """Return the resident agent for model_path, reloading it if the file changed"""
+        key = self._key(model_path)
+        now = time.monotonic()
+
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None and now - self._last_check.get(key, 0) < self.check_interval:
+                return agent
+            self._last_check[key] = now
+
+        try:
+            mtime = os.stat(key).st_mtime_ns
+            if agent is not None and mtime == self._mtimes.get(key):
+                return agent
+            return self._reload(key, mtime)
+        except Exception as e:
+            if agent is None:
+                raise
+            # A file that is missing or still being written during a deploy
+            # fails to stat or load; keep serving the previous weights and
+            # retry on the next check.
+            print(f"Reload of '{key}' failed, keeping previous weights: {e}")
+            return agent
+
+    def get_optimizer(self, model_path):
+        """Return a request-scoped optimizer backed by the resident agent"""
+        agent = self.get_agent(model_path)
+        if self.batcher is not None:
+            agent = BatchedAgent(agent, self.batcher)
+        return LogisticsOptimizer(model_path, agent=agent, distance_cache=self.distance_cache)
+
+    def loaded_models(self):
+        with self._lock:
+            return {path: self._mtimes[path] for path in self._agents}
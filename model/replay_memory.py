@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+
+class ReplayMemory:
+    """
+    Uniform replay memory for ImprovedDQNAgent backed by preallocated arrays.
+
+    Observations are stored once as float16 in their own ring: when a
+    transition's state equals a recent transition's next_state (the normal
+    case while stepping an episode, also across interleaved vectorized
+    environments) the stored observation is shared. Masks are bit-packed,
+    actions are int16 and rewards float32, which brings a transition down
+    to roughly 340 bytes of allocated storage.
+
+    The observation ring holds obs_capacity entries (1.0625x capacity by
+    default). Transitions whose observations have been overwritten are
+    dropped from the old end, so with poor sharing the effective capacity
+    shrinks rather than returning stale data.
+
+    With path set, every array is an np.memmap file in that directory so
+    very large buffers can live on disk.
+    """
+
+    def __init__(self, capacity, state_size, action_size, obs_capacity=None, path=None, recent_window=64):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.action_size = action_size
+        self.obs_capacity = obs_capacity or capacity + capacity // 16
+        self.path = path
+        self.recent_window = max(1, min(recent_window, self.obs_capacity // 8))
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+        mask_bytes = (action_size + 7) // 8
+        self.obs = self._alloc("obs", (self.obs_capacity, state_size), np.float16)
+        self.state_seq = self._alloc("state_seq", (capacity,), np.int64)
+        self.next_state_seq = self._alloc("next_state_seq", (capacity,), np.int64)
+        self.actions = self._alloc("actions", (capacity,), np.int16)
+        self.rewards = self._alloc("rewards", (capacity,), np.float32)
+        self.dones = self._alloc("dones", (capacity,), np.bool_)
+        self.masks = self._alloc("masks", (capacity, mask_bytes), np.uint8)
+        self.next_masks = self._alloc("next_masks", (capacity, mask_bytes), np.uint8)
+
+        self.obs_count = 0   # observations ever written; obs seq k lives in slot k % obs_capacity
+        self.head = 0        # ring position of the oldest transition
+        self.count = 0
+        self.appended = 0    # transitions ever appended
+        self._recent = {}    # next_state bytes -> (append seq, obs seq), oldest first
+        self._rng = np.random.default_rng()
+
+    def _alloc(self, name, shape, dtype):
+        if self.path:
+            return np.memmap(os.path.join(self.path, f"{name}.dat"), dtype=dtype, mode="w+", shape=shape)
+        return np.zeros(shape, dtype=dtype)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.obs, self.state_seq, self.next_state_seq, self.actions,
+                                      self.rewards, self.dones, self.masks, self.next_masks))
+
+    def _push_obs(self, state):
+        seq = self.obs_count
+        self.obs[seq % self.obs_capacity] = state
+        self.obs_count += 1
+
+        # Drop transitions that referenced the observation just overwritten.
+        # A shared state comes from one of the last recent_window transitions,
+        # so no live transition references an observation more than
+        # 2 * recent_window older than the head's; evicting with that margin
+        # guarantees nothing stale survives.
+        oldest_live = self.obs_count - self.obs_capacity
+        while self.count and self.state_seq[self.head] - 2 * self.recent_window < oldest_live:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        return seq
+
+    def append(self, transition):
+        """Store a (state, action, reward, next_state, done, mask, next_mask) tuple"""
+        state, action, reward, next_state, done, mask, next_mask = transition
+
+        # Only next_states of the last recent_window transitions may be
+        # shared; the eviction margin in _push_obs depends on it
+        while self._recent:
+            key, (appended_at, _) = next(iter(self._recent.items()))
+            if self.appended - appended_at <= self.recent_window:
+                break
+            del self._recent[key]
+
+        state = np.asarray(state, dtype=np.float32)
+        _, state_seq = self._recent.pop(state.tobytes(), (None, None))
+        if state_seq is None or state_seq < self.obs_count - self.obs_capacity:
+            state_seq = self._push_obs(state)
+        next_state = np.asarray(next_state, dtype=np.float32)
+        next_state_seq = self._push_obs(next_state)
+
+        # Re-inserted so the dict stays ordered by append seq
+        key = next_state.tobytes()
+        self._recent.pop(key, None)
+        self._recent[key] = (self.appended, next_state_seq)
+        self.appended += 1
+
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        pos = (self.head + self.count) % self.capacity
+        self.state_seq[pos] = state_seq
+        self.next_state_seq[pos] = next_state_seq
+        self.actions[pos] = action
+        self.rewards[pos] = reward
+        self.dones[pos] = done
+        self.masks[pos] = np.packbits(np.asarray(mask) != 0)
+        self.next_masks[pos] = np.packbits(np.asarray(next_mask) != 0)
+        self.count += 1
+
+    def sample(self, batch_size):
+        """
+        Uniformly sample batch_size distinct transitions. Returns float32
+        (states, actions, rewards, next_states, dones, masks, next_masks).
+        """
+        offsets = self._rng.choice(self.count, size=batch_size, replace=False)
+        pos = (self.head + offsets) % self.capacity
+        unpack = lambda packed: np.unpackbits(packed, axis=1, count=self.action_size).astype(np.float32)
+        return (
+            self.obs[self.state_seq[pos] % self.obs_capacity].astype(np.float32),
+            self.actions[pos].astype(np.int32),
+            self.rewards[pos],
+            self.obs[self.next_state_seq[pos] % self.obs_capacity].astype(np.float32),
+            self.dones[pos].astype(np.float32),
+            unpack(self.masks[pos]),
+            unpack(self.next_masks[pos]),
+        )
@@ -0,0 +1,147 @@
+import heapq
+import time
+
+import numpy as np
+
+# Dijkstra from every source only beats the vectorized Floyd-Warshall once the
+# graph is both large and sparse; below these the numpy kernel always wins.
+SPARSE_MIN_NODES = 400
+SPARSE_MAX_DENSITY = 0.02  # edges / n^2
+
+
+def floyd_warshall(dist):
+    """
+    All-pairs shortest paths on a dense (n, n) matrix of direct edge
+    lengths, with np.inf for missing edges and 0 on the diagonal.
+
+    Each k-relaxation is a single broadcast np.minimum, so the work is
+    O(n^3) inside numpy rather than in the interpreter. Produces exactly
+    the same values as the classic triple loop.
+    """
+    dist = np.array(dist, dtype=np.float64)
+    for k in range(dist.shape[0]):
+        np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+    return dist
+
+
+def dijkstra_all_pairs(dist):
+    """All-pairs shortest paths by running a heap Dijkstra from every node"""
+    dist = np.asarray(dist, dtype=np.float64)
+    n = dist.shape[0]
+
+    off_diagonal = np.isfinite(dist) & ~np.eye(n, dtype=bool)
+    neighbors = []
+    for i in range(n):
+        cols = np.nonzero(off_diagonal[i])[0]
+        neighbors.append(list(zip(cols.tolist(), dist[i, cols].tolist())))
+
+    result = np.full((n, n), np.inf)
+    for source in range(n):
+        best = [float('inf')] * n
+        best[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > best[u]:
+                continue
+            for v, w in neighbors[u]:
+                nd = d + w
+                if nd < best[v]:
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        result[source] = best
+    return result
+
+
+def choose_method(dist):
+    """Pick 'dijkstra' for large sparse graphs, 'floyd_warshall' otherwise"""
+    n = dist.shape[0]
+    if n < SPARSE_MIN_NODES:
+        return "floyd_warshall"
+    edges = np.count_nonzero(np.isfinite(dist)) - n
+    return "dijkstra" if edges <= SPARSE_MAX_DENSITY * n * n else "floyd_warshall"
+
+
+def shortest_path_matrix(dist, method="auto"):
+    """
+    Turn a matrix of direct edge lengths into the all-pairs shortest
+    path matrix. method is 'auto', 'floyd_warshall' or 'dijkstra'.
+    """
+    dist = np.asarray(dist, dtype=np.float64)
+    if method == "auto":
+        method = choose_method(dist)
+    if method == "floyd_warshall":
+        return floyd_warshall(dist)
+    if method == "dijkstra":
+        return dijkstra_all_pairs(dist)
+    raise ValueError(f"Unknown shortest path method: {method}")
+
+
+def direct_edge_matrix(n, starts, ends, lengths):
+    """
+    Dense (n, n) matrix of undirected direct edges, keeping the shortest
+    of any parallel routes. starts/ends are location indices.
+    """
+    dist = np.full((n, n), np.inf)
+    np.fill_diagonal(dist, 0)
+    if len(lengths):
+        starts = np.asarray(starts, dtype=np.intp)
+        ends = np.asarray(ends, dtype=np.intp)
+        lengths = np.asarray(lengths, dtype=np.float64)
+        np.minimum.at(dist, (starts, ends), lengths)
+        np.minimum.at(dist, (ends, starts), lengths)
+    return dist
+
+
+# ========================= BENCHMARK =========================
+
+def _reference_floyd_warshall(dist):
+    """The original pure-Python triple loop, kept for the benchmark"""
+    dist = np.array(dist, dtype=np.float64)
+    n = dist.shape[0]
+    for k in range(n):
+        for i in range(n):
+            for j in range(n):
+                dist[i][j] = min(dist[i][j], dist[i][k] + dist[k][j])
+    return dist
+
+
+def _random_network(n, rng):
+    """Chain-plus-shortcuts graph shaped like m.generate_random_scenario"""
+    starts, ends, lengths = [], [], []
+    for i in range(n):
+        for j in range(i + 1, min(i + 4, n)):
+            if rng.random() < 0.7 or j == i + 1:
+                starts.append(i)
+                ends.append(j)
+                lengths.append(rng.uniform(5, 50))
+    return direct_edge_matrix(n, starts, ends, lengths)
+
+
+def benchmark(sizes=(20, 50, 100, 200), reference_max_n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        direct = _random_network(n, rng)
+
+        start = time.perf_counter()
+        fw = floyd_warshall(direct)
+        fw_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        dj = dijkstra_all_pairs(direct)
+        dj_ms = (time.perf_counter() - start) * 1000
+
+        line = (f"n={n:<5} floyd_warshall={fw_ms:9.2f} ms  dijkstra={dj_ms:9.2f} ms  "
+                f"auto={choose_method(direct):<14} dijkstra_max_abs_diff={np.max(np.abs(fw - dj)):.2e}")
+
+        if n <= reference_max_n:
+            start = time.perf_counter()
+            ref = _reference_floyd_warshall(direct)
+            ref_ms = (time.perf_counter() - start) * 1000
+            line += f"  triple_loop={ref_ms:9.2f} ms  identical={np.array_equal(fw, ref)}"
+        print(line)
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark(sizes=(400, 800, 1600), reference_max_n=0)
@@ -126,21 +126,28 @@ logging.basicConfig(
 print = lambda *args, **kwargs: logging.info(" ".join(map(str, args)))
 
 
-def run_with_json(scenario_data, model_path="logistics_model_v3.weights.h5"):
+def run_with_json(scenario_data, model_path="logistics_model_v3.weights.h5", registry=None, engine="dqn", **options):
     """
     Run the logistics optimizer with a JSON dict (not a file).
+
+    If a ModelRegistry is given, the resident model is reused instead of
+    loading the weights file again. engine and options (beam_width,
+    beam_depth) are passed on to LogisticsOptimizer.optimize_routes.
     """
     print("data:", scenario_data)
     try:
-        print(f"Loading model from '{model_path}'...")
-        optimizer = LogisticsOptimizer(model_path=model_path)
+        if registry is not None:
+            optimizer = registry.get_optimizer(model_path)
+        else:
+            print(f"Loading model from '{model_path}'...")
+            optimizer = LogisticsOptimizer(model_path=model_path)
     except Exception as e:
         logging.error(f"Could not load model weights from '{model_path}'. Error: {e}")
         return {"error": str(e)}
 
     # Run optimization
     print("Running optimization...")
-    result = optimizer.optimize_routes(scenario_data)
+    result = optimizer.optimize_routes(scenario_data, engine=engine, **options)
 
     # Pretty print results
     try:
@@ -151,6 +158,31 @@ def run_with_json(scenario_data, model_path="logistics_model_v3.weights.h5"):
     return result
 
 
+def stream_with_json(scenario_data, model_path="logistics_model_v3.weights.h5", registry=None, engine="dqn", **options):
+    """
+    Streaming variant of run_with_json: yields the events of
+    LogisticsOptimizer.optimize_routes_stream (one per plan step, then the
+    final result). Loading or solving failures end the stream with an
+    {"type": "error"} event instead of an exception.
+    """
+    try:
+        if registry is not None:
+            optimizer = registry.get_optimizer(model_path)
+        else:
+            optimizer = LogisticsOptimizer(model_path=model_path)
+    except Exception as e:
+        logging.error(f"Could not load model weights from '{model_path}'. Error: {e}")
+        yield {"type": "error", "error": str(e)}
+        return
+
+    try:
+        yield from optimizer.optimize_routes_stream(scenario_data, engine=engine, **options)
+    except Exception as e:
+        # The response is already streaming, so the failure can only be reported in-band
+        logging.exception(f"Streaming solve failed: {e}")
+        yield {"type": "error", "error": str(e)}
+
+
 if __name__ == "__main__":
     # Example usage if running standalone
     import json
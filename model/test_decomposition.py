@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+from decomposition import Decomposer
+from inference import LogisticsOptimizer
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logistics_model_v3.weights.h5")
+
+
+@pytest.fixture(scope="module")
+def optimizer():
+    return LogisticsOptimizer(MODEL_PATH)
+
+
+def random_scenario(seed, locations=30, packages=30, vehicles=2):
+    rng = np.random.default_rng(seed)
+    points = rng.random((locations, 2)) * 100
+    return {
+        "format": "compact-v1",
+        "locations": [f"L{i}" for i in range(locations)],
+        "distance_matrix": np.linalg.norm(points[:, None] - points[None], axis=2),
+        "metric": True,
+        "packages": {"id": list(range(packages)), "pickup": rng.integers(0, locations, packages).tolist(),
+                     "delivery": rng.integers(0, locations, packages).tolist(),
+                     "weight": rng.integers(1, 20, packages).tolist()},
+        "vehicles": {"id": list(range(vehicles)), "capacity": [60] * vehicles,
+                     "location": rng.integers(0, locations, vehicles).tolist()},
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_heuristic_over_30_locations_is_not_worse_than_decomposed(optimizer, seed):
+    scenario = random_scenario(seed)
+    whole = optimizer.optimize_routes(scenario, engine="heuristic")
+    decomposed = Decomposer(optimizer, optimizer.env.max_locations, workers=1).solve(scenario, "heuristic")
+
+    assert whole["engine"] == "heuristic"
+    assert whole["metrics"]["packages_delivered"] >= decomposed["metrics"]["packages_delivered"]
+    if whole["metrics"]["packages_delivered"] == decomposed["metrics"]["packages_delivered"]:
+        assert whole["metrics"]["total_cost"] <= decomposed["metrics"]["total_cost"] + 1e-6
+
+
+def test_policy_engines_decompose_beyond_their_locations(optimizer):
+    result = optimizer.optimize_routes(random_scenario(0), engine="dqn")
+
+    assert result["engine"] == "decomposed"
+    assert result["metrics"]["total_packages"] == 30
@@ -0,0 +1,106 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from exact import HeldKarpSolver
+from heuristic import PDPSolver
+
+EPS = 1e-6
+
+
+def brute_force(dist, pickup, delivery, weight, start, capacity, close, speed, ready):
+    """Shortest route over every order of the servable packages' events, or inf"""
+    served = [p for p in range(len(pickup)) if weight[p] <= capacity and close[p] >= ready]
+    best = np.inf
+    for order in itertools.permutations([2 * p + d for p in served for d in (0, 1)]):
+        picked, load, loc, total = set(), 0.0, start, 0.0
+        for e in order:
+            p = e >> 1
+            if e & 1:
+                if p not in picked:
+                    break
+                load -= weight[p]
+                nxt = delivery[p]
+            else:
+                picked.add(p)
+                load += weight[p]
+                nxt = pickup[p]
+            total += dist[loc, nxt]
+            loc = nxt
+            if load > capacity + 1e-9 or (not e & 1 and ready + total / speed > close[p] + 1e-9):
+                break
+        else:
+            best = min(best, total)
+    return best
+
+
+def random_instance(seed, packages=3, capacity="binding", preload=False, windows=False):
+    rng = np.random.default_rng(seed)
+    points = rng.random((6, 2)) * 10
+    weight = rng.integers(1, 6, packages).astype(float)
+    instance = {
+        "dist": np.linalg.norm(points[:, None] - points[None], axis=2),
+        "pickup": rng.integers(0, 6, packages),
+        "delivery": rng.integers(0, 6, packages),
+        "weight": weight,
+        "start": 0,
+        # Binding: every package fits, but not all of them at once
+        "capacity": weight.max() + (weight.sum() - weight.max()) / 2 if capacity == "binding" else weight.sum(),
+        "close": np.full(packages, np.inf),
+        "speed": 1.5,
+        "ready": 2.0,
+    }
+    if preload:
+        # Packages starting at the vehicle, two of them sharing a pickup and delivery
+        instance["pickup"][:2] = 0
+        instance["delivery"][1] = instance["delivery"][0]
+    if windows:
+        # Some windows close before the vehicle leaves, others while it drives
+        instance["close"] = rng.uniform(0.0, 20.0, packages)
+    return instance
+
+
+def check_against_brute_force(instance):
+    exact = HeldKarpSolver(instance["dist"], instance["pickup"], instance["delivery"], instance["weight"],
+                           instance["start"], instance["capacity"], close=instance["close"],
+                           speed=instance["speed"], ready=instance["ready"], time_limit=10.0)
+    route = exact.solve()
+    optimum = brute_force(**instance)
+
+    if not np.isfinite(optimum):
+        assert route is None and exact.reason == "no feasible route"
+        return
+    heuristic = PDPSolver(instance["dist"], instance["pickup"], instance["delivery"], instance["weight"],
+                          np.ones(len(instance["pickup"])), [instance["start"]], [instance["capacity"]], [1.0],
+                          servable=exact.servable, close=instance["close"],
+                          veh_speed=[instance["speed"]], veh_ready=[instance["ready"]])
+    heuristic.solve()
+
+    assert route is not None, exact.reason
+    assert sorted(route) == sorted(2 * p + d for p in np.flatnonzero(exact.servable) for d in (0, 1))
+    assert heuristic.feasible(0, route)
+    assert heuristic.route_distance(0, route) == pytest.approx(optimum, abs=EPS)
+    if not heuristic.unassigned:
+        assert heuristic.route_distance(0, route) <= heuristic.route_distance(0, heuristic.routes[0]) + EPS
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_capacity_binding_matches_brute_force(seed):
+    check_against_brute_force(random_instance(seed, capacity="binding"))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_preloaded_and_merged_jobs_match_brute_force(seed):
+    instance = random_instance(seed, capacity="loose", preload=True)
+    exact = HeldKarpSolver(instance["dist"], instance["pickup"], instance["delivery"], instance["weight"],
+                           instance["start"], instance["capacity"])
+
+    assert exact.preloaded and exact.num_events < 2 * len(instance["pickup"])
+    check_against_brute_force(instance)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("capacity", ["binding", "loose"])
+def test_closed_windows_match_brute_force(seed, capacity):
+    check_against_brute_force(random_instance(seed, capacity=capacity, preload=capacity == "loose", windows=True))
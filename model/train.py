@@ -7,6 +7,8 @@ import matplotlib.pyplot as plt
 from dataclasses import dataclass
 import os
 
+from shortest_path import shortest_path_matrix
+
 # --- NEW: Data Class for a Route ---
 
 @dataclass
@@ -94,8 +96,8 @@ class LogisticsEnvironment:
 
     def _create_distance_matrix(self):
         """
-        Creates an all-pairs shortest path distance matrix using the
-        Floyd-Warshall algorithm from the defined routes. This allows finding
+        Creates an all-pairs shortest path distance matrix from the defined
+        routes via shortest_path.shortest_path_matrix. This allows finding
         the distance between any two locations in the network.
         """
         num_locs = self.num_locations
@@ -110,13 +112,8 @@ class LogisticsEnvironment:
                 dist_matrix[idx1, idx2] = route.distance
                 dist_matrix[idx2, idx1] = route.distance # Assume routes are bidirectional
 
-        # Floyd-Warshall algorithm to find all-pairs shortest paths
-        for k in range(num_locs):
-            for i in range(num_locs):
-                for j in range(num_locs):
-                    dist_matrix[i, j] = min(dist_matrix[i, j], dist_matrix[i, k] + dist_matrix[k, j])
-        
-        self.distance_matrix = dist_matrix
+        # All-pairs shortest paths (vectorized Floyd-Warshall or sparse Dijkstra)
+        self.distance_matrix = shortest_path_matrix(dist_matrix)
         if np.any(np.isinf(self.distance_matrix)):
             print("Warning: The route network graph is not fully connected.")
 
@@ -241,62 +238,95 @@ class LogisticsEnvironment:
 
         return self._get_state(), reward, done, {}
 
-# --- Prioritized Experience Replay Buffer (UNCHANGED) ---
+# --- Prioritized Experience Replay Buffer ---
 class SumTree:
+    """
+    Array-backed sum tree over leaf priorities. Batches of prefix sums are
+    resolved with one level-by-level descent and batched priority updates
+    recompute parents level by level, all in NumPy.
+    """
     def __init__(self, capacity):
         self.capacity = capacity
         self.tree = np.zeros(2 * capacity - 1)
-        self.data = np.zeros(capacity, dtype=object)
         self.n_entries = 0
         self.write = 0
-    def _propagate(self, idx, change):
-        parent = (idx - 1) // 2
-        self.tree[parent] += change
-        if parent != 0: self._propagate(parent, change)
-    def _retrieve(self, idx, s):
-        left, right = 2 * idx + 1, 2 * idx + 2
-        if left >= len(self.tree): return idx
-        return self._retrieve(left, s) if s <= self.tree[left] else self._retrieve(right, s - self.tree[left])
     def total(self): return self.tree[0]
-    def add(self, p, data):
-        idx = self.write + self.capacity - 1
-        self.data[self.write] = data
-        self.update(idx, p)
+    def add(self, p):
+        """Set the priority of the next ring slot and return that slot"""
+        slot = self.write
+        self.update(slot + self.capacity - 1, p)
         self.write = (self.write + 1) % self.capacity
         if self.n_entries < self.capacity: self.n_entries += 1
-    def update(self, idx, p):
-        change = p - self.tree[idx]
-        self.tree[idx] = p
-        self._propagate(idx, change)
+        return slot
+    def update_batch(self, idxs, priorities):
+        idxs = np.asarray(idxs, dtype=np.int64)
+        self.tree[idxs] = priorities
+        # Parents are recomputed from both children, so duplicate indices and
+        # leaves at different depths need no special handling
+        nodes = (idxs[idxs > 0] - 1) // 2
+        while len(nodes):
+            self.tree[nodes] = self.tree[2 * nodes + 1] + self.tree[2 * nodes + 2]
+            nodes = (nodes[nodes > 0] - 1) // 2
+    def update(self, idx, p): self.update_batch([idx], [p])
+    def get_batch(self, s):
+        """Tree indices, priorities and data slots for an array of prefix sums"""
+        s = np.array(s, dtype=np.float64)
+        idxs = np.zeros(len(s), dtype=np.int64)
+        while True:
+            internal = idxs < self.capacity - 1
+            if not internal.any(): break
+            # Leaves (which can sit one level apart) stay where they are
+            left = np.where(internal, 2 * idxs + 1, idxs)
+            left_sum = self.tree[left]
+            go_right = internal & (s > left_sum)
+            s -= np.where(go_right, left_sum, 0)
+            idxs = left + go_right
+        return idxs, self.tree[idxs], idxs - self.capacity + 1
     def get(self, s):
-        idx = self._retrieve(0, s)
-        return idx, self.tree[idx], self.data[idx - self.capacity + 1]
+        idxs, priorities, slots = self.get_batch([s])
+        return idxs[0], priorities[0], slots[0]
 
 class PrioritizedReplayBuffer:
+    """
+    Prioritized replay with transitions kept in preallocated typed arrays
+    (allocated on the first add, once the state shape is known).
+    sample() returns (states, actions, rewards, next_states, dones) arrays.
+    """
     def __init__(self, capacity, alpha=0.6, beta=0.4, beta_increment_per_sampling=0.001):
         self.tree, self.alpha, self.beta, self.beta_increment = SumTree(capacity), alpha, beta, beta_increment_per_sampling
         self.epsilon, self.max_priority = 0.01, 1.0
-    def add(self, experience): self.tree.add(self.max_priority, experience)
+        self.states = None
+    def _allocate(self, state_shape):
+        capacity = self.tree.capacity
+        self.states = np.zeros((capacity,) + state_shape, dtype=np.float32)
+        self.next_states = np.zeros((capacity,) + state_shape, dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int32)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.dones = np.zeros(capacity, dtype=bool)
+    def add(self, experience):
+        state, action, reward, next_state, done = experience
+        if self.states is None: self._allocate(np.shape(state))
+        slot = self.tree.add(self.max_priority)
+        self.states[slot], self.actions[slot], self.rewards[slot] = state, action, reward
+        self.next_states[slot], self.dones[slot] = next_state, done
     def sample(self, n):
-        batch, idxs, priorities = [], [], []
         segment = self.tree.total() / n
         self.beta = np.min([1., self.beta + self.beta_increment])
-        for i in range(n):
-            s = random.uniform(segment * i, segment * (i + 1))
-            idx, p, data = self.tree.get(s)
-            priorities.append(p); batch.append(data); idxs.append(idx)
+        s = (np.arange(n) + np.random.random(n)) * segment
+        idxs, priorities, slots = self.tree.get_batch(s)
         probs = priorities / self.tree.total()
         is_weight = np.power(self.tree.n_entries * probs, -self.beta)
         is_weight /= is_weight.max()
+        batch = (self.states[slots], self.actions[slots], self.rewards[slots],
+                 self.next_states[slots], self.dones[slots])
         return batch, idxs, is_weight
     def update(self, idxs, errors):
-        for i, idx in enumerate(idxs):
-            p = (np.abs(errors[i]) + self.epsilon) ** self.alpha
-            self.tree.update(idx, p)
-            self.max_priority = max(self.max_priority, p)
+        p = (np.abs(np.asarray(errors)) + self.epsilon) ** self.alpha
+        self.tree.update_batch(idxs, p)
+        self.max_priority = max(self.max_priority, p.max())
     def __len__(self): return self.tree.n_entries
 
-# --- The DQN Agent (UNCHANGED) ---
+# --- The DQN Agent ---
 
 class DQNAgent:
     def __init__(self, state_size, action_size):
@@ -309,6 +339,10 @@ class DQNAgent:
         self.q_network = self._build_model()
         self.target_network = self._build_model()
         self.update_target_network()
+        # Direct graph-compiled forward passes; Keras predict() has a large fixed cost per call
+        states_spec = tf.TensorSpec([None, self.state_size], tf.float32)
+        self._q_forward = tf.function(lambda x: self.q_network(x, training=False), input_signature=[states_spec])
+        self._target_forward = tf.function(lambda x: self.target_network(x, training=False), input_signature=[states_spec])
 
     def _build_model(self):
         input_layer = keras.layers.Input(shape=(self.state_size,))
@@ -334,26 +368,24 @@ class DQNAgent:
     def act(self, state):
         if np.random.rand() <= self.epsilon:
             return random.randrange(self.action_size)
-        return np.argmax(self.q_network.predict(state.reshape(1, -1), verbose=0)[0])
+        return np.argmax(self._q_forward(state.reshape(1, -1).astype(np.float32)).numpy()[0])
 
     def replay(self):
         if len(self.memory) < self.batch_size: return
-        minibatch, idxs, is_weights = self.memory.sample(self.batch_size)
-        states = np.array([e[0] for e in minibatch], dtype=np.float32)
-        actions, rewards = np.array([e[1] for e in minibatch]), np.array([e[2] for e in minibatch])
-        next_states, dones = np.array([e[3] for e in minibatch], dtype=np.float32), np.array([e[4] for e in minibatch])
-        q_values_current = self.q_network.predict(states, verbose=0)
-        q_values_next_target = self.target_network.predict(next_states, verbose=0)
-        q_values_next_main = self.q_network.predict(next_states, verbose=0)
-        errors = np.zeros(self.batch_size)
-        for i in range(self.batch_size):
-            old_q, target = q_values_current[i][actions[i]], rewards[i]
-            if not dones[i]:
-                best_action = np.argmax(q_values_next_main[i])
-                target += self.gamma * q_values_next_target[i][best_action]
-            q_values_current[i][actions[i]], errors[i] = target, old_q - target
+        (states, actions, rewards, next_states, dones), idxs, is_weights = self.memory.sample(self.batch_size)
+        rows = np.arange(self.batch_size)
+        # One fused pass of the online network over current and next states
+        q_values_both = self._q_forward(np.concatenate([states, next_states])).numpy()
+        q_values_current, q_values_next_main = q_values_both[:self.batch_size], q_values_both[self.batch_size:]
+        q_values_next_target = self._target_forward(next_states).numpy()
+        # Double DQN targets and TD errors for the whole batch
+        best_actions = np.argmax(q_values_next_main, axis=1)
+        bootstrap = self.gamma * q_values_next_target[rows, best_actions]
+        targets = np.where(dones, rewards, rewards + bootstrap)
+        errors = q_values_current[rows, actions] - targets
+        q_values_current[rows, actions] = targets
         self.memory.update(idxs, errors)
-        self.q_network.fit(states, q_values_current, batch_size=self.batch_size, epochs=1, verbose=0, sample_weight=is_weights)
+        self.q_network.train_on_batch(states, q_values_current, sample_weight=is_weights)
         if self.epsilon > self.epsilon_min: self.epsilon *= self.epsilon_decay
 
     def save_model(self, file_path):
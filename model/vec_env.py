@@ -0,0 +1,79 @@
+import numpy as np
+
+from inference import ImprovedLogisticsEnvironment
+
+
+class VecLogisticsEnvironment:
+    """
+    N independent ImprovedLogisticsEnvironment instances stepped together.
+
+    reset/step/get_valid_actions_mask return stacked arrays so an agent can
+    pick actions for every environment with one forward pass. Episodes that
+    finish (or hit max_steps) are reset immediately with a fresh scenario
+    from scenario_fn; the final state and mask are returned in the info
+    dict of that environment as "terminal_state" / "terminal_mask".
+    """
+
+    def __init__(self, num_envs, scenario_fn, max_steps=1000, **env_kwargs):
+        self.num_envs = num_envs
+        self.scenario_fn = scenario_fn
+        self.max_steps = max_steps
+        self.envs = [ImprovedLogisticsEnvironment(**env_kwargs) for _ in range(num_envs)]
+
+        self.state_size = self.envs[0].state_size
+        self.action_space_size = self.envs[0].action_space_size
+
+        self.states = np.zeros((num_envs, self.state_size), dtype=np.float32)
+        self.episode_steps = np.zeros(num_envs, dtype=np.int64)
+        self.episode_rewards = np.zeros(num_envs, dtype=np.float64)
+
+    def _reset_env(self, i):
+        locations, routes, packages, vehicles = self.scenario_fn()
+        self.states[i] = self.envs[i].load_scenario(locations, routes, packages, vehicles)
+        self.episode_steps[i] = 0
+        self.episode_rewards[i] = 0.0
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self._reset_env(i)
+        return self.states.copy()
+
+    def get_valid_actions_mask(self):
+        return np.stack([env.get_valid_actions_mask() for env in self.envs])
+
+    def step(self, actions):
+        """
+        Step every environment with its action.
+
+        Returns (states, rewards, dones, infos). dones is True for both
+        terminated and truncated episodes; infos[i]["truncated"] tells them
+        apart.
+        """
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = [{} for _ in range(self.num_envs)]
+
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            next_state, reward, done, _ = env.step(int(action))
+            self.states[i] = next_state
+            rewards[i] = reward
+            self.episode_steps[i] += 1
+            self.episode_rewards[i] += reward
+
+            truncated = not done and self.episode_steps[i] >= self.max_steps
+            if done or truncated:
+                dones[i] = True
+                infos[i] = {
+                    "terminal_state": next_state,
+                    "terminal_mask": env.get_valid_actions_mask(),
+                    "truncated": truncated,
+                    "episode_reward": self.episode_rewards[i],
+                    "episode_steps": int(self.episode_steps[i]),
+                    "packages_delivered": env.packages_delivered,
+                    "total_packages": len(env.packages),
+                    "completion_time": env.current_time,
+                    "total_distance": env.total_distance,
+                }
+                self._reset_env(i)
+
+        return self.states.copy(), rewards, dones, infos
@@ -0,0 +1 @@
+"""Code shared by the backend and the model service (install with `pip install -e shared`)"""
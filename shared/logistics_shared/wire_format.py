@@ -0,0 +1,127 @@
+"""
+Compact, index-based scenario format shared by the backend and the model service.
+
+A compact scenario is a dict:
+
+    {
+        "format": "compact-v1",
+        "locations": ["Depot", "Stop 1", ...],           # N names
+        "distance_matrix": (N, N) float32 array (km),     # NaN/inf: no direct route
+        "metric": True,                                   # matrix already holds shortest paths
+        "packages": {"id": [...], "pickup": [...], "delivery": [...],   # location indices
+                     "weight": [...], "priority": [...]},
+        "vehicles": {"id": [...], "capacity": [...], "location": [...],
+                     "speed": [...], "cost_per_km": [...]},
+    }
+
+Packages and vehicles are columns rather than lists of dicts, and
+locations are referenced by index, so nothing scales with N^2 except the
+one matrix array. On the wire it travels either as JSON (lists) or as an
+.npz archive (encode_npz / decode_npz) with the arrays stored as-is and
+the location names in a small JSON header.
+"""
+import io
+import json
+
+import numpy as np
+
+COMPACT_FORMAT = "compact-v1"
+NPZ_MIMETYPE = "application/x-scenario-npz"
+
+PACKAGE_COLUMNS = {
+    "id": np.int64,
+    "pickup": np.int32,
+    "delivery": np.int32,
+    "weight": np.float64,
+    "priority": np.int32,
+}
+VEHICLE_COLUMNS = {
+    "id": np.int64,
+    "capacity": np.float64,
+    "location": np.int32,
+    "speed": np.float64,
+    "cost_per_km": np.float64,
+}
+PACKAGE_DEFAULTS = {"priority": 1}
+VEHICLE_DEFAULTS = {"speed": 1.0, "cost_per_km": 1.0}
+
+
+def is_compact(scenario):
+    return isinstance(scenario, dict) and scenario.get("format") == COMPACT_FORMAT
+
+
+def _columns(table, spec, defaults):
+    table = table or {}
+    size = len(table.get("id", []))
+    columns = {}
+    for name, dtype in spec.items():
+        if name in table:
+            columns[name] = np.asarray(table[name], dtype=dtype).reshape(size)
+        elif name in defaults:
+            columns[name] = np.full(size, defaults[name], dtype=dtype)
+        else:
+            raise ValueError(f"Compact scenario column '{name}' is missing")
+    return columns
+
+
+def normalize(scenario):
+    """Validate a compact scenario (JSON lists or arrays) and coerce every column to its array dtype"""
+    if not is_compact(scenario):
+        raise ValueError(f"Not a {COMPACT_FORMAT} scenario")
+    locations = [str(name) for name in scenario["locations"]]
+    n = len(locations)
+    matrix = np.array(
+        [[np.nan if d is None else d for d in row] for row in scenario["distance_matrix"]]
+        if isinstance(scenario["distance_matrix"], list) else scenario["distance_matrix"],
+        dtype=np.float32,
+    ).reshape(n, n)
+    packages = _columns(scenario.get("packages"), PACKAGE_COLUMNS, PACKAGE_DEFAULTS)
+    vehicles = _columns(scenario.get("vehicles"), VEHICLE_COLUMNS, VEHICLE_DEFAULTS)
+    for label, column in (("package pickup", packages["pickup"]), ("package delivery", packages["delivery"]),
+                          ("vehicle location", vehicles["location"])):
+        if column.size and (column.min() < 0 or column.max() >= n):
+            raise ValueError(f"{label} index out of range for {n} locations")
+    return {
+        "format": COMPACT_FORMAT,
+        "locations": locations,
+        "distance_matrix": matrix,
+        "metric": bool(scenario.get("metric", False)),
+        "packages": packages,
+        "vehicles": vehicles,
+    }
+
+
+def to_json(scenario):
+    """JSON-serializable form of a compact scenario (NaN distances become None)"""
+    scenario = normalize(scenario)
+    matrix = scenario["distance_matrix"].astype(np.float64)
+    return {
+        "format": COMPACT_FORMAT,
+        "locations": scenario["locations"],
+        "distance_matrix": [[None if not np.isfinite(d) else d for d in row] for row in matrix.tolist()],
+        "metric": scenario["metric"],
+        "packages": {k: v.tolist() for k, v in scenario["packages"].items()},
+        "vehicles": {k: v.tolist() for k, v in scenario["vehicles"].items()},
+    }
+
+
+def encode_npz(scenario):
+    scenario = normalize(scenario)
+    header = {"format": COMPACT_FORMAT, "locations": scenario["locations"], "metric": scenario["metric"]}
+    arrays = {"header": np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+              "distance_matrix": scenario["distance_matrix"]}
+    arrays.update({f"package_{k}": v for k, v in scenario["packages"].items()})
+    arrays.update({f"vehicle_{k}": v for k, v in scenario["vehicles"].items()})
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_npz(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+        header = json.loads(archive["header"].tobytes().decode("utf-8"))
+        scenario = dict(header)
+        scenario["distance_matrix"] = archive["distance_matrix"]
+        scenario["packages"] = {k: archive[f"package_{k}"] for k in PACKAGE_COLUMNS if f"package_{k}" in archive}
+        scenario["vehicles"] = {k: archive[f"vehicle_{k}"] for k in VEHICLE_COLUMNS if f"vehicle_{k}" in archive}
+    return normalize(scenario)